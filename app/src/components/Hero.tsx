@@ -13,24 +13,35 @@ import Document from './Document';
 import {visuallyHidden} from '@mui/utils';
 import {Paper, Table, TableBody, TableCell, TableContainer, TableRow} from "@mui/material";
 
+// Number of results per page, the server returns at most 100
+const PAGE_SIZE = 10;
+// Largest offset the server accepts
+const MAX_OFFSET = 1000;
+
 export default function Hero() {
     const [query, setQuery] = useState("");
     const [matchingDocs, setMatchingDocs] = useState([]);
     const [rankedTfIdf, setRankedTfIdf] = useState([]);
     const [rankedBm25, setRankedBm25] = useState([]);
+    const [totalMatches, setTotalMatches] = useState(0);
+    const [offset, setOffset] = useState(0);
 
-    const handleSearch = async () => {
+    const fetchPage = async (pageOffset: number) => {
         const response = await fetch("http://127.0.0.1:5000/search", {
             method: "POST",
             headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ query }),
+            body: JSON.stringify({ query, offset: pageOffset, limit: PAGE_SIZE }),
         });
         const data = await response.json();
         setMatchingDocs(data.matching_docs);
         setRankedTfIdf(data.ranked_tf_idf);
         setRankedBm25(data.ranked_bm25);
+        setTotalMatches(data.total_matches);
+        setOffset(pageOffset);
     };
 
+    const handleSearch = () => fetchPage(0);
+
 
     return (
         <Box
@@ -165,6 +176,27 @@ export default function Hero() {
                         <Typography variant="h6" align="center" sx={{ marginBottom: 2 }}>
                             Matching Documents
                         </Typography>
+                        <Stack direction="row" spacing={2} sx={{ justifyContent: 'center', alignItems: 'center', marginBottom: 2 }}>
+                            <Button
+                                size="small"
+                                disabled={offset === 0}
+                                onClick={() => fetchPage(Math.max(0, offset - PAGE_SIZE))}
+                            >
+                                Previous
+                            </Button>
+                            <Typography variant="body2" color="text.secondary">
+                                {totalMatches === 0
+                                    ? "No matches"
+                                    : `${offset + 1}-${Math.min(offset + PAGE_SIZE, totalMatches)} of ${totalMatches}`}
+                            </Typography>
+                            <Button
+                                size="small"
+                                disabled={offset + PAGE_SIZE >= totalMatches || offset + PAGE_SIZE > MAX_OFFSET}
+                                onClick={() => fetchPage(offset + PAGE_SIZE)}
+                            >
+                                Next
+                            </Button>
+                        </Stack>
                         <TableContainer>
                             <Table>
                                 <TableBody>
@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from collections import Counter
+
+from searchengine import (SCORING_BACKENDS, Analyzer, IndexReader, LRUCache, Searcher, build_inverted_index,
+                          compute_max_scores, open_binary_index, write_binary_index)
+from searchengine.matrix import build_matrix_index, save_matrix_index
+
+QUERY_MIXES = ("boolean", "free_text", "rare_terms")
+
+
+class TermAnalyzer(Analyzer):
+    """
+    Analyzer of the generated queries, made of index terms that are already stemmed: they are
+    only tokenized, stemming them again would turn many of them into terms missing from the index.
+    """
+    name = "terms"
+
+    def __init__(self):
+        super().__init__(stop_words=())
+
+    def stem(self, token):
+        return token
+
+
+def load_vocabulary(processed_data_file):
+    """
+    Collect the term statistics of the processed data that synthetic corpora are drawn from.
+    :return: Dictionary with the term counts, description lengths and feature lists.
+    """
+    with open(processed_data_file, "r") as f:
+        processed_data = json.load(f)
+    term_counts = Counter(term for hotel in processed_data for term in hotel["description"])
+    return {
+        "term_counts": term_counts,
+        "description_lengths": [len(hotel["description"]) for hotel in processed_data],
+        "features": [feature for hotel in processed_data for feature in hotel["features"]],
+        "features_per_hotel": [len(hotel["features"]) for hotel in processed_data]
+    }
+
+
+def generate_corpus(vocabulary, num_docs, seed=0):
+    """
+    Generate processed hotels with the term distribution, description lengths and features of
+    the real data, so that postings lengths follow the same skew.
+    :param vocabulary: Output of load_vocabulary.
+    :param num_docs: Number of hotels.
+    :param seed: Random seed, the same seed gives the same corpus.
+    :return: Tuple (processed hotels, raw documents with only a name).
+    """
+    rng = random.Random(seed)
+    terms = list(vocabulary["term_counts"])
+    weights = list(vocabulary["term_counts"].values())
+    processed_data = []
+    for _ in range(num_docs):
+        length = rng.choice(vocabulary["description_lengths"])
+        features = [rng.choice(vocabulary["features"]) for _ in range(rng.choice(vocabulary["features_per_hotel"]))]
+        processed_data.append({"description": rng.choices(terms, weights, k=length), "features": features})
+    documents = [{"basic_data": {"name": f"Hotel {doc_id}"}} for doc_id in range(num_docs)]
+    return processed_data, documents
+
+
+def generate_queries(inverted_index, mix, count, seed=0):
+    """
+    Generate a query mix over the terms of an index.
+        boolean:    AND/OR/NOT combinations and phrases of common and mid-frequency terms
+        free_text:  long queries of 8 to 15 terms, mostly frequent ones
+        rare_terms: 1 to 3 terms found in a handful of documents
+    :return: List of query strings of index terms, to be analyzed with a TermAnalyzer.
+    """
+    rng = random.Random(seed)
+    terms = sorted(inverted_index.terms(), key=inverted_index.document_frequency, reverse=True)
+    common = terms[:max(1, len(terms) // 20)]
+    middle = terms[len(terms) // 20:len(terms) // 2] or common
+    rare = terms[-max(1, len(terms) // 4):]
+    queries = []
+    for _ in range(count):
+        if mix == "boolean":
+            a, b, c, d = rng.choice(common), rng.choice(middle), rng.choice(middle), rng.choice(common)
+            queries.append(rng.choice([f"{a} AND ({b} OR {c}) NOT {d}",
+                                       f'"{a} {b}" OR {c}',
+                                       f"({a} OR {d}) AND {b}",
+                                       f"{a} {b} NOT {c}"]))
+        elif mix == "free_text":
+            queries.append(" ".join(rng.choice(common if rng.random() < 0.7 else middle)
+                                    for _ in range(rng.randint(8, 15))))
+        elif mix == "rare_terms":
+            queries.append(" OR ".join(rng.choice(rare) for _ in range(rng.randint(1, 3))))
+        else:
+            raise ValueError(f"Unknown query mix: {mix}")
+    return queries
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def measure_queries(searcher, queries, k, scoring_backend, warmup=10):
+    """
+    Time the full pipeline of every query, parsing, Boolean matching and both rankings.
+    :return: Dictionary of latency percentiles in milliseconds and sequential throughput.
+    """
+    for query in queries[:warmup]:
+        searcher.search(query, k, scoring_backend=scoring_backend)
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        searcher.search(query, k, scoring_backend=scoring_backend)
+        latencies.append(time.perf_counter() - query_start)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "qps": len(queries) / elapsed if elapsed else 0.0
+    }
+
+
+def benchmark_corpus(vocabulary, num_docs, num_queries, k, backends, seed, work_dir):
+    """
+    Build an index over a synthetic corpus and measure it.
+    :return: Dictionary with the build times, index sizes and query results by backend and mix.
+    """
+    processed_data, documents = generate_corpus(vocabulary, num_docs, seed)
+    result = {"docs": num_docs, "build": {}, "size_bytes": {}, "queries": {}}
+
+    start = time.perf_counter()
+    inverted_index = build_inverted_index(processed_data)
+    result["build"]["index_s"] = time.perf_counter() - start
+    start = time.perf_counter()
+    inverted_index.max_scores = compute_max_scores(inverted_index)
+    result["build"]["max_scores_s"] = time.perf_counter() - start
+
+    binary_file = os.path.join(work_dir, f"index_{num_docs}.bin")
+    start = time.perf_counter()
+    write_binary_index(inverted_index, binary_file)
+    result["build"]["binary_write_s"] = time.perf_counter() - start
+    result["size_bytes"]["binary"] = os.path.getsize(binary_file)
+    result["vocabulary_size"] = len(inverted_index)
+
+    matrix_index = None
+    if "matrix" in backends:
+        try:
+            start = time.perf_counter()
+            matrix_index = build_matrix_index(inverted_index)
+            result["build"]["matrix_s"] = time.perf_counter() - start
+            matrix_file = os.path.join(work_dir, f"index_{num_docs}.npz")
+            save_matrix_index(matrix_index, matrix_file)
+            result["size_bytes"]["matrix"] = os.path.getsize(matrix_file)
+        except ImportError as e:
+            print(f"Skipping the matrix backend: {e}")
+            backends = [backend for backend in backends if backend != "matrix"]
+
+    # Results are not cached, every query is computed
+    reader = IndexReader(open_binary_index(binary_file), documents, matrix_index)
+    searcher = Searcher(reader, TermAnalyzer(), result_cache=LRUCache(maxsize=0))
+    try:
+        for backend in backends:
+            result["queries"][backend] = {
+                mix: measure_queries(searcher, generate_queries(inverted_index, mix, num_queries, seed), k, backend)
+                for mix in QUERY_MIXES
+            }
+    finally:
+        reader.close()
+    return result
+
+
+def print_report(results):
+    for corpus in results["corpora"]:
+        print(f"\n{corpus['docs']} documents, {corpus['vocabulary_size']} terms, "
+              f"binary index {corpus['size_bytes']['binary'] / 1024:.0f} KiB")
+        print("  build: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in corpus["build"].items()))
+        for backend, mixes in corpus["queries"].items():
+            for mix, stats in mixes.items():
+                print(f"  {backend:<8} {mix:<10} p50 {stats['p50_ms']:8.2f}ms  p95 {stats['p95_ms']:8.2f}ms  "
+                      f"p99 {stats['p99_ms']:8.2f}ms  {stats['qps']:8.1f} qps")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark index build and query latency on synthetic corpora")
+    parser.add_argument("--docs", type=int, nargs="+", default=[1000, 10000], help="Corpus sizes")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries per mix")
+    parser.add_argument("--k", type=int, default=10, help="Number of ranked documents per query")
+    parser.add_argument("--backends", nargs="+", default=list(SCORING_BACKENDS), choices=SCORING_BACKENDS)
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the corpora and queries")
+    parser.add_argument("--processed-data", default="processed_hotel_data.json", help="Source of the vocabulary")
+    parser.add_argument("--output", help="JSON file to write the results to, for regression tracking")
+    args = parser.parse_args()
+
+    vocabulary = load_vocabulary(args.processed_data)
+    results = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "settings": {"queries": args.queries, "k": args.k, "seed": args.seed},
+        "corpora": []
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_docs in args.docs:
+            results["corpora"].append(benchmark_corpus(vocabulary, num_docs, args.queries, args.k,
+                                                       args.backends, args.seed, work_dir))
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+from httpx import AsyncClient, Response, TransportError
+
+# Statuses worth retrying: blocked, throttled or temporarily failing requests
+RETRY_STATUSES = (403, 429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Token bucket allowing rate requests per second on average and bursts of capacity requests"""
+
+    def __init__(self, rate: float, capacity: float = 1.0, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it"""
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self.lock:
+            while True:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await self.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Token bucket per host, so that a crawl over several sites is throttled per site"""
+
+    def __init__(self, rate: float, capacity: float = 1.0, **bucket_options):
+        self.rate = rate
+        self.capacity = capacity
+        self.bucket_options = bucket_options
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    async def acquire(self, url: str) -> None:
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.capacity, **self.bucket_options)
+        await self.buckets[host].acquire()
+
+
+class Page(NamedTuple):
+    """Outcome of fetching a URL: its data, or None when unchanged since the last crawl, and its validators"""
+    url: str
+    data: Optional[Dict]
+    changed: bool
+    etag: Optional[str]
+    last_modified: Optional[str]
+    hash: str
+
+    def validators(self) -> Dict:
+        return {"etag": self.etag, "last_modified": self.last_modified, "hash": self.hash}
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+class CrawlState:
+    """
+    JSON file of the validators of every crawled URL: ETag and Last-Modified headers for
+    conditional requests, and a hash of the content to detect pages served again unchanged.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def save(self, state: Dict[str, Dict]) -> None:
+        # Written to a temporary file first, a crash never leaves a partial state
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class Checkpoint:
+    """
+    Append-only JSONL file of the finished URLs, one record per line with the fields of their Page.
+    Every record is flushed as soon as its URL is done, so a crash loses at most the URLs in flight
+    and a restarted crawl skips the URLs already in the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Dict[str, Dict]:
+        """
+        Read the records of the finished URLs. A last line cut by a crash is truncated, so that the
+        records appended next start on a line of their own.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+        end = 0  # End of the last complete record
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if line.endswith(b"\n"):
+                    records[record["url"]] = record
+                    end = f.tell()
+        if end < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        return records
+
+    def append(self, page: Page) -> None:
+        with open(self.path, "a") as f:
+            f.write(json.dumps(page._asdict()) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class CrawlError(Exception):
+    """Raised when a URL still fails after the maximum number of retries"""
+
+
+class Crawler:
+    """
+    Fetch and parse pages concurrently: at most concurrency requests are in flight, each host is
+    rate limited by a token bucket, blocked or failing requests are retried with exponential
+    backoff up to max_retries times, and finished pages are checkpointed as they complete. Given
+    the validators of a previous crawl, requests are conditional and pages whose content did not
+    change are not parsed.
+    """
+
+    def __init__(self, client: AsyncClient, parse: Callable[[Response], Dict], concurrency: int = 4,
+                 rate: float = 1.0, burst: float = 1.0, max_retries: int = 5, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, checkpoint: Optional[Checkpoint] = None,
+                 state: Optional[Dict[str, Dict]] = None, sleep: Callable[[float], Awaitable] = asyncio.sleep):
+        """
+        :param client: HTTP client, pointed at a local stub server in tests.
+        :param parse: Function extracting the data of a successful response.
+        :param concurrency: Maximum number of requests in flight.
+        :param rate: Requests per second allowed per host.
+        :param burst: Number of requests a host may receive at once after being idle.
+        :param max_retries: Number of retries of a URL before giving up on it.
+        :param backoff_base: Delay before the first retry in seconds, doubled at every retry.
+        :param backoff_max: Maximum delay between two retries in seconds.
+        :param checkpoint: Optional checkpoint recording the finished URLs.
+        :param state: Optional validators of the URLs from a previous crawl, see CrawlState.
+        :param sleep: Coroutine function used to wait, replaced to run tests without delays.
+        """
+        self.client = client
+        self.parse = parse
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rate, burst, sleep=sleep)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.checkpoint = checkpoint
+        self.state = state or {}
+        self.sleep = sleep
+        self.stats = {"fetched": 0, "unchanged": 0, "retries": 0, "failed": 0, "skipped": 0}
+
+    def backoff(self, attempt: int, response: Optional[Response] = None) -> float:
+        """Delay before a retry: the Retry-After of the server if any, else exponential with full jitter"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        previous = self.state.get(url, {})
+        headers = {}
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+        return headers
+
+    def page(self, url: str, response: Response) -> Page:
+        """Build the Page of a response, parsing it only if its content changed"""
+        previous = self.state.get(url, {})
+        if response.status_code == 304:
+            # Not modified, the previous validators still hold
+            return Page(url, None, False, previous.get("etag"), previous.get("last_modified"), previous.get("hash"))
+        digest = content_hash(response.content)
+        etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+        if digest == previous.get("hash"):
+            return Page(url, None, False, etag, last_modified, digest)
+        return Page(url, self.parse(response), True, etag, last_modified, digest)
+
+    async def fetch(self, url: str) -> Dict:
+        """Fetch and parse a URL, retrying blocked and failed requests"""
+        return (await self.fetch_page(url)).data
+
+    async def fetch_page(self, url: str) -> Page:
+        """Fetch a URL, with a conditional request if it was crawled before, retrying blocked and failed requests"""
+        headers = self.conditional_headers(url)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                async with self.semaphore:
+                    # The host token is taken with a slot held, right before the request: tokens taken
+                    # while waiting for a slot would let the queued requests leave back-to-back
+                    await self.limiter.acquire(url)
+                    response = await self.client.get(url, headers=headers)
+            except TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code == 200 or (response.status_code == 304 and url in self.state):
+                    return self.page(url, response)
+                error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRY_STATUSES:
+                    break
+            if attempt < self.max_retries:
+                self.stats["retries"] += 1
+                print(f"Request to {url} failed ({error}), retrying...")
+                await self.sleep(self.backoff(attempt, response))
+        raise CrawlError(f"{url}: {error}")
+
+    async def crawl_one(self, url: str) -> Optional[Page]:
+        try:
+            page = await self.fetch_page(url)
+        except CrawlError as e:
+            self.stats["failed"] += 1
+            print(f"Giving up on {e}")
+            return None
+        if self.checkpoint is not None:
+            self.checkpoint.append(page)
+        self.stats["fetched" if page.changed else "unchanged"] += 1
+        return page
+
+    async def crawl(self, urls: Iterable[str]) -> Dict[str, Page]:
+        """
+        Crawl URLs, skipping the ones already in the checkpoint. Checkpointed pages found unchanged
+        are only kept for the URLs of the state given, whose previous data they refer to.
+        :return: Page of every finished URL, from this crawl or the checkpoint, by URL.
+        """
+        results = {}
+        if self.checkpoint is not None:
+            results = {url: Page(**record) for url, record in self.checkpoint.load().items()
+                       if record["changed"] or url in self.state}
+        pending = [url for url in dict.fromkeys(urls) if url not in results]
+        self.stats["skipped"] += len(results)
+        for url, page in zip(pending, await asyncio.gather(*(self.crawl_one(url) for url in pending))):
+            if page is not None:
+                results[url] = page
+        return results
+
+
+async def crawl_urls(client: AsyncClient, urls: List[str], parse: Callable[[Response], Dict],
+                     **crawler_options) -> List[Dict]:
+    """Crawl URLs and return the data of the finished ones in the order of the URLs"""
+    results = await Crawler(client, parse, **crawler_options).crawl(urls)
+    return [results[url].data for url in dict.fromkeys(urls) if url in results]
+
+
+def write_change_feed(path: str, changes: List[Dict]) -> None:
+    """
+    Write the changes of a crawl as JSONL, one {"op", "url", "key", "data"} record per line where op
+    is "added", "updated" or "removed", for downstream stages to apply incrementally.
+    """
+    with open(path + ".tmp", "w") as f:
+        for change in changes:
+            f.write(json.dumps(change) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def read_change_feed(path: str) -> List[Dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,19 @@
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "127.0.0.1:5000")
+
+# One process per core for the CPU-bound scoring, a few threads per process to overlap I/O;
+# the scoring executor of each process bounds the number of concurrent searches
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("WEB_THREADS", 8))
+worker_class = "gthread"
+
+# The app is loaded in every worker rather than before forking: the index watcher thread does
+# not survive a fork, and the memory-mapped index is shared between workers by the page cache
+preload_app = False
+
+# Longer than REQUEST_TIMEOUT, so that slow searches get a 503 from the app before the worker is killed
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
@@ -1,11 +1,15 @@
 from typing import List, Dict, Optional
+import argparse
 import asyncio
 import json
-import random
-import time
+import os
+import sys
 from httpx import AsyncClient, Response
 from parsel import Selector
 
+from crawler import Checkpoint, Crawler, CrawlState, crawl_urls, write_change_feed
+from searchengine import document_key
+
 client = AsyncClient(
     headers={
         "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
@@ -36,38 +40,103 @@ def parse_hotel_page(result: Response) -> Dict:
 
 
 async def scrape_hotel(url: str) -> Dict:
-    """Scrape hotel data and reviews"""
-    first_page = await client.get(url)
-    if first_page.status_code == 403:
-        print("Request blocked, retrying...")
-        await asyncio.sleep(random.uniform(5, 10))  # Sleep to avoid blocking
-        return await scrape_hotel(url)  # Retry the request
-    hotel_data = parse_hotel_page(first_page)
-    print(f"Scraped one hotel data.")
-    return hotel_data
-
-
-async def scrape_hotels(urls: List[str]) -> List[Dict]:
-    """Scrape data for multiple hotels"""
-    all_hotel_data = []
-    for url in urls:
-        hotel_data = await scrape_hotel(url)
-        all_hotel_data.append(hotel_data)
-    return all_hotel_data
+    """Scrape hotel data, retrying blocked requests with backoff"""
+    return await Crawler(client, parse_hotel_page).fetch(url)
+
+
+async def scrape_hotels(urls: List[str], checkpoint: Optional[Checkpoint] = None, **crawler_options) -> List[Dict]:
+    """Scrape data for multiple hotels concurrently, skipping the ones already in the checkpoint"""
+    return await crawl_urls(client, urls, parse_hotel_page, checkpoint=checkpoint, **crawler_options)
+
+
+async def recrawl_hotels(urls: List[str], previous_hotels: List[Dict], state: Dict[str, Dict],
+                         checkpoint: Optional[Checkpoint] = None, **crawler_options):
+    """
+    Scrape hotels again, with conditional requests for the pages of the previous crawl and without
+    parsing the pages whose content did not change.
+    :param urls: Hotel page URLs.
+    :param previous_hotels: Hotel data of the previous crawl.
+    :param state: Validators and document key of every URL of the previous crawl, see CrawlState.
+    :return: Tuple (hotel data, change feed records, new state).
+    """
+    previous_by_key = {document_key(hotel): hotel for hotel in previous_hotels}
+    # Pages whose previous data is gone are fetched and parsed again
+    known = {url: page_state for url, page_state in state.items() if page_state.get("key") in previous_by_key}
+    pages = await Crawler(client, parse_hotel_page, checkpoint=checkpoint, state=known, **crawler_options).crawl(urls)
+
+    hotels, changes, new_state = [], [], {}
+    for url in dict.fromkeys(urls):
+        page = pages.get(url)
+        if page is None:
+            # Failed this time, keep the previous version
+            if url in known:
+                hotels.append(previous_by_key[known[url]["key"]])
+                new_state[url] = known[url]
+            continue
+        if not page.changed:
+            key = known[url]["key"]
+            hotels.append(previous_by_key[key])
+        else:
+            key = document_key(page.data)
+            hotels.append(page.data)
+            previous_key = state.get(url, {}).get("key")
+            if previous_key is not None and previous_key != key:
+                changes.append({"op": "removed", "url": url, "key": previous_key, "data": None})
+            op = "updated" if url in state else "added"
+            changes.append({"op": op, "url": url, "key": key, "data": page.data})
+        new_state[url] = {**page.validators(), "key": key}
+
+    for url in state.keys() - new_state.keys() - set(urls):
+        changes.append({"op": "removed", "url": url, "key": state[url].get("key"), "data": None})
+    return hotels, changes, new_state
 
 
 async def main():
+    parser = argparse.ArgumentParser(description="Scrape the hotel pages listed in the hotel links file")
+    parser.add_argument("--links", default="hotel_links.json", help="JSON list of hotel page URLs")
+    parser.add_argument("--output", default="hotel_data.json", help="Output hotel data file")
+    parser.add_argument("--checkpoint", default="hotel_data.checkpoint.jsonl",
+                        help="JSONL file of the scraped hotels, a restarted scrape skips them")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of requests in flight")
+    parser.add_argument("--rate", type=float, default=1.0, help="Requests per second per host")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries of a page before giving up on it")
+    parser.add_argument("--state", default="crawl_state.json",
+                        help="Validators and content hashes of the pages, for conditional re-crawls")
+    parser.add_argument("--changes", default="hotel_changes.jsonl",
+                        help="Change feed of the added, updated and removed hotels, see update_index.py")
+    parser.add_argument("--full", action="store_true", help="Fetch and parse every page again")
+    args = parser.parse_args()
+
     # Read list of urls from hotels_links.json
-    with open("hotel_links.json", "r") as f:
+    with open(args.links, "r") as f:
         hotel_urls = json.load(f)
 
-    hotel_data = await scrape_hotels(hotel_urls)
+    crawl_state = CrawlState(args.state)
+    previous_hotels, state = [], {}
+    if not args.full and os.path.exists(args.output):
+        with open(args.output, "r") as f:
+            previous_hotels = json.load(f)
+        state = crawl_state.load()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    hotel_data, changes, new_state = await recrawl_hotels(hotel_urls, previous_hotels, state, checkpoint,
+                                                          concurrency=args.concurrency, rate=args.rate,
+                                                          max_retries=args.max_retries)
+    counts = {op: sum(change["op"] == op for change in changes) for op in ("added", "updated", "removed")}
+    print(f"Scraped {len(hotel_data)} of {len(hotel_urls)} hotels: " + ", ".join(f"{n} {op}" for op, n in counts.items()))
 
     # Create and save data in JSON
-    with open("hotel_data.json", "w") as f:
+    with open(args.output + ".tmp", "w") as f:
         json.dump(hotel_data, f, indent=2)
+    os.replace(args.output + ".tmp", args.output)
+    write_change_feed(args.changes, changes)
+    crawl_state.save(new_state)
+    # The crawl is complete, the next one starts over
+    if os.path.exists(checkpoint.path):
+        os.remove(checkpoint.path)
 
 
 if __name__ == "__main__":
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     asyncio.run(main())
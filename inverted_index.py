@@ -1,51 +1,63 @@
-import json
-from collections import defaultdict
-
-def build_inverted_index(processed_data):
-    """
-    Build an inverted index from the processed data.
-    :param processed_data: List of processed hotel data.
-    :return: Inverted index as a dictionary.
-    """
-    inverted_index = defaultdict(list)  # Term-to-docID mapping
-
-    for doc_id, hotel in enumerate(processed_data):
-        # Combine terms from description and features
-        terms = hotel.get("description", [])
-        for feature_list in hotel.get("features", []):
-            terms.extend(feature_list)
-
-        # Add terms to the inverted index
-        for term in set(terms):  # Use set to avoid duplicates
-            inverted_index[term].append(doc_id)
-
-    # Convert defaultdict to a regular dict
-    return dict(inverted_index)
-
-def save_inverted_index(index, output_file):
-    """
-    Save the inverted index to a JSON file.
-    :param index: Inverted index dictionary.
-    :param output_file: File path to save the index.
-    """
-    with open(output_file, "w") as f:
-        json.dump(index, f, indent=2)
+import argparse
+import os
 
-def main():
-    # Input processed data file
-    processed_data_file = "processed_hotel_data.json"
-    output_index_file = "inverted_index.json"
+from searchengine import (build_external_index, build_inverted_index, compute_max_scores, save_inverted_index,
+                          write_binary_index)
+from searchengine.matrix import build_matrix_index, save_matrix_index
+from preprocessing import read_hotels
 
-    # Load the processed data
-    with open(processed_data_file, "r") as f:
-        processed_data = json.load(f)
 
-    # Build the inverted index
-    inverted_index = build_inverted_index(processed_data)
+def main():
+    parser = argparse.ArgumentParser(description="Build the inverted index of the processed hotels")
+    parser.add_argument("input", nargs="?", default="processed_hotel_data.json",
+                        help="Processed hotels, JSON array or the .jsonl output of the streaming pipeline")
+    parser.add_argument("--external", action="store_true",
+                        help="Build only the binary index, with bounded memory, for corpora larger than RAM")
+    parser.add_argument("--memory-mb", type=int, default=256, help="Memory budget of the external build in MiB")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes of the external build")
+    parser.add_argument("--work-dir", help="Directory of the temporary files of the external build")
+    args = parser.parse_args()
+
+    # Input processed data file: JSONL is streamed, a JSON array is loaded whole
+    processed_data_file = args.input
+    output_index_file = "inverted_index.json"
+    output_binary_index_file = "inverted_index.bin"
+    output_matrix_file = "inverted_index.npz"
+
+    if args.external:
+        if not processed_data_file.endswith(".jsonl"):
+            print(f"{processed_data_file} is a JSON array and is loaded whole: pass the .jsonl output of "
+                  f"preprocessing.py to build with bounded memory")
+        # The JSON index and the scoring matrices need the whole index in memory, they are not built
+        stats = build_external_index(read_hotels(processed_data_file), output_binary_index_file,
+                                     args.memory_mb * 1024 * 1024, args.workers, work_dir=args.work_dir)
+        print(f"Binary index of {stats['total_docs']} documents saved to {output_binary_index_file}")
+        # Scoring matrices of a previous build would no longer match the index
+        if os.path.exists(output_matrix_file):
+            os.remove(output_matrix_file)
+            print(f"Removed the outdated {output_matrix_file}, the matrix backend builds it from the index")
+        return
+
+    # Build the inverted index, streaming the processed data when it is in JSONL
+    inverted_index = build_inverted_index(read_hotels(processed_data_file))
+
+    # Precompute the per-term score upper bounds used for dynamic pruning
+    inverted_index.max_scores = compute_max_scores(inverted_index)
 
     # Save the inverted index
     save_inverted_index(inverted_index, output_index_file)
     print(f"Inverted index saved to {output_index_file}")
 
+    # Save the compact binary index served by server.py
+    write_binary_index(inverted_index, output_binary_index_file)
+    print(f"Binary index saved to {output_binary_index_file}")
+
+    # Save the precomputed scoring matrices of the matrix backend, when numpy and scipy are installed
+    try:
+        save_matrix_index(build_matrix_index(inverted_index), output_matrix_file)
+        print(f"Scoring matrices saved to {output_matrix_file}")
+    except ImportError as e:
+        print(f"Skipping scoring matrices: {e}")
+
 if __name__ == "__main__":
     main()
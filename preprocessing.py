@@ -1,58 +1,86 @@
+import argparse
 import json
-import re
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
-
-# Initialize stemmer and stopwords
-stemmer = PorterStemmer()
-stop_words = set(stopwords.words('english'))
-
-def preprocess_text(text):
-    """Preprocess text: tokenize, remove stopwords, and stem words"""
-    if text is None:
-        return []
-    tokens = word_tokenize(text.lower())  # Tokenize and convert to lowercase
-    tokens = [re.sub(r'\W+', '', token) for token in tokens if token.isalpha()]  # Remove non-alphabetic characters
-    tokens = [word for word in tokens if word not in stop_words]  # Remove stopwords
-    tokens = [stemmer.stem(word) for word in tokens]  # Apply stemming
-    return tokens
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from searchengine import preprocess_hotel
 
 def preprocess_json(input_file, output_file):
     """Process hotel data and save the cleaned data to a new JSON file"""
     with open(input_file, 'r') as f:
         hotel_data = json.load(f)
 
-    processed_data = []
-    for hotel in hotel_data:
-        basic_data = hotel.get("basic_data", {})
-        description = hotel.get("description", "")
-        features = hotel.get("features", [])
-
-        # Preprocess description and features
-        processed_description = preprocess_text(description)
-        processed_features = [preprocess_text(feature) for feature in features]
-
-        # Organize processed data
-        processed_data.append({
-            "name": basic_data.get("name"),
-            "rating": basic_data.get("aggregateRating", {}).get("ratingValue"),
-            "reviewCount": basic_data.get("aggregateRating", {}).get("reviewCount"),
-            "address": basic_data.get("address", {}).get("streetAddress"),
-            "country": basic_data.get("address", {}).get("addressCountry", {}).get("name"),
-            "description": processed_description,
-            "features": processed_features,
-            "image": basic_data.get("image")
-        })
+    processed_data = [preprocess_hotel(hotel) for hotel in hotel_data]
 
     # Save the processed data to a new JSON file
     with open(output_file, 'w') as f:
         json.dump(processed_data, f, indent=2)
 
+def read_hotels(input_file):
+    """
+    Read hotels one at a time. JSONL files are streamed line by line, JSON arrays are loaded whole.
+    :param input_file: Path to a .jsonl file or a JSON array.
+    :return: Generator of hotel data.
+    """
+    with open(input_file, 'r') as f:
+        if not input_file.endswith(".jsonl"):
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def preprocess_chunk(hotels):
+    """
+    Preprocess a chunk of hotels in a worker process.
+    :return: The processed hotels, serialized as JSON lines to spare the parent process.
+    """
+    return "".join(json.dumps(preprocess_hotel(hotel)) + "\n" for hotel in hotels)
+
+def preprocess_jsonl(input_file, output_file, workers=None, chunk_size=64):
+    """
+    Preprocess hotels in parallel with bounded memory. Hotels are streamed from the input,
+    sent to a process pool in chunks and written to the JSONL output in input order. At most
+    two chunks per worker are in flight, so memory does not grow with the size of the crawl.
+    :param input_file: Path to the raw hotels, JSONL or JSON array.
+    :param output_file: Path of the processed hotels, one JSON object per line.
+    :param workers: Number of worker processes, the number of CPUs by default.
+    :param chunk_size: Number of hotels sent to a worker at once.
+    :return: Number of processed hotels.
+    """
+    workers = workers or os.cpu_count() or 1
+    hotels = read_hotels(input_file)
+    count = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(output_file, 'w') as f:
+        pending = deque()
+        while True:
+            # Keep the pool busy, then write the oldest chunk as soon as it is done
+            while len(pending) < 2 * workers:
+                chunk = list(islice(hotels, chunk_size))
+                if not chunk:
+                    break
+                pending.append((len(chunk), executor.submit(preprocess_chunk, chunk)))
+            if not pending:
+                break
+            chunk_length, future = pending.popleft()
+            f.write(future.result())
+            count += chunk_length
+    return count
+
 if __name__ == "__main__":
-    # Input and output file paths
-    input_json = "hotel_data.json"
-    output_json = "processed_hotel_data.json"
+    parser = argparse.ArgumentParser(description="Preprocess scraped hotel data for indexing")
+    parser.add_argument("input", nargs="?", default="hotel_data.json", help="Raw hotels, JSON array or JSONL")
+    parser.add_argument("output", nargs="?", default="processed_hotel_data.json",
+                        help="Processed hotels; a .jsonl output is written by the parallel streaming pipeline")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Number of hotels per worker task")
+    args = parser.parse_args()
 
-    preprocess_json(input_json, output_json)
-    print(f"Processed data saved to {output_json}")
+    if args.output.endswith(".jsonl"):
+        count = preprocess_jsonl(args.input, args.output, args.workers, args.chunk_size)
+        print(f"Processed {count} hotels")
+    else:
+        preprocess_json(args.input, args.output)
+    print(f"Processed data saved to {args.output}")
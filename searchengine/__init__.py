@@ -0,0 +1,25 @@
+"""
+Search engine core shared by the Flask server, the command line query tool,
+the evaluator and the ground truth builder.
+"""
+from .analysis import Analyzer, default_analyzer, preprocess_query, preprocess_text
+from .binary_index import BinaryIndex, BinaryIndexWriter, open_binary_index, write_binary_index
+from .boolean_query import BooleanExecutor, QuerySyntaxError, expand_terms, parse_boolean_query, query_terms
+from .cache import CachedIndex, LRUCache
+from .documents import SUMMARY_FIELDS, DocumentStore, document_key, preprocess_hotel, summarize_document
+from .encoding import Encoded, encode, load_file
+from .fuzzy import FuzzyMatcher
+from .index import InvertedIndex, build_inverted_index, load_inverted_index, save_inverted_index
+from .matrix import MatrixIndex, build_matrix_index, load_matrix_index, save_matrix_index
+from .metrics import MetricsRegistry, Trace, count, current_trace, stage, tracing
+from .profiler import SamplingProfiler
+from .proximity import proximity_score, rerank_by_proximity
+from .scoring import (SCORERS, BM25Scorer, CollectionStats, ScoringEngine, TfIdfScorer, compute_max_scores,
+                      register_scorer)
+from .searcher import RANKING_FUNCTIONS, SCORING_BACKENDS, IndexReader, Searcher, open_index
+from .segments import IndexWriter, SegmentedIndex, TieredMergePolicy, open_segmented_index
+from .serving import BoundedExecutor, Saturated, Timeout
+from .sharding import LocalShardCluster, ShardedSearcher, ShardError, build_shards, open_shard
+from .snapshots import Snapshot, SnapshotManager
+from .spimi import build_external_index
+from .suggest import SuggestionIndex
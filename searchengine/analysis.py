@@ -0,0 +1,71 @@
+import hashlib
+import re
+
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer
+
+from .cache import LRUCache
+
+# Runs of letters, lowercased before matching: digits, punctuation and underscores split words
+WORD_PATTERN = re.compile(r"[^\W\d_]+")
+
+
+class Analyzer:
+    """
+    Text analysis shared by indexing and querying: lowercasing, regex tokenization into runs of
+    letters, stopword removal and Porter stemming. Stems are memoized in a bounded LRU cache
+    since vocabularies are highly repetitive and stemming is the costliest step.
+
+    The fingerprint identifies the analysis: it is stored with the processed data and the index,
+    and a Searcher refuses an index built with a different analysis than its queries.
+    """
+    name = "regex-porter"
+    version = 1
+
+    def __init__(self, stop_words=None, stem_cache_size=65536):
+        """
+        :param stop_words: Collection of lowercase stopwords, the NLTK English list by default.
+        :param stem_cache_size: Maximum number of memoized stems.
+        """
+        self.stop_words = frozenset(stopwords.words('english') if stop_words is None else stop_words)
+        self.stemmer = PorterStemmer()
+        self.stem_cache = LRUCache(maxsize=stem_cache_size)
+        stop_words_digest = hashlib.sha1("\n".join(sorted(self.stop_words)).encode("utf-8")).hexdigest()
+        self.fingerprint = f"{self.name}-v{self.version}:{stop_words_digest[:12]}"
+
+    def tokenize(self, text):
+        return WORD_PATTERN.findall(text.lower())
+
+    def stem(self, token):
+        return self.stem_cache.get_or_compute(token, lambda: self.stemmer.stem(token))
+
+    def analyze(self, text):
+        """
+        Analyze a text into terms.
+        :param text: Raw text, None is analyzed as an empty text.
+        :return: List of terms.
+        """
+        if text is None:
+            return []
+        stop_words = self.stop_words
+        return [self.stem(token) for token in self.tokenize(text) if token not in stop_words]
+
+    __call__ = analyze
+
+
+# Analyzer of the processed data, the index and the queries
+default_analyzer = Analyzer()
+
+
+def preprocess_text(text):
+    """Preprocess text: tokenize, remove stopwords, and stem words"""
+    return default_analyzer.analyze(text)
+
+
+def preprocess_query(query):
+    """
+    Preprocess the user query to match processed data terms.
+    :param query: Raw query string.
+    :return: List of preprocessed query terms.
+    """
+    return default_analyzer.analyze(query)
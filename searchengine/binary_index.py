@@ -0,0 +1,391 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+
+# File layout (little-endian):
+#   header       magic, version, section offsets and lengths
+#   metadata     JSON object with corpus statistics, the analyzer fingerprint and the max score slots
+#   term offsets uint32[num_terms + 1] offsets into the term blob
+#   term blob    UTF-8 terms, sorted by their encoded bytes
+#   term entries one TERM_ENTRY record per term, same order as the terms
+#   doc lengths  uint32[total_docs]
+#   postings     per term: varint(doc_id delta), varint(term_frequency) for every posting
+#   positions    per posting: varint(position delta) for every occurrence
+MAGIC = b"UWIX"
+VERSION = 1
+HEADER = struct.Struct("<4sI6Q")
+TERM_ENTRY = struct.Struct("<IQIQI")
+# Size in bytes above which BinaryIndexWriter moves a section to a temporary file
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
+def encode_varint(value, out):
+    """
+    Append an unsigned integer to a bytearray as a LEB128 varint.
+    """
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(buffer, start, end):
+    """
+    Decode all the varints stored in buffer[start:end].
+    :return: List of integers.
+    """
+    values = []
+    data = bytes(buffer[start:end])
+    value = 0
+    shift = 0
+    for byte in data:
+        if byte < 0x80:
+            values.append(value | (byte << shift))
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+    return values
+
+
+def iter_varints(buffer, start, end):
+    """
+    Decode the varints stored in buffer[start:end] one at a time, without materializing them.
+    :return: Generator of integers.
+    """
+    value = 0
+    shift = 0
+    for i in range(start, end):
+        byte = buffer[i]
+        if byte < 0x80:
+            yield value | (byte << shift)
+            value = 0
+            shift = 0
+        else:
+            value |= (byte & 0x7F) << shift
+            shift += 7
+
+
+class BinaryIndexWriter:
+    """
+    Incremental writer of the binary format: terms are added one at a time with their already
+    encoded postings and positions, in the order of their UTF-8 bytes, and the sections are spooled
+    to temporary files once they outgrow spool_size so that writing a large index does not hold it
+    in memory.
+    """
+
+    def __init__(self, output_file, score_slots=(), spool_size=SPOOL_SIZE):
+        """
+        :param output_file: File path to save the index.
+        :param score_slots: Sorted names of the ranking functions with per-term max scores.
+        :param spool_size: Size in bytes above which a section is moved from memory to a temporary file.
+        """
+        self.output_file = output_file
+        self.score_slots = list(score_slots)
+        self.entry = struct.Struct(TERM_ENTRY.format + "d" * len(self.score_slots))
+        self.term_offsets = array("I", [0])
+        self.term_blob, self.term_entries, self.postings, self.positions = (
+            tempfile.SpooledTemporaryFile(max_size=spool_size) for _ in range(4))
+        self.postings_length = 0
+        self.positions_length = 0
+        self.last_term = None
+
+    def add_term(self, term, doc_count, postings_data, positions_data, max_scores=()):
+        """
+        Add the postings of a term.
+        :param term: UTF-8 bytes of the term, greater than those of the previous term.
+        :param doc_count: Number of postings.
+        :param postings_data: varint(doc_id delta), varint(term_frequency) of every posting.
+        :param positions_data: varint(position delta) of every occurrence, posting by posting.
+        :param max_scores: Max score of the term for each score slot.
+        """
+        if self.last_term is not None and term <= self.last_term:
+            raise ValueError(f"Terms must be added in increasing order: {term!r} after {self.last_term!r}")
+        self.last_term = term
+        self.term_blob.write(term)
+        self.term_offsets.append(self.term_offsets[-1] + len(term))
+        self.term_entries.write(self.entry.pack(doc_count, self.postings_length, len(postings_data),
+                                                self.positions_length, len(positions_data), *max_scores))
+        self.postings.write(postings_data)
+        self.positions.write(positions_data)
+        self.postings_length += len(postings_data)
+        self.positions_length += len(positions_data)
+
+    def finish(self, doc_lengths, stats, analyzer=None):
+        """
+        Write the index file.
+        :param doc_lengths: Document lengths, indexed by doc_id.
+        :param stats: Corpus statistics, as returned by InvertedIndex.stats.
+        :param analyzer: Fingerprint of the Analyzer of the terms.
+        """
+        metadata = json.dumps({
+            "stats": stats,
+            "analyzer": analyzer,
+            "max_score_slots": self.score_slots
+        }).encode("utf-8")
+        doc_lengths = array("I", doc_lengths)
+        num_terms = len(self.term_offsets) - 1
+
+        doc_lengths_offset = (HEADER.size + len(metadata) + self.term_offsets.itemsize * len(self.term_offsets) +
+                              self.term_offsets[-1] + self.entry.size * num_terms)
+        postings_offset = doc_lengths_offset + doc_lengths.itemsize * len(doc_lengths)
+        positions_offset = postings_offset + self.postings_length
+        end_offset = positions_offset + self.positions_length
+
+        # Write to a temporary file then rename it over the output: a running server keeps reading
+        # the file it memory-mapped, rewriting it in place would change the data under its feet
+        with open(self.output_file + ".tmp", "wb") as f:
+            # The offsets of metadata, term offsets, term blob and term entries are implied by the
+            # number of terms, so only the variable-sized sections are listed in the header
+            f.write(HEADER.pack(MAGIC, VERSION, len(metadata), num_terms,
+                                doc_lengths_offset, postings_offset, positions_offset, end_offset))
+            f.write(metadata)
+            f.write(self.term_offsets.tobytes())
+            self._copy(self.term_blob, f)
+            self._copy(self.term_entries, f)
+            f.write(doc_lengths.tobytes())
+            self._copy(self.postings, f)
+            self._copy(self.positions, f)
+        os.replace(self.output_file + ".tmp", self.output_file)
+
+    @staticmethod
+    def _copy(section, f):
+        section.seek(0)
+        shutil.copyfileobj(section, f)
+        section.close()
+
+
+def encode_postings(postings):
+    """
+    Encode a postings list in the binary format.
+    :param postings: List of (doc_id, term_frequency, positions) sorted by doc_id.
+    :return: Tuple (postings bytes, positions bytes).
+    """
+    postings_data = bytearray()
+    positions_data = bytearray()
+    previous_doc_id = 0
+    for doc_id, term_frequency, positions in postings:
+        encode_varint(doc_id - previous_doc_id, postings_data)
+        encode_varint(term_frequency, postings_data)
+        previous_doc_id = doc_id
+        previous_position = 0
+        for position in positions:
+            encode_varint(position - previous_position, positions_data)
+            previous_position = position
+    return postings_data, positions_data
+
+
+def write_binary_index(inverted_index, output_file):
+    """
+    Save an inverted index in the compact binary format read by BinaryIndex.
+    Postings are delta encoded and compressed with varints.
+    :param inverted_index: InvertedIndex instance.
+    :param output_file: File path to save the index.
+    """
+    terms = sorted(inverted_index.terms(), key=lambda term: term.encode("utf-8"))
+    score_slots = sorted(inverted_index.max_scores)
+    writer = BinaryIndexWriter(output_file, score_slots)
+    for term in terms:
+        postings = inverted_index.get_postings(term)
+        postings_data, positions_data = encode_postings(postings)
+        writer.add_term(term.encode("utf-8"), len(postings), postings_data, positions_data,
+                        [inverted_index.max_scores[slot].get(term, 0.0) for slot in score_slots])
+    writer.finish(inverted_index.doc_lengths, inverted_index.stats(), inverted_index.analyzer)
+
+
+class _MaxScoreSlot:
+    """
+    Read-only mapping term -> max score of one ranking function, backed by the term entries.
+    """
+
+    def __init__(self, index, slot):
+        self.index = index
+        self.slot = slot
+
+    def __contains__(self, term):
+        return self.index._find_term(term) >= 0
+
+    def __getitem__(self, term):
+        i = self.index._find_term(term)
+        if i < 0:
+            raise KeyError(term)
+        return self.index._term_entry(i)[5 + self.slot]
+
+    def get(self, term, default=None):
+        i = self.index._find_term(term)
+        return self.index._term_entry(i)[5 + self.slot] if i >= 0 else default
+
+
+class BinaryIndex:
+    """
+    Inverted index backed by a memory-mapped binary file written by write_binary_index.
+    Only the header and the fixed-size tables are touched at load time; the postings of a term
+    are decoded when it is looked up. Exposes the same interface as InvertedIndex.
+    """
+
+    def __init__(self, input_file):
+        self._file = open(input_file, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+
+        magic, version, metadata_length, num_terms, doc_lengths_offset, postings_offset, \
+            positions_offset, end_offset = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Unsupported index file: {input_file}")
+
+        metadata = json.loads(bytes(buffer[HEADER.size:HEADER.size + metadata_length]))
+        stats = metadata["stats"]
+        score_slots = metadata["max_score_slots"]
+
+        self._num_terms = num_terms
+        self._entry = struct.Struct(TERM_ENTRY.format + "d" * len(score_slots))
+        term_offsets_start = HEADER.size + metadata_length
+        term_blob_start = term_offsets_start + 4 * (num_terms + 1)
+        self._term_offsets = buffer[term_offsets_start:term_blob_start].cast("I")
+        term_entries_start = term_blob_start + self._term_offsets[num_terms]
+        self._term_blob = buffer[term_blob_start:term_entries_start]
+        self._term_entries = buffer[term_entries_start:doc_lengths_offset]
+        self._postings = buffer[postings_offset:positions_offset]
+        self._positions = buffer[positions_offset:end_offset]
+
+        self.doc_lengths = buffer[doc_lengths_offset:postings_offset].cast("I")
+        self.total_docs = stats["total_docs"]
+        self.total_terms = stats["total_terms"]
+        self.avg_doc_length = stats["avg_doc_length"]
+        self.analyzer = metadata.get("analyzer")
+        self.max_scores = {name: _MaxScoreSlot(self, slot) for slot, name in enumerate(score_slots)}
+
+    def close(self):
+        self._term_offsets.release()
+        self._term_blob.release()
+        self._term_entries.release()
+        self._postings.release()
+        self._positions.release()
+        self.doc_lengths.release()
+        self._mmap.close()
+        self._file.close()
+
+    def _term_at(self, i):
+        return bytes(self._term_blob[self._term_offsets[i]:self._term_offsets[i + 1]])
+
+    def _find_term(self, term):
+        """
+        Binary search of a term in the sorted term dictionary.
+        :return: Index of the term, -1 if it is not in the index.
+        """
+        key = term.encode("utf-8")
+        low, high = 0, self._num_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._num_terms and self._term_at(low) == key:
+            return low
+        return -1
+
+    def term_id(self, term):
+        """
+        Get the position of a term in the sorted term dictionary, -1 if it is not in the index.
+        """
+        return self._find_term(term)
+
+    def _term_entry(self, i):
+        return self._entry.unpack_from(self._term_entries, i * self._entry.size)
+
+    def __contains__(self, term):
+        return self._find_term(term) >= 0
+
+    def __len__(self):
+        return self._num_terms
+
+    def terms(self):
+        return [self._term_at(i).decode("utf-8") for i in range(self._num_terms)]
+
+    def _decode_doc_postings(self, entry):
+        """
+        Decode the document IDs and term frequencies of a term entry.
+        :return: Tuple (doc_ids, term_frequencies).
+        """
+        _, postings_start, postings_length = entry[:3]
+        values = decode_varints(self._postings, postings_start, postings_start + postings_length)
+        doc_ids = values[0::2]
+        for i in range(1, len(doc_ids)):
+            doc_ids[i] += doc_ids[i - 1]
+        return doc_ids, values[1::2]
+
+    def get_postings(self, term):
+        """
+        Decode the postings list of a term.
+        :param term: Preprocessed term.
+        :return: List of (doc_id, term_frequency, positions), empty if the term is unknown.
+        """
+        i = self._find_term(term)
+        if i < 0:
+            return []
+        entry = self._term_entry(i)
+        doc_ids, term_frequencies = self._decode_doc_postings(entry)
+        positions_start, positions_length = entry[3:5]
+        deltas = decode_varints(self._positions, positions_start, positions_start + positions_length)
+
+        postings = []
+        offset = 0
+        for doc_id, term_frequency in zip(doc_ids, term_frequencies):
+            positions = deltas[offset:offset + term_frequency]
+            for j in range(1, term_frequency):
+                positions[j] += positions[j - 1]
+            postings.append((doc_id, term_frequency, positions))
+            offset += term_frequency
+        return postings
+
+    def get_doc_ids(self, term):
+        """
+        Decode the sorted document IDs containing a term, without their positions.
+        :param term: Preprocessed term.
+        :return: Sorted list of document IDs.
+        """
+        i = self._find_term(term)
+        if i < 0:
+            return []
+        return self._decode_doc_postings(self._term_entry(i))[0]
+
+    def document_frequency(self, term):
+        i = self._find_term(term)
+        return self._term_entry(i)[0] if i >= 0 else 0
+
+    def term_frequency(self, term, doc_id):
+        i = self._find_term(term)
+        if i < 0:
+            return 0
+        doc_ids, term_frequencies = self._decode_doc_postings(self._term_entry(i))
+        j = bisect_left(doc_ids, doc_id)
+        if j < len(doc_ids) and doc_ids[j] == doc_id:
+            return term_frequencies[j]
+        return 0
+
+    def doc_length(self, doc_id):
+        return self.doc_lengths[doc_id]
+
+    def stats(self):
+        return {
+            "total_docs": self.total_docs,
+            "total_terms": self.total_terms,
+            "avg_doc_length": self.avg_doc_length,
+            "vocabulary_size": self._num_terms
+        }
+
+
+def open_binary_index(input_file):
+    """
+    Open a binary index file written by write_binary_index.
+    :param input_file: File path of the index.
+    :return: BinaryIndex instance.
+    """
+    return BinaryIndex(input_file)
@@ -0,0 +1,499 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from .cache import LRUCache
+from .index import FIELD_POSITION_GAP
+from .proximity import term_positions
+
+# Query AST nodes
+Term = namedtuple("Term", ["term"])
+Phrase = namedtuple("Phrase", ["terms"])
+And = namedtuple("And", ["children"])
+Or = namedtuple("Or", ["children"])
+Not = namedtuple("Not", ["child"])
+# Both operands within distance positions of each other, in any order; operands are Term, Phrase or Near
+Near = namedtuple("Near", ["left", "right", "distance"])
+
+OPERATORS = {"AND", "OR", "NOT"}
+TOKEN_PATTERN = re.compile(r'\(|\)|"[^"]*"?|[^\s()"]+')
+NEAR_PATTERN = re.compile(r"NEAR(?:/(\d+))?")
+# Distance of a NEAR operator without /k
+DEFAULT_NEAR_DISTANCE = 5
+# Larger NEAR distances are rejected, NEAR never matches terms of two separate fields
+MAX_NEAR_DISTANCE = FIELD_POSITION_GAP - 1
+
+# A document set is stored as a bitmap when it holds more than 1/DENSE_RATIO of the corpus
+DENSE_RATIO = 32
+
+
+class QuerySyntaxError(ValueError):
+    """Raised when a query uses an operator in a way the parser rejects"""
+
+
+def tokenize_query(query):
+    """
+    Split a raw query into parentheses, quoted phrases, operators and words.
+    :param query: Raw query string.
+    :return: List of tokens.
+    """
+    return TOKEN_PATTERN.findall(query)
+
+
+class QueryParser:
+    """
+    Recursive descent parser for Boolean queries, from lowest to highest precedence:
+        or_expr  := and_expr ("OR" and_expr)*
+        and_expr := not_expr (["AND"] not_expr)*
+        not_expr := "NOT" not_expr | sequence
+        sequence := near+                         (adjacent words are ANDed)
+        near     := primary ("NEAR/k" primary)*   (within k positions, in any order)
+        primary  := WORD | "quoted phrase" | "(" or_expr ")"
+    So "Taxi service NOT Airport transportation" is (taxi AND servic) AND NOT (airport AND transport),
+    and "pool NEAR/3 view" matches pool and view at most 3 positions apart. NEAR stays within a
+    field, a k above MAX_NEAR_DISTANCE raises a QuerySyntaxError. Words that preprocess to nothing
+    (stopwords, punctuation) are dropped, and NEAR between operands that are not words or phrases,
+    such as parenthesized groups, is an AND.
+    """
+
+    def __init__(self, preprocess):
+        """
+        :param preprocess: Function mapping a raw string to a list of preprocessed terms.
+        """
+        self.preprocess = preprocess
+
+    def parse(self, query):
+        """
+        Parse a raw query into an AST.
+        :param query: Raw query string.
+        :return: Root node, or None if the query contains no searchable term.
+        """
+        self.tokens = tokenize_query(query)
+        self.position = 0
+        node = self._or_expr()
+        # Unbalanced closing parentheses end the expression: parse what follows as well
+        while self.position < len(self.tokens):
+            self.position += 1
+            node = _combine(And, [node, self._or_expr()])
+        return node
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _or_expr(self):
+        children = [self._and_expr()]
+        while self._peek() == "OR":
+            self.position += 1
+            children.append(self._and_expr())
+        return _combine(Or, children)
+
+    def _and_expr(self):
+        children = [self._not_expr()]
+        while self._peek() not in (None, "OR", ")"):
+            if self._peek() == "AND":
+                self.position += 1
+            children.append(self._not_expr())
+        return _combine(And, children)
+
+    def _not_expr(self):
+        if self._peek() == "NOT":
+            self.position += 1
+            child = self._not_expr()
+            return Not(child) if child is not None else None
+        return self._sequence()
+
+    def _near_operator(self):
+        """
+        Get the distance of the NEAR operator at the current token, None if it is not one.
+        :raises QuerySyntaxError: If the distance is above MAX_NEAR_DISTANCE.
+        """
+        match = NEAR_PATTERN.fullmatch(self._peek() or "")
+        if match is None:
+            return None
+        if not match.group(1):
+            return DEFAULT_NEAR_DISTANCE
+        distance = int(match.group(1))
+        if distance > MAX_NEAR_DISTANCE:
+            raise QuerySyntaxError(f"NEAR distance must be at most {MAX_NEAR_DISTANCE}, got {distance}")
+        return distance
+
+    def _is_operand(self):
+        return self._peek() is not None and self._peek() not in OPERATORS and self._peek() != ")"
+
+    def _sequence(self):
+        children = []
+        while self._is_operand():
+            if self._near_operator() is not None:
+                self.position += 1  # NEAR without a left operand
+                continue
+            children.append(self._near())
+        return _combine(And, children)
+
+    def _near(self):
+        node = self._primary()
+        while self._near_operator() is not None:
+            distance = self._near_operator()
+            self.position += 1
+            if not self._is_operand() or self._near_operator() is not None:
+                break
+            right = self._primary()
+            if node is None or right is None:
+                node = node or right
+            elif isinstance(node, POSITIONAL_NODES) and isinstance(right, POSITIONAL_NODES):
+                node = Near(node, right, distance)
+            else:
+                node = _combine(And, [node, right])
+        return node
+
+    def _primary(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        if token == "(":
+            node = self._or_expr()
+            if self._peek() == ")":
+                self.position += 1
+            return node
+        if token.startswith('"'):
+            terms = self.preprocess(token.strip('"'))
+            if len(terms) > 1:
+                return Phrase(tuple(terms))
+            return Term(terms[0]) if terms else None
+        return _combine(And, [Term(term) for term in self.preprocess(token)])
+
+
+POSITIONAL_NODES = (Term, Phrase, Near)
+
+
+def _combine(node_type, children):
+    """
+    Build an And/Or node, dropping empty children and flattening nested nodes of the same type.
+    """
+    flat = []
+    for child in children:
+        if child is None:
+            continue
+        if isinstance(child, node_type):
+            flat.extend(child.children)
+        else:
+            flat.append(child)
+    if not flat:
+        return None
+    if len(flat) == 1:
+        return flat[0]
+    return node_type(tuple(flat))
+
+
+def parse_boolean_query(query, preprocess):
+    """
+    Parse a raw Boolean query into an AST.
+    :param query: Raw query string.
+    :param preprocess: Function mapping a raw string to a list of preprocessed terms.
+    :return: Root node, or None if the query contains no searchable term.
+    """
+    return QueryParser(preprocess).parse(query)
+
+
+def query_terms(node):
+    """
+    Collect the terms of a query that documents should contain, for ranking.
+    Terms under a NOT are excluded.
+    :param node: Query AST.
+    :return: List of preprocessed terms.
+    """
+    if node is None or isinstance(node, Not):
+        return []
+    if isinstance(node, Term):
+        return [node.term]
+    if isinstance(node, Phrase):
+        return list(node.terms)
+    if isinstance(node, Near):
+        return query_terms(node.left) + query_terms(node.right)
+    return [term for child in node.children for term in query_terms(child)]
+
+
+def expand_terms(node, expand):
+    """
+    Rewrite a query with the expansions of its terms, such as the corrections of misspelled terms.
+    A term becomes the OR of its expansions. In phrases and NEAR operands, where a position holds
+    one term, a term is replaced by its first expansion.
+    :param node: Query AST.
+    :param expand: Function mapping a term to a non-empty tuple of terms.
+    :return: Rewritten query AST.
+    """
+    if node is None:
+        return None
+    if isinstance(node, Term):
+        return _combine(Or, [Term(term) for term in expand(node.term)])
+    if isinstance(node, (Phrase, Near)):
+        return _expand_positional(node, expand)
+    if isinstance(node, Not):
+        return Not(expand_terms(node.child, expand))
+    return _combine(type(node), [expand_terms(child, expand) for child in node.children])
+
+
+def _expand_positional(node, expand):
+    if isinstance(node, Term):
+        return Term(expand(node.term)[0])
+    if isinstance(node, Phrase):
+        return Phrase(tuple(expand(term)[0] for term in node.terms))
+    return Near(_expand_positional(node.left, expand), _expand_positional(node.right, expand), node.distance)
+
+
+def gallop_intersect(small, large):
+    """
+    Intersect two sorted lists by galloping through the larger one.
+    Runs in O(len(small) * log(len(large) / len(small))) for skewed lists.
+    """
+    result = []
+    low = 0
+    n = len(large)
+    for doc_id in small:
+        if low < n and large[low] < doc_id:
+            bound = 1
+            while low + bound < n and large[low + bound] < doc_id:
+                bound <<= 1
+            low = bisect_left(large, doc_id, low + (bound >> 1), min(low + bound, n))
+        if low == n:
+            break
+        if large[low] == doc_id:
+            result.append(doc_id)
+    return result
+
+
+def gallop_difference(left, right):
+    """
+    Remove the elements of the sorted list right from the sorted list left.
+    """
+    result = []
+    low = 0
+    n = len(right)
+    for doc_id in left:
+        if low < n and right[low] < doc_id:
+            bound = 1
+            while low + bound < n and right[low + bound] < doc_id:
+                bound <<= 1
+            low = bisect_left(right, doc_id, low + (bound >> 1), min(low + bound, n))
+        if low == n or right[low] != doc_id:
+            result.append(doc_id)
+    return result
+
+
+class DocSet:
+    """
+    Set of document IDs stored either as a sorted list (sparse) or as an integer bitmap (dense),
+    in the spirit of roaring bitmap containers.
+    """
+    __slots__ = ("ids", "bits", "total_docs")
+
+    def __init__(self, total_docs, ids=None, bits=None):
+        self.total_docs = total_docs
+        self.ids = ids
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, ids, total_docs):
+        if len(ids) * DENSE_RATIO > total_docs:
+            return cls(total_docs, bits=ids_to_bitmap(ids, total_docs))
+        return cls(total_docs, ids=ids)
+
+    def is_dense(self):
+        return self.bits is not None
+
+    def to_bitmap(self):
+        return self.bits if self.bits is not None else ids_to_bitmap(self.ids, self.total_docs)
+
+    def to_list(self):
+        return self.ids if self.ids is not None else bitmap_to_ids(self.bits, self.total_docs)
+
+    def _compact(self):
+        """
+        Switch a bitmap back to a sorted list once it has become sparse.
+        """
+        if self.bits is not None and self.bits.bit_count() * DENSE_RATIO <= self.total_docs:
+            return DocSet(self.total_docs, ids=bitmap_to_ids(self.bits, self.total_docs))
+        return self
+
+    def __len__(self):
+        return len(self.ids) if self.ids is not None else self.bits.bit_count()
+
+    def intersection(self, other):
+        if self.ids is not None and other.ids is not None:
+            small, large = sorted((self.ids, other.ids), key=len)
+            return DocSet(self.total_docs, ids=gallop_intersect(small, large))
+        if self.bits is not None and other.bits is not None:
+            return DocSet(self.total_docs, bits=self.bits & other.bits)._compact()
+        ids, bits = (self.ids, other.bits) if self.ids is not None else (other.ids, self.bits)
+        data = bitmap_bytes(bits, self.total_docs)
+        return DocSet(self.total_docs, ids=[doc_id for doc_id in ids if data[doc_id >> 3] >> (doc_id & 7) & 1])
+
+    def union(self, other):
+        if self.ids is not None and other.ids is not None \
+                and (len(self.ids) + len(other.ids)) * DENSE_RATIO <= self.total_docs:
+            return DocSet(self.total_docs, ids=sorted(set(self.ids).union(other.ids)))
+        return DocSet(self.total_docs, bits=self.to_bitmap() | other.to_bitmap())
+
+    def difference(self, other):
+        if self.ids is not None:
+            if other.ids is not None:
+                return DocSet(self.total_docs, ids=gallop_difference(self.ids, other.ids))
+            data = bitmap_bytes(other.bits, self.total_docs)
+            return DocSet(self.total_docs,
+                          ids=[doc_id for doc_id in self.ids if not data[doc_id >> 3] >> (doc_id & 7) & 1])
+        return DocSet(self.total_docs, bits=self.bits & ~other.to_bitmap())._compact()
+
+    def complement(self):
+        universe = (1 << self.total_docs) - 1
+        return DocSet(self.total_docs, bits=universe & ~self.to_bitmap())._compact()
+
+
+def ids_to_bitmap(ids, total_docs):
+    data = bytearray((total_docs + 7) // 8)
+    for doc_id in ids:
+        data[doc_id >> 3] |= 1 << (doc_id & 7)
+    return int.from_bytes(data, "little")
+
+
+def bitmap_bytes(bits, total_docs):
+    return bits.to_bytes((total_docs + 7) // 8, "little")
+
+
+def bitmap_to_ids(bits, total_docs):
+    data = bitmap_bytes(bits, total_docs)
+    return [(i << 3) | j for i, byte in enumerate(data) if byte for j in range(8) if byte >> j & 1]
+
+
+class BooleanExecutor:
+    """
+    Execute query ASTs against an inverted index. AND clauses are evaluated rarest-first with
+    galloping intersections and stop as soon as the result is empty, NOT clauses are applied as
+    differences, and dense intermediate results switch to bitmaps.
+    """
+
+    def __init__(self, inverted_index, term_set_cache=None, generation=0):
+        """
+        :param inverted_index: Index to match against.
+        :param term_set_cache: LRUCache of the document sets of the terms, a new one holding 4096 sets by default.
+        :param generation: Number identifying the version of the index, part of the cache keys so that
+            the cache can be shared with executors over other versions of the index.
+        """
+        self.inverted_index = inverted_index
+        self.total_docs = inverted_index.total_docs
+        self.term_set_cache = term_set_cache if term_set_cache is not None else LRUCache(maxsize=4096)
+        self.generation = generation
+
+    def term_set(self, term):
+        return self.term_set_cache.get_or_compute(
+            (self.generation, term),
+            lambda: DocSet.from_ids(self.inverted_index.get_doc_ids(term), self.total_docs))
+
+    def estimate(self, node):
+        """
+        Estimate the number of documents matching a node, used to order clauses.
+        """
+        if isinstance(node, Term):
+            return self.inverted_index.document_frequency(node.term)
+        if isinstance(node, Phrase):
+            return min(self.inverted_index.document_frequency(term) for term in node.terms)
+        if isinstance(node, Near):
+            return min(self.estimate(node.left), self.estimate(node.right))
+        if isinstance(node, Not):
+            return self.total_docs - self.estimate(node.child)
+        if isinstance(node, And):
+            return min(self.estimate(child) for child in node.children if not isinstance(child, Not)) \
+                if any(not isinstance(child, Not) for child in node.children) else self.total_docs
+        return min(self.total_docs, sum(self.estimate(child) for child in node.children))
+
+    def execute(self, node):
+        """
+        Find the documents matching a query.
+        :param node: Query AST, as returned by parse_boolean_query.
+        :return: Sorted list of matching document IDs.
+        """
+        if node is None:
+            return []
+        return self.evaluate(node).to_list()
+
+    def evaluate(self, node):
+        if isinstance(node, Term):
+            return self.term_set(node.term)
+        if isinstance(node, (Phrase, Near)):
+            return self._evaluate_positional(node)
+        if isinstance(node, Not):
+            return self.evaluate(node.child).complement()
+        if isinstance(node, And):
+            return self._evaluate_and(node)
+        if isinstance(node, Or):
+            return self._evaluate_or(node)
+        raise ValueError(f"Unsupported query node: {node}")
+
+    def _evaluate_and(self, node):
+        positives = sorted((child for child in node.children if not isinstance(child, Not)), key=self.estimate)
+        negatives = sorted((child.child for child in node.children if isinstance(child, Not)),
+                           key=self.estimate, reverse=True)
+        if positives:
+            result = self.evaluate(positives[0])
+            for child in positives[1:]:
+                if not len(result):
+                    return result
+                result = result.intersection(self.evaluate(child))
+        else:
+            result = self.evaluate(negatives.pop(0)).complement()
+        for child in negatives:
+            if not len(result):
+                break
+            result = result.difference(self.evaluate(child))
+        return result
+
+    def _evaluate_or(self, node):
+        children = [self.evaluate(child) for child in node.children]
+        result = children[0]
+        for child in children[1:]:
+            result = result.union(child)
+        return result
+
+    def _evaluate_positional(self, node):
+        """
+        Match a phrase or NEAR node: intersect the documents of its terms, then check the positions
+        of the candidates in the postings.
+        """
+        terms = query_terms(node)
+        candidates = self._evaluate_and(And(tuple(Term(term) for term in set(terms)))).to_list()
+        if not candidates:
+            return DocSet(self.total_docs, ids=[])
+
+        # Positions of every term, restricted to the candidate documents
+        positions = {term: term_positions(self.inverted_index, term, candidates) for term in set(terms)}
+
+        matches = [doc_id for doc_id in candidates if node_spans(node, positions, doc_id)]
+        return DocSet.from_ids(matches, self.total_docs)
+
+
+def node_spans(node, positions, doc_id):
+    """
+    Find the occurrences of a Term, Phrase or Near node in a document.
+    :param node: Term, Phrase or Near node.
+    :param positions: Dictionary term -> {doc_id: sorted positions of the term in the document}.
+    :param doc_id: Document ID.
+    :return: Sorted list of (first position, last position) of the occurrences.
+    """
+    if isinstance(node, Term):
+        return [(position, position) for position in positions[node.term][doc_id]]
+    if isinstance(node, Phrase):
+        starts = set(positions[node.terms[0]][doc_id])
+        for offset, term in enumerate(node.terms[1:], start=1):
+            starts &= {position - offset for position in positions[term][doc_id]}
+            if not starts:
+                return []
+        return [(start, start + len(node.terms) - 1) for start in sorted(starts)]
+
+    left_spans = node_spans(node.left, positions, doc_id)
+    right_spans = node_spans(node.right, positions, doc_id) if left_spans else []
+    right_starts = [start for start, _ in right_spans]
+    spans = set()
+    for left_start, left_end in left_spans:
+        # Right occurrences starting at most distance positions after the left one ends...
+        for right_start, right_end in right_spans[:bisect_right(right_starts, left_end + node.distance)]:
+            # ...and ending at most distance positions before it starts
+            if right_end >= left_start - node.distance and (right_start, right_end) != (left_start, left_end):
+                spans.add((min(left_start, right_start), max(left_end, right_end)))
+    return sorted(spans)
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import count
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe mapping bounded in size, evicting the least recently used entry when full.
+    Entries optionally expire ttl seconds after they were stored. Hits, misses and evictions
+    are counted so that the caches can be sized from their stats.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, timer=time.monotonic):
+        """
+        :param maxsize: Maximum number of entries; 0 disables the cache.
+        :param ttl: Optional lifetime of the entries in seconds.
+        :param timer: Function returning the current time in seconds.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, expires = entry
+                if expires is None or expires > self.timer():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = self.timer() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Get the value of a key, computing and storing it on a miss.
+        :param key: Hashable cache key.
+        :param compute: Function of no argument returning the value.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def recent_keys(self, count):
+        """
+        Get the keys of the most recently used entries, most recent first.
+        """
+        with self.lock:
+            keys = list(self.entries)
+        return keys[:-count - 1:-1] if count > 0 else []
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
+
+
+class CachedIndex:
+    """
+    Index wrapper serving decoded postings lists from an LRU cache, so that popular terms of a
+    binary index are not decoded again for every query. Keys include the index generation:
+    a cache shared between successive versions of an index never serves stale postings.
+    Every other attribute is read from the wrapped index.
+    """
+
+    def __init__(self, inverted_index, cache, generation=0):
+        """
+        :param inverted_index: InvertedIndex or BinaryIndex instance.
+        :param cache: LRUCache instance holding the postings.
+        :param generation: Number identifying the version of the index.
+        """
+        self.inverted_index = inverted_index
+        self.cache = cache
+        self.generation = generation
+
+    def __getattr__(self, name):
+        return getattr(self.inverted_index, name)
+
+    def __contains__(self, term):
+        return term in self.inverted_index
+
+    def __len__(self):
+        return len(self.inverted_index)
+
+    def _get(self, kind, term, load):
+        key = (self.generation, kind, term)
+        value = self.cache.get(key, _MISSING)
+        if value is _MISSING:
+            count("postings_cache_misses")
+            value = load(term)
+            self.cache.put(key, value)
+        else:
+            count("postings_cache_hits")
+        count("postings_read")
+        return value
+
+    def get_postings(self, term):
+        return self._get("postings", term, self.inverted_index.get_postings)
+
+    def get_doc_ids(self, term):
+        return self._get("doc_ids", term, self.inverted_index.get_doc_ids)
@@ -0,0 +1,136 @@
+from array import array
+
+from .analysis import default_analyzer
+from .encoding import Encoded, dumps
+
+SUMMARY_FIELDS = ("title", "imageUrl", "description", "country", "address", "rating", "reviewCount",
+                  "fullDescription")
+# Fields of a summary when none are selected: the untruncated description is only sent on request
+DEFAULT_SUMMARY_FIELDS = SUMMARY_FIELDS[:-1]
+# Descriptions are cut in the "description" field, "fullDescription" holds the whole text
+DESCRIPTION_LENGTH = 300
+
+
+def document_key(hotel):
+    """
+    Get the key identifying a hotel across crawls: its TripAdvisor URL, or its name without one.
+    """
+    basic_data = hotel.get("basic_data", {})
+    return basic_data.get("url") or basic_data.get("name")
+
+
+def preprocess_hotel(hotel, analyzer=default_analyzer):
+    """
+    Preprocess the description and features of a hotel.
+    :param hotel: Raw hotel data.
+    :param analyzer: Analyzer of the description and features.
+    :return: Processed hotel data.
+    """
+    basic_data = hotel.get("basic_data", {})
+    description = hotel.get("description", "")
+    features = hotel.get("features", [])
+
+    # Preprocess description and features
+    processed_description = analyzer.analyze(description)
+    processed_features = [analyzer.analyze(feature) for feature in features]
+
+    # Organize processed data
+    return {
+        "name": basic_data.get("name"),
+        "rating": basic_data.get("aggregateRating", {}).get("ratingValue"),
+        "reviewCount": basic_data.get("aggregateRating", {}).get("reviewCount"),
+        "address": basic_data.get("address", {}).get("streetAddress"),
+        "country": basic_data.get("address", {}).get("addressCountry", {}).get("name"),
+        "description": processed_description,
+        "features": processed_features,
+        "image": basic_data.get("image"),
+        # Fingerprint of the analysis, checked against the analysis of the queries
+        "analyzer": analyzer.fingerprint
+    }
+
+
+def truncate(text, length):
+    """
+    Cut a text to at most length characters at a word boundary, marking the cut with an ellipsis.
+    """
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(" ", 1)[0] or text[:length]
+    return cut.rstrip(" ,.;:") + "..."
+
+
+def summarize_document(doc, description_length=DESCRIPTION_LENGTH):
+    """
+    Build the summary of a hotel shown in search results.
+    :param doc: Raw hotel data.
+    :param description_length: Maximum length of the description.
+    :return: Dictionary with the SUMMARY_FIELDS.
+    """
+    # As served before summaries, a missing description is replaced and an empty one kept
+    description = doc.get("description", "No description available")
+    return {
+        "title": doc["basic_data"]["name"],
+        "imageUrl": doc["basic_data"].get("image", ""),
+        "description": truncate(description, description_length) if description else description,
+        "country": doc["basic_data"]["address"]["addressCountry"]["name"],
+        "address": doc["basic_data"]["address"]["streetAddress"],
+        "rating": doc["basic_data"]["aggregateRating"]["ratingValue"],
+        "reviewCount": doc["basic_data"]["aggregateRating"]["reviewCount"],
+        "fullDescription": description
+    }
+
+
+class DocumentStore:
+    """
+    Summaries of all the documents pre-encoded to JSON when loading, so that a result page is
+    written by splicing bytes instead of building and encoding a dictionary per document (see
+    encoding.encode). The encoded summaries are concatenated in a single bytes buffer, with the
+    start offset of each of their F fields and their end in a compact array: the '"field":value'
+    fragment f of document d starts at offsets[d * (F + 1) + f] and ends one byte before the next
+    offset, at the comma or closing brace that follows it.
+    """
+
+    def __init__(self, documents, description_length=DESCRIPTION_LENGTH):
+        """
+        :param documents: List of raw hotel data, indexed by document ID.
+        :param description_length: Maximum length of the descriptions.
+        """
+        self.field_positions = {field: i for i, field in enumerate(SUMMARY_FIELDS)}
+        chunks = []
+        offsets = array("Q")
+        position = 0
+        for doc in documents:
+            summary = summarize_document(doc, description_length)
+            separator = b"{"
+            for field in SUMMARY_FIELDS:
+                fragment = separator + dumps(field) + b":" + dumps(summary[field])
+                offsets.append(position + 1)
+                chunks.append(fragment)
+                position += len(fragment)
+                separator = b","
+            chunks.append(b"}")
+            position += 1
+            offsets.append(position)
+        self.buffer = b"".join(chunks)
+        self.offsets = offsets
+        self.count = len(documents)
+
+    def __len__(self):
+        return self.count
+
+    def get(self, doc_id, fields=None):
+        """
+        Get the encoded summary of a document.
+        :param doc_id: Document ID.
+        :param fields: Optional collection of SUMMARY_FIELDS to keep, the DEFAULT_SUMMARY_FIELDS by default.
+        :return: Encoded JSON object, with the fields in the order given.
+        """
+        if not 0 <= doc_id < self.count:
+            raise IndexError(f"Document ID out of range: {doc_id}")
+        start = doc_id * (len(SUMMARY_FIELDS) + 1)
+        buffer, offsets = self.buffer, self.offsets
+        if fields is None:
+            # The default fields come first, up to the comma before the next field
+            return Encoded(buffer[offsets[start] - 1:offsets[start + len(DEFAULT_SUMMARY_FIELDS)] - 1] + b"}")
+        positions = [start + self.field_positions[field] for field in fields]
+        return Encoded(b"{" + b",".join(buffer[offsets[i]:offsets[i + 1] - 1] for i in positions) + b"}")
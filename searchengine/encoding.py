@@ -0,0 +1,78 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # The standard library encoder is used without orjson
+    orjson = None
+
+
+def loads(data):
+    """
+    Parse JSON from bytes or text, with orjson when available.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_file(file_path):
+    """
+    Parse a JSON file. orjson parses the bytes of the whole file at once, several times faster
+    than json.load on the large data files read at startup.
+    """
+    if orjson is not None:
+        with open(file_path, "rb") as f:
+            return orjson.loads(f.read())
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
+def dumps(value):
+    """
+    Encode a value to compact JSON bytes, with orjson when available.
+    """
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class Encoded(bytes):
+    """
+    Bytes of an already encoded JSON value, copied as is into the output of encode.
+    """
+
+
+def encode(value):
+    """
+    Encode a response to JSON bytes, splicing the Encoded values it contains instead of encoding
+    them again. Only the dictionaries and lists leading to Encoded values are walked in Python,
+    every other value is encoded by dumps.
+    :param value: JSON-serializable value, possibly containing Encoded values.
+    :return: JSON bytes.
+    """
+    parts = []
+    _encode(value, parts)
+    return b"".join(parts)
+
+
+def _encode(value, parts):
+    if isinstance(value, Encoded):
+        parts.append(value)
+    elif isinstance(value, dict):
+        parts.append(b"{")
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                parts.append(b",")
+            parts.append(dumps(key))
+            parts.append(b":")
+            _encode(item, parts)
+        parts.append(b"}")
+    elif isinstance(value, list):
+        parts.append(b"[")
+        for i, item in enumerate(value):
+            if i:
+                parts.append(b",")
+            _encode(item, parts)
+        parts.append(b"]")
+    else:
+        parts.append(dumps(value))
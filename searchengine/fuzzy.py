@@ -0,0 +1,119 @@
+from array import array
+from collections import Counter, defaultdict
+
+from .cache import LRUCache
+
+NGRAM_SIZE = 3
+# Terms are runs of letters, the padding cannot occur in them
+NGRAM_PADDING = "$"
+# Maximum number of dictionary terms a missing term expands to
+MAX_EXPANSIONS = 3
+
+
+def max_edit_distance(term):
+    """
+    Get the edit distance allowed when correcting a term: none below 4 letters, which have too
+    many neighbours to be corrected reliably, 1 up to 7 letters and 2 beyond.
+    """
+    if len(term) < 4:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def ngrams(term, n=NGRAM_SIZE):
+    """
+    Get the distinct character n-grams of a term, padded so that its first and last letters
+    are in n grams like the others.
+    """
+    padded = NGRAM_PADDING * (n - 1) + term + NGRAM_PADDING * (n - 1)
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def bounded_levenshtein(source, target, max_distance):
+    """
+    Compute the Levenshtein distance between two strings, stopping as soon as it exceeds a bound.
+    :return: Distance, or max_distance + 1 if it is greater than max_distance.
+    """
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(target) + 1))
+    for i, source_char in enumerate(source, 1):
+        current = [i]
+        for j, target_char in enumerate(target, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (source_char != target_char)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return min(previous[-1], max_distance + 1)
+
+
+class FuzzyMatcher:
+    """
+    Typo-tolerant lookup of the terms of an index: a term missing from the dictionary expands to
+    the dictionary terms within a small edit distance. Candidates come from an index of the
+    character n-grams of the terms: each edit changes at most n of the n-grams of a term, so a
+    term within distance d shares at least |ngrams| - n * d of them with the query term. Only the
+    terms sharing enough n-grams and of a close length are compared with a bounded Levenshtein
+    distance, never the whole vocabulary. Expansions are memoized in an LRU cache.
+    """
+
+    def __init__(self, inverted_index, max_expansions=MAX_EXPANSIONS, cache=None, n=NGRAM_SIZE):
+        """
+        :param inverted_index: Index whose term dictionary is matched.
+        :param max_expansions: Maximum number of terms a missing term expands to.
+        :param cache: LRUCache of the expansions, a new one holding 4096 expansions by default. Its
+            entries are only valid for this dictionary.
+        :param n: Size of the character n-grams.
+        """
+        self.inverted_index = inverted_index
+        self.max_expansions = max_expansions
+        self.n = n
+        self.cache = cache if cache is not None else LRUCache(maxsize=4096)
+        self.terms = list(inverted_index.terms())
+        postings = defaultdict(list)
+        for term_id, term in enumerate(self.terms):
+            for gram in ngrams(term, n):
+                postings[gram].append(term_id)
+        self.ngram_postings = {gram: array("I", term_ids) for gram, term_ids in postings.items()}
+
+    def _document_frequency(self, term):
+        # Terms left only by deleted documents have no postings
+        return self.inverted_index.document_frequency(term) if term in self.inverted_index else 0
+
+    def expand(self, term):
+        """
+        Get the terms a query term stands for.
+        :param term: Preprocessed term.
+        :return: Tuple of the term itself if it is in the dictionary or has no close term, else of
+            the closest dictionary terms, by distance then by descending document frequency.
+        """
+        return self.cache.get_or_compute(term, lambda: self._expand(term))
+
+    def _expand(self, term):
+        if self._document_frequency(term) > 0:
+            return (term,)
+        max_distance = max_edit_distance(term)
+        if max_distance == 0:
+            return (term,)
+
+        grams = ngrams(term, self.n)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.ngram_postings.get(gram, ()))
+        min_shared = len(grams) - self.n * max_distance
+        matches = []
+        for term_id, count in shared.items():
+            candidate = self.terms[term_id]
+            if count < min_shared or abs(len(candidate) - len(term)) > max_distance:
+                continue
+            distance = bounded_levenshtein(term, candidate, max_distance)
+            if distance <= max_distance:
+                document_frequency = self._document_frequency(candidate)
+                if document_frequency > 0:
+                    matches.append((distance, -document_frequency, candidate))
+        if not matches:
+            return (term,)
+        return tuple(candidate for _, _, candidate in sorted(matches)[:self.max_expansions])
+
+    def stats(self):
+        return {"terms": len(self.terms), "ngrams": len(self.ngram_postings), "expansions": self.cache.stats()}
@@ -0,0 +1,170 @@
+import json
+from bisect import bisect_left
+from collections import defaultdict
+
+from .encoding import load_file
+
+# Position gap inserted between the description and each feature, so that
+# positional matches never span two separate fields of a hotel.
+FIELD_POSITION_GAP = 100
+
+
+class InvertedIndex:
+    """
+    Positional inverted index with precomputed term frequencies and document lengths.
+    Postings for each term are a list of (doc_id, term_frequency, positions) sorted by doc_id.
+    """
+
+    def __init__(self, postings, doc_lengths, max_scores=None, analyzer=None):
+        """
+        :param postings: Dictionary term -> list of (doc_id, term_frequency, positions).
+        :param doc_lengths: List of document lengths (number of terms), indexed by doc_id.
+        :param max_scores: Optional per-term score upper bounds, ranking_function -> {term: max_score}.
+        :param analyzer: Fingerprint of the Analyzer of the indexed terms, None if unknown.
+        """
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.max_scores = max_scores or {}
+        self.analyzer = analyzer
+        self.total_docs = len(doc_lengths)
+        self.total_terms = sum(doc_lengths)
+        self.avg_doc_length = self.total_terms / self.total_docs if self.total_docs else 0.0
+        self._doc_ids = {}
+
+    def __contains__(self, term):
+        return term in self.postings
+
+    def __len__(self):
+        return len(self.postings)
+
+    def terms(self):
+        return self.postings.keys()
+
+    def get_postings(self, term):
+        """
+        Get the postings list of a term.
+        :param term: Preprocessed term.
+        :return: List of (doc_id, term_frequency, positions), empty if the term is unknown.
+        """
+        return self.postings.get(term, [])
+
+    def get_doc_ids(self, term):
+        """
+        Get the sorted document IDs containing a term.
+        :param term: Preprocessed term.
+        :return: Sorted list of document IDs.
+        """
+        doc_ids = self._doc_ids.get(term)
+        if doc_ids is None:
+            doc_ids = [doc_id for doc_id, _, _ in self.get_postings(term)]
+            self._doc_ids[term] = doc_ids
+        return doc_ids
+
+    def document_frequency(self, term):
+        return len(self.get_postings(term))
+
+    def term_frequency(self, term, doc_id):
+        """
+        Get the frequency of a term in a document using a binary search over the postings.
+        :param term: Preprocessed term.
+        :param doc_id: Document ID.
+        :return: Number of occurrences of the term in the document.
+        """
+        doc_ids = self.get_doc_ids(term)
+        i = bisect_left(doc_ids, doc_id)
+        if i < len(doc_ids) and doc_ids[i] == doc_id:
+            return self.postings[term][i][1]
+        return 0
+
+    def doc_length(self, doc_id):
+        return self.doc_lengths[doc_id]
+
+    def stats(self):
+        return {
+            "total_docs": self.total_docs,
+            "total_terms": self.total_terms,
+            "avg_doc_length": self.avg_doc_length,
+            "vocabulary_size": len(self.postings)
+        }
+
+    def to_dict(self):
+        return {
+            "stats": self.stats(),
+            "analyzer": self.analyzer,
+            "doc_lengths": self.doc_lengths,
+            "max_scores": self.max_scores,
+            "postings": {term: [[doc_id, tf, positions] for doc_id, tf, positions in postings]
+                         for term, postings in self.postings.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        postings = {term: [(doc_id, tf, positions) for doc_id, tf, positions in term_postings]
+                    for term, term_postings in data["postings"].items()}
+        return cls(postings, data["doc_lengths"], data.get("max_scores"), data.get("analyzer"))
+
+
+def document_terms(hotel):
+    """
+    Yield the terms of a processed hotel together with their positions.
+    Features are placed after the description, separated by FIELD_POSITION_GAP.
+    :param hotel: Processed hotel data.
+    :return: Generator of (position, term).
+    """
+    position = 0
+    for term in hotel.get("description", []):
+        yield position, term
+        position += 1
+    for feature_list in hotel.get("features", []):
+        position += FIELD_POSITION_GAP
+        for term in feature_list:
+            yield position, term
+            position += 1
+
+
+def build_inverted_index(processed_data):
+    """
+    Build a positional inverted index from the processed data.
+    :param processed_data: Iterable of processed hotel data, in document ID order.
+    :return: InvertedIndex instance.
+    """
+    postings = defaultdict(list)  # Term-to-postings mapping
+    doc_lengths = []
+    analyzers = set()  # Fingerprints of the analyzers of the processed data
+
+    for doc_id, hotel in enumerate(processed_data):
+        analyzers.add(hotel.get("analyzer"))
+        # Collect the positions of every term from description and features
+        term_positions = defaultdict(list)
+        for position, term in document_terms(hotel):
+            term_positions[term].append(position)
+
+        # Add one posting per distinct term
+        for term, positions in term_positions.items():
+            postings[term].append((doc_id, len(positions), positions))
+        doc_lengths.append(sum(len(positions) for positions in term_positions.values()))
+
+    if len(analyzers) > 1:
+        raise ValueError(f"Processed data mixes analyzers: {', '.join(sorted(map(str, analyzers)))}")
+
+    # Convert defaultdict to a regular dict
+    return InvertedIndex(dict(postings), doc_lengths, analyzer=analyzers.pop() if analyzers else None)
+
+
+def save_inverted_index(index, output_file):
+    """
+    Save the inverted index to a JSON file.
+    :param index: InvertedIndex instance.
+    :param output_file: File path to save the index.
+    """
+    with open(output_file, "w") as f:
+        json.dump(index.to_dict(), f, indent=2)
+
+
+def load_inverted_index(input_file):
+    """
+    Load an inverted index saved with save_inverted_index.
+    :param input_file: File path of the index.
+    :return: InvertedIndex instance.
+    """
+    return InvertedIndex.from_dict(load_file(input_file))
@@ -0,0 +1,195 @@
+from collections import Counter
+
+from .metrics import count
+from .scoring import SCORERS
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # Optional dependencies, only needed by the matrix backend
+    np = None
+    sparse = None
+
+
+def _require_scipy():
+    if sparse is None:
+        raise ImportError("The matrix scoring backend requires numpy and scipy")
+
+
+class MatrixIndex:
+    """
+    Sparse matrix form of an inverted index for vectorized scoring. For each ranking function,
+    the per-(term, document) score contributions are precomputed into a term-document CSR
+    matrix, so that scoring a query is a sparse vector-matrix product and scoring a batch of
+    queries is a single sparse matrix-matrix product.
+    """
+
+    def __init__(self, terms, matrices, total_docs):
+        """
+        :param terms: List of terms, in the row order of the matrices.
+        :param matrices: Dictionary ranking_function -> scipy CSR matrix of shape (len(terms), total_docs).
+        :param total_docs: Number of documents.
+        """
+        _require_scipy()
+        self.terms = terms
+        self.term_rows = {term: row for row, term in enumerate(terms)}
+        self.matrices = matrices
+        self.total_docs = total_docs
+
+    def _query_matrix(self, queries):
+        """
+        Build the sparse (queries x terms) matrix of query term frequencies.
+        Unknown terms are dropped.
+        """
+        rows, columns, values = [], [], []
+        for i, query_terms in enumerate(queries):
+            for term, query_frequency in Counter(query_terms).items():
+                row = self.term_rows.get(term)
+                if row is not None:
+                    rows.append(i)
+                    columns.append(row)
+                    values.append(query_frequency)
+        return sparse.csr_matrix((values, (rows, columns)), shape=(len(queries), len(self.terms)))
+
+    def _candidates(self, term_rows):
+        """
+        Get the sorted IDs of the documents containing at least one of the given terms.
+        All the matrices share the same sparsity structure, so any of them can be used.
+        """
+        matrix = next(iter(self.matrices.values()))
+        if not len(term_rows):
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate([matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
+                                         for row in term_rows])).astype(np.int64)
+
+    def _get_matrix(self, ranking_function):
+        matrix = self.matrices.get(ranking_function)
+        if matrix is None:
+            raise ValueError(f"Unsupported ranking function: {ranking_function}")
+        return matrix
+
+    def score_many(self, queries, ranking_function="TF-IDF"):
+        """
+        Score a batch of queries with one sparse matrix product.
+        :param queries: List of lists of preprocessed query terms.
+        :param ranking_function: Name of a precomputed ranking function.
+        :return: Sparse CSR matrix of shape (len(queries), total_docs).
+        """
+        return (self._query_matrix(queries) @ self._get_matrix(ranking_function)).tocsr()
+
+    def top_k_many(self, queries, k=10, ranking_function="TF-IDF", doc_ids=None):
+        """
+        Retrieve the k best documents for each query of a batch.
+        :param queries: List of lists of preprocessed query terms.
+        :param k: Number of documents to return per query.
+        :param ranking_function: Name of a precomputed ranking function.
+        :param doc_ids: Optional collection of document IDs to restrict scoring to.
+        :return: One list of (doc_id, score) per query, sorted by descending score.
+        """
+        query_matrix = self._query_matrix(queries)
+        scores = (query_matrix @ self._get_matrix(ranking_function)).tocsr()
+        allowed = None
+        if doc_ids is not None:
+            allowed = np.zeros(self.total_docs, dtype=bool)
+            allowed[np.fromiter(doc_ids, dtype=np.int64)] = True
+
+        results = []
+        for i in range(len(queries)):
+            # The product drops scores that sum to exactly zero: take the candidates from the
+            # postings of the query terms so that they match ScoringEngine
+            candidates = self._candidates(query_matrix.indices[query_matrix.indptr[i]:query_matrix.indptr[i + 1]])
+            candidate_scores = np.zeros(len(candidates))
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            candidate_scores[np.searchsorted(candidates, scores.indices[start:end])] = scores.data[start:end]
+            if allowed is not None:
+                mask = allowed[candidates]
+                candidates = candidates[mask]
+                candidate_scores = candidate_scores[mask]
+            count("docs_scored", len(candidates))
+            results.append(_top_k(candidates, candidate_scores, k))
+        return results
+
+    def top_k(self, query_terms, k=10, ranking_function="TF-IDF", doc_ids=None):
+        """
+        Retrieve the k best documents for a query. Same contract as ScoringEngine.top_k.
+        """
+        return self.top_k_many([query_terms], k, ranking_function, doc_ids)[0]
+
+
+def _top_k(doc_ids, scores, k):
+    """
+    Select the k best (doc_id, score) pairs with argpartition, breaking ties by doc_id.
+    """
+    if k <= 0 or not len(doc_ids):
+        return []
+    if len(doc_ids) > k:
+        # Keep every candidate tied with the k-th best score, then sort that small set
+        kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+        selected = scores >= kth_score
+        doc_ids = doc_ids[selected]
+        scores = scores[selected]
+    order = np.lexsort((doc_ids, -scores))[:k]
+    return [(int(doc_id), float(score)) for doc_id, score in zip(doc_ids[order], scores[order])]
+
+
+def build_matrix_index(inverted_index, ranking_functions=None):
+    """
+    Precompute the weighted term-document matrices of an inverted index.
+    :param inverted_index: InvertedIndex or BinaryIndex instance.
+    :param ranking_functions: Names of the scorers to precompute, all registered ones by default.
+    :return: MatrixIndex instance.
+    """
+    _require_scipy()
+    terms = sorted(inverted_index.terms())
+    postings = [inverted_index.get_postings(term) for term in terms]
+    indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(term_postings) for term_postings in postings])
+    indices = np.fromiter((doc_id for term_postings in postings for doc_id, _, _ in term_postings),
+                          dtype=np.int32, count=indptr[-1])
+
+    matrices = {}
+    for ranking_function in ranking_functions or SCORERS:
+        scorer = SCORERS[ranking_function](inverted_index)
+        data = np.fromiter((scorer.score(term_frequency, doc_id, term_weight)
+                            for term_postings in postings
+                            for term_weight in (scorer.term_weight(len(term_postings)),)
+                            for doc_id, term_frequency, _ in term_postings),
+                           dtype=np.float64, count=indptr[-1])
+        matrices[ranking_function] = sparse.csr_matrix((data, indices, indptr),
+                                                       shape=(len(terms), inverted_index.total_docs))
+    return MatrixIndex(terms, matrices, inverted_index.total_docs)
+
+
+def save_matrix_index(matrix_index, output_file):
+    """
+    Save the precomputed matrices to a NumPy .npz file.
+    :param matrix_index: MatrixIndex instance.
+    :param output_file: File path to save the matrices.
+    """
+    arrays = {"terms": np.array(matrix_index.terms, dtype=str),
+              "total_docs": np.array(matrix_index.total_docs),
+              "ranking_functions": np.array(list(matrix_index.matrices), dtype=str)}
+    for i, matrix in enumerate(matrix_index.matrices.values()):
+        arrays[f"data_{i}"] = matrix.data
+        arrays[f"indices_{i}"] = matrix.indices
+        arrays[f"indptr_{i}"] = matrix.indptr
+    with open(output_file, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def load_matrix_index(input_file):
+    """
+    Load matrices saved with save_matrix_index.
+    :param input_file: File path of the matrices.
+    :return: MatrixIndex instance.
+    """
+    _require_scipy()
+    with np.load(input_file) as arrays:
+        terms = arrays["terms"].tolist()
+        total_docs = int(arrays["total_docs"])
+        matrices = {}
+        for i, ranking_function in enumerate(arrays["ranking_functions"].tolist()):
+            matrices[ranking_function] = sparse.csr_matrix(
+                (arrays[f"data_{i}"], arrays[f"indices_{i}"], arrays[f"indptr_{i}"]),
+                shape=(len(terms), total_docs))
+    return MatrixIndex(terms, matrices, total_docs)
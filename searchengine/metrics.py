@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds in seconds of the stage latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+_local = threading.local()
+
+
+class Trace:
+    """
+    Per-request record of the time spent in each stage of the query pipeline and of event
+    counters (postings read, documents scored, cache hits). Stages may nest: the time of
+    "analyze" is also part of "parse". The pipeline records into the trace active in the
+    current thread, see tracing.
+    """
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] += time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def to_dict(self):
+        return {
+            "stages_ms": {name: seconds * 1000 for name, seconds in self.stages.items()},
+            "counters": dict(self.counters)
+        }
+
+
+class _NullTrace:
+    """
+    Trace recording nothing, active when no request is traced.
+    """
+
+    def stage(self, name):
+        return nullcontext()
+
+    def count(self, name, value=1):
+        pass
+
+
+NULL_TRACE = _NullTrace()
+
+
+def current_trace():
+    return getattr(_local, "trace", NULL_TRACE)
+
+
+@contextmanager
+def tracing(trace=None):
+    """
+    Make a trace the active trace of the current thread.
+    :param trace: Trace instance, a new one by default.
+    :return: Context manager yielding the trace.
+    """
+    trace = trace if trace is not None else Trace()
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+def stage(name):
+    """
+    Time a stage of the pipeline in the active trace.
+    """
+    return current_trace().stage(name)
+
+
+def count(name, value=1):
+    """
+    Increment an event counter of the active trace.
+    """
+    current_trace().count(name, value)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    """
+    Aggregate of the traces of all the requests: a latency histogram per stage and a total per
+    event counter, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix="search", buckets=DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.stage_buckets = defaultdict(lambda: [0] * len(self.buckets))
+        self.stage_sums = defaultdict(float)
+        self.stage_counts = defaultdict(int)
+        self.events = defaultdict(int)
+
+    def observe(self, trace):
+        """
+        Add the stages and counters of a finished request.
+        """
+        with self.lock:
+            for name, seconds in trace.stages.items():
+                counts = self.stage_buckets[name]
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        counts[i] += 1
+                self.stage_sums[name] += seconds
+                self.stage_counts[name] += 1
+            for name, value in trace.counters.items():
+                self.events[name] += value
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.events[name] += value
+
+    def render(self, gauges=()):
+        """
+        Render the metrics in the Prometheus text format.
+        :param gauges: Iterable of (name, labels dictionary, value) of current values to add.
+        :return: Text of the metrics.
+        """
+        prefix = self.prefix
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in each stage of the query pipeline.",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        with self.lock:
+            for name in sorted(self.stage_counts):
+                for bound, bucket_count in zip(self.buckets, self.stage_buckets[name]):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {bucket_count}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {self.stage_counts[name]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {self.stage_sums[name]}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {self.stage_counts[name]}')
+            lines += [f"# HELP {prefix}_events_total Events of the query pipeline.",
+                      f"# TYPE {prefix}_events_total counter"]
+            for name in sorted(self.events):
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {self.events[name]}')
+
+        declared = set()
+        for name, labels, value in gauges:
+            if name not in declared:
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                declared.add(name)
+            lines.append(f"{prefix}_{name}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
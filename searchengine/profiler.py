@@ -0,0 +1,112 @@
+import os
+import sys
+import threading
+from collections import Counter
+
+# Innermost frames of threads waiting for work, such as idle ThreadPoolExecutor workers blocked on their queue
+IDLE_FUNCTIONS = frozenset({"thread.py:_worker"})
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler sampling the stacks of running threads every interval seconds from a
+    background thread. Unlike a tracing profiler it does not slow down the sampled code, so it
+    can be switched on in production to find where time goes under real load. Samples are
+    aggregated into collapsed stacks, the input format of flame graph tools. Threads waiting for
+    work are not sampled, so that the stacks only show where busy threads spend their time.
+    """
+
+    def __init__(self, interval=0.005, thread_prefix=None, max_depth=64, idle_functions=IDLE_FUNCTIONS):
+        """
+        :param interval: Time between two samples in seconds.
+        :param thread_prefix: Only sample threads whose name starts with this prefix, all by default.
+        :param max_depth: Maximum number of frames kept per stack, from the innermost.
+        :param idle_functions: "file:function" names of the innermost frames of idle threads, not sampled.
+        """
+        self.interval = interval
+        self.thread_prefix = thread_prefix
+        self.max_depth = max_depth
+        self.idle_functions = idle_functions
+        self.stacks = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def _sampled_thread_ids(self):
+        own_id = threading.get_ident()
+        return {thread.ident for thread in threading.enumerate()
+                if thread.ident != own_id and (self.thread_prefix is None or thread.name.startswith(self.thread_prefix))}
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            thread_ids = self._sampled_thread_ids()
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None or _frame_name(frame) in self.idle_functions:
+                    continue
+                names = []
+                while frame is not None and len(names) < self.max_depth:
+                    names.append(_frame_name(frame))
+                    frame = frame.f_back
+                if names:
+                    stacks.append(";".join(reversed(names)))
+            with self.lock:
+                self.stacks.update(stacks)
+                self.samples += 1
+
+    def collapsed(self):
+        """
+        Get the samples as collapsed stacks, one "outer;...;inner count" line per distinct stack.
+        """
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, count=20):
+        """
+        Get the functions found most often at the top of the sampled stacks.
+        :return: List of (function, number of samples).
+        """
+        with self.lock:
+            leaves = Counter()
+            for stack, samples in self.stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += samples
+        return leaves.most_common(count)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+            "stacks": len(self.stacks)
+        }
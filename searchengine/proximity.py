@@ -0,0 +1,78 @@
+import heapq
+from bisect import bisect_left
+
+# Number of top documents reranked by proximity, at least the number of documents requested
+PROXIMITY_DEPTH = 100
+
+
+def term_positions(inverted_index, term, doc_ids):
+    """
+    Look up the positions of a term in some documents directly in its postings.
+    :param inverted_index: Index with get_postings and get_doc_ids.
+    :param term: Preprocessed term.
+    :param doc_ids: Document IDs.
+    :return: Dictionary doc_id -> sorted positions, for the documents containing the term.
+    """
+    postings = inverted_index.get_postings(term)
+    term_doc_ids = inverted_index.get_doc_ids(term)
+    positions = {}
+    for doc_id in doc_ids:
+        i = bisect_left(term_doc_ids, doc_id)
+        if i < len(term_doc_ids) and term_doc_ids[i] == doc_id:
+            positions[doc_id] = postings[i][2]
+    return positions
+
+
+def minimal_span(position_lists):
+    """
+    Find the length of the smallest window of a document holding one occurrence of every term.
+    :param position_lists: Non-empty sorted positions of each term.
+    :return: Number of positions of the window.
+    """
+    # Sweep the occurrences in position order, keeping the latest one of every term
+    heap = [(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    end = max(position for position, _, _ in heap)
+    best = end - heap[0][0]
+    while True:
+        start, i, j = heapq.heappop(heap)
+        best = min(best, end - start)
+        if j + 1 == len(position_lists[i]):
+            return best + 1
+        end = max(end, position_lists[i][j + 1])
+        heapq.heappush(heap, (position_lists[i][j + 1], i, j + 1))
+
+
+def proximity_score(position_lists):
+    """
+    Score how close the query terms found in a document are to each other: 1 when they are
+    adjacent, decreasing as the smallest window holding all of them grows, 0 with fewer than two.
+    :param position_lists: Sorted positions of each distinct query term in the document.
+    """
+    position_lists = [positions for positions in position_lists if positions]
+    if len(position_lists) < 2:
+        return 0.0
+    return len(position_lists) / minimal_span(position_lists)
+
+
+def rerank_by_proximity(inverted_index, terms, ranking, weight):
+    """
+    Boost the scores of a ranking by the proximity of the query terms in each document, adding
+    |score| * weight * proximity_score so that negative scores are raised too, and sort it again.
+    :param inverted_index: Index with get_postings and get_doc_ids.
+    :param terms: Preprocessed query terms.
+    :param ranking: List of (doc_id, score).
+    :param weight: Weight of the proximity boost, 0 to keep the ranking as is.
+    :return: List of (doc_id, score) sorted by descending score.
+    """
+    terms = list(dict.fromkeys(terms))
+    if weight <= 0 or len(terms) < 2 or not ranking:
+        return ranking
+    doc_ids = sorted(doc_id for doc_id, _ in ranking)
+    positions = [term_positions(inverted_index, term, doc_ids) for term in terms]
+    boosted = []
+    for doc_id, score in ranking:
+        proximity = proximity_score([doc_positions.get(doc_id) for doc_positions in positions])
+        boosted.append((doc_id, score + abs(score) * weight * proximity))
+    boosted.sort(key=lambda x: (-x[1], x[0]))
+    return boosted
@@ -0,0 +1,348 @@
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from math import inf, log
+
+from .metrics import count
+
+
+class TfIdfScorer:
+    """
+    TF-IDF scorer: (1 + log(tf)) * log(N / (1 + df)).
+    """
+    name = "TF-IDF"
+
+    def __init__(self, inverted_index):
+        self.total_docs = inverted_index.total_docs
+
+    def term_weight(self, doc_count_containing_term):
+        return log(self.total_docs / (1 + doc_count_containing_term))
+
+    def score(self, term_frequency, doc_id, term_weight):
+        return (1 + log(term_frequency)) * term_weight
+
+
+class BM25Scorer:
+    """
+    Okapi BM25 scorer. The length normalisation of every document is computed once, in a compact
+    array of doubles.
+    """
+    name = "BM25"
+
+    def __init__(self, inverted_index, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.total_docs = inverted_index.total_docs
+        avg_doc_length = inverted_index.avg_doc_length or 1
+        self.length_norms = array("d", (k1 * (1 - b + b * (doc_length / avg_doc_length))
+                                        for doc_length in inverted_index.doc_lengths))
+
+    def term_weight(self, doc_count_containing_term):
+        return log((self.total_docs - doc_count_containing_term + 0.5) / (doc_count_containing_term + 0.5) + 1)
+
+    def score(self, term_frequency, doc_id, term_weight):
+        return term_weight * (term_frequency * (self.k1 + 1)) / (term_frequency + self.length_norms[doc_id])
+
+
+# Registered scorers by ranking function name
+SCORERS = {
+    TfIdfScorer.name: TfIdfScorer,
+    BM25Scorer.name: BM25Scorer
+}
+
+
+def register_scorer(name, scorer_class):
+    """
+    Register a custom scorer class under a ranking function name.
+    :param name: Ranking function name, as passed to ScoringEngine.rank.
+    :param scorer_class: Class built from an inverted index, exposing term_weight and score.
+    """
+    SCORERS[name] = scorer_class
+
+
+def term_max_score(scorer, postings, document_frequency=None):
+    """
+    Compute the upper bound of the score contribution of a term in any document.
+    The bound is clamped at zero so that sums of bounds stay valid for negative weights.
+    :param scorer: Scorer instance.
+    :param postings: Postings list of the term.
+    :param document_frequency: Document frequency of the term, the length of the postings by default.
+    :return: Maximum score of the term over its postings.
+    """
+    if not postings:
+        return 0.0
+    term_weight = scorer.term_weight(len(postings) if document_frequency is None else document_frequency)
+    return max(0.0, max(scorer.score(term_frequency, doc_id, term_weight)
+                        for doc_id, term_frequency, _ in postings))
+
+
+def compute_max_scores(inverted_index, ranking_functions=None, collection_stats=None):
+    """
+    Precompute per-term score upper bounds for the registered scorers, to be stored in the index.
+    :param inverted_index: InvertedIndex instance.
+    :param ranking_functions: Names of the scorers to compute bounds for, all registered ones by default.
+    :param collection_stats: Optional CollectionStats of the whole collection when the index is one shard of it.
+    :return: Dictionary ranking_function -> {term: max_score}.
+    """
+    engine = ScoringEngine(inverted_index, collection_stats)
+    max_scores = {}
+    for ranking_function in ranking_functions or SCORERS:
+        scorer = engine.get_scorer(ranking_function)
+        max_scores[ranking_function] = {}
+        for term in inverted_index.terms():
+            postings = inverted_index.get_postings(term)
+            max_scores[ranking_function][term] = term_max_score(scorer, postings,
+                                                                engine.document_frequency(term, postings))
+    return max_scores
+
+
+class CollectionStats:
+    """
+    Statistics of a whole collection partitioned into shards. A shard scored with the statistics
+    of the collection instead of its own gives every document the score it has in the whole
+    collection, so the results of the shards can be merged by score.
+    """
+
+    def __init__(self, total_docs, total_terms, document_frequencies):
+        """
+        :param total_docs: Number of documents of the collection.
+        :param total_terms: Number of terms of the collection.
+        :param document_frequencies: Function term -> document frequency in the collection.
+        """
+        self.total_docs = total_docs
+        self.total_terms = total_terms
+        self.avg_doc_length = total_terms / total_docs if total_docs else 0.0
+        self.document_frequency = document_frequencies
+
+
+class _ShardScoringView:
+    """
+    Index of a shard as seen by the scorers: collection-wide corpus statistics with the document
+    lengths of the shard.
+    """
+
+    def __init__(self, inverted_index, collection_stats):
+        self.inverted_index = inverted_index
+        self.total_docs = collection_stats.total_docs
+        self.avg_doc_length = collection_stats.avg_doc_length
+
+    def __getattr__(self, name):
+        return getattr(self.inverted_index, name)
+
+
+def _cursor_doc_id(cursor):
+    return cursor.doc_id
+
+
+class _TermCursor:
+    """
+    Iterator over the postings of one query term, used by WAND.
+    """
+
+    def __init__(self, term_order, postings, doc_ids, term_weight, max_score):
+        self.term_order = term_order
+        self.postings = postings
+        self.doc_ids = doc_ids
+        self.term_weight = term_weight
+        self.max_score = max_score
+        self.position = 0
+        self.doc_id = doc_ids[0]
+
+    def next(self):
+        self.position += 1
+        self.doc_id = self.doc_ids[self.position] if self.position < len(self.doc_ids) else inf
+
+    def advance(self, target):
+        """
+        Move to the first posting with doc_id >= target.
+        """
+        self.position = bisect_left(self.doc_ids, target, self.position)
+        self.doc_id = self.doc_ids[self.position] if self.position < len(self.doc_ids) else inf
+
+
+class ScoringEngine:
+    """
+    Scoring engine driven by postings lists. Only the postings of the query terms are visited,
+    corpus statistics are computed once per scorer and top-k queries use WAND dynamic pruning.
+    """
+
+    def __init__(self, inverted_index, collection_stats=None):
+        """
+        :param inverted_index: Index to score.
+        :param collection_stats: Optional CollectionStats of the whole collection when the index
+            holds one shard of it, used instead of the statistics of the index.
+        """
+        self.inverted_index = inverted_index
+        self.collection_stats = collection_stats
+        self.scorers = {}
+        self.max_scores = defaultdict(dict)
+
+    def get_scorer(self, ranking_function):
+        scorer = self.scorers.get(ranking_function)
+        if scorer is None:
+            if ranking_function not in SCORERS:
+                raise ValueError(f"Unsupported ranking function: {ranking_function}")
+            if self.collection_stats is None:
+                scorer = SCORERS[ranking_function](self.inverted_index)
+            else:
+                scorer = SCORERS[ranking_function](_ShardScoringView(self.inverted_index, self.collection_stats))
+            self.scorers[ranking_function] = scorer
+        return scorer
+
+    def document_frequency(self, term, postings):
+        if self.collection_stats is None:
+            return len(postings)
+        return self.collection_stats.document_frequency(term)
+
+    def score(self, query_terms, ranking_function="TF-IDF", doc_ids=None):
+        """
+        Accumulate the scores of the documents containing at least one query term.
+        :param query_terms: List of preprocessed query terms (repeated terms count multiple times).
+        :param ranking_function: Name of a registered scorer.
+        :param doc_ids: Optional collection of document IDs to restrict scoring to.
+        :return: Dictionary doc_id -> score.
+        """
+        scorer = self.get_scorer(ranking_function)
+        allowed = set(doc_ids) if doc_ids is not None else None
+        accumulators = defaultdict(float)
+
+        for term, query_frequency in Counter(query_terms).items():
+            postings = self.inverted_index.get_postings(term)
+            if not postings:
+                continue
+            term_weight = scorer.term_weight(self.document_frequency(term, postings)) * query_frequency
+            for doc_id, term_frequency, _ in postings:
+                if allowed is None or doc_id in allowed:
+                    accumulators[doc_id] += scorer.score(term_frequency, doc_id, term_weight)
+
+        count("docs_scored", len(accumulators))
+        return accumulators
+
+    def rank(self, query_terms, ranking_function="TF-IDF", doc_ids=None):
+        """
+        Rank documents based on the query using the specified ranking function.
+        :return: List of (doc_id, score) sorted by descending score.
+        """
+        scores = self.score(query_terms, ranking_function, doc_ids)
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+
+    def top_k_many(self, queries, k=10, ranking_function="TF-IDF", doc_ids=None):
+        """
+        Retrieve the k best documents for each query of a batch. The postings of every distinct
+        term of the batch are fetched and scored once, then shared by the queries containing it.
+        :param queries: List of lists of preprocessed query terms.
+        :param k: Number of documents to return per query.
+        :param ranking_function: Name of a registered scorer.
+        :param doc_ids: Optional collection of document IDs to restrict scoring to.
+        :return: One list of (doc_id, score) per query, sorted by descending score.
+        """
+        scorer = self.get_scorer(ranking_function)
+        allowed = set(doc_ids) if doc_ids is not None else None
+
+        # Score contributions of every distinct term of the batch
+        contributions = {}
+        for term in {term for query_terms in queries for term in query_terms}:
+            postings = self.inverted_index.get_postings(term)
+            if postings:
+                term_weight = scorer.term_weight(self.document_frequency(term, postings))
+                contributions[term] = [(doc_id, scorer.score(term_frequency, doc_id, term_weight))
+                                       for doc_id, term_frequency, _ in postings
+                                       if allowed is None or doc_id in allowed]
+
+        results = []
+        for query_terms in queries:
+            accumulators = defaultdict(float)
+            for term, query_frequency in Counter(query_terms).items():
+                for doc_id, contribution in contributions.get(term, ()):
+                    accumulators[doc_id] += contribution * query_frequency
+            count("docs_scored", len(accumulators))
+            results.append(heapq.nsmallest(k, accumulators.items(), key=lambda x: (-x[1], x[0])))
+        return results
+
+    def max_score(self, term, ranking_function="TF-IDF"):
+        """
+        Get the score upper bound of a term, from the index if it was precomputed at build time.
+        """
+        stored = self.inverted_index.max_scores.get(ranking_function)
+        if stored is not None and term in stored:
+            return stored[term]
+        cached = self.max_scores[ranking_function]
+        if term not in cached:
+            postings = self.inverted_index.get_postings(term)
+            cached[term] = term_max_score(self.get_scorer(ranking_function), postings,
+                                          self.document_frequency(term, postings))
+        return cached[term]
+
+    def top_k(self, query_terms, k=10, ranking_function="TF-IDF", doc_ids=None):
+        """
+        Retrieve the k best documents with document-at-a-time WAND pruning and a bounded heap.
+        Documents whose score upper bound cannot beat the current k-th score are skipped.
+        :param query_terms: List of preprocessed query terms (repeated terms count multiple times).
+        :param k: Number of documents to return.
+        :param ranking_function: Name of a registered scorer.
+        :param doc_ids: Optional collection of document IDs to restrict scoring to.
+        :return: List of (doc_id, score) sorted by descending score, same order as rank.
+        """
+        if k <= 0:
+            return []
+        scorer = self.get_scorer(ranking_function)
+        allowed = set(doc_ids) if doc_ids is not None else None
+
+        cursors = []
+        for term_order, (term, query_frequency) in enumerate(Counter(query_terms).items()):
+            postings = self.inverted_index.get_postings(term)
+            if postings:
+                term_weight = scorer.term_weight(self.document_frequency(term, postings))
+                cursors.append(_TermCursor(term_order, postings, self.inverted_index.get_doc_ids(term),
+                                           term_weight * query_frequency,
+                                           self.max_score(term, ranking_function) * query_frequency))
+
+        heap = []  # Min-heap of (score, -doc_id) holding the current top k
+        threshold = -inf
+        scored = 0
+        while cursors:
+            cursors.sort(key=_cursor_doc_id)
+
+            # Find the pivot: first cursor where the accumulated upper bounds beat the threshold
+            upper_bound = 0.0
+            pivot = -1
+            for i, cursor in enumerate(cursors):
+                upper_bound += cursor.max_score
+                if upper_bound > threshold:
+                    pivot = i
+                    break
+            if pivot < 0:
+                break
+            pivot_doc = cursors[pivot].doc_id
+
+            if cursors[0].doc_id == pivot_doc:
+                # Every cursor up to the pivot is on the pivot document: score it fully,
+                # summing in query term order so that scores are identical to rank
+                contributions = []
+                for cursor in cursors:
+                    if cursor.doc_id != pivot_doc:
+                        break
+                    contributions.append((cursor.term_order, scorer.score(
+                        cursor.postings[cursor.position][1], pivot_doc, cursor.term_weight)))
+                    cursor.next()
+                if allowed is None or pivot_doc in allowed:
+                    scored += 1
+                    score = 0.0
+                    for _, contribution in sorted(contributions):
+                        score += contribution
+                    if len(heap) < k:
+                        heapq.heappush(heap, (score, -pivot_doc))
+                    elif (score, -pivot_doc) > heap[0]:
+                        heapq.heapreplace(heap, (score, -pivot_doc))
+                    if len(heap) == k:
+                        threshold = heap[0][0]
+            else:
+                # Skip the cursors before the pivot to the pivot document
+                for cursor in cursors[:pivot]:
+                    cursor.advance(pivot_doc)
+            if any(cursor.doc_id == inf for cursor in cursors):
+                cursors = [cursor for cursor in cursors if cursor.doc_id != inf]
+
+        count("docs_scored", scored)
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(heap, key=lambda x: (-x[0], -x[1]))]
@@ -0,0 +1,400 @@
+import os
+import threading
+
+from .analysis import default_analyzer
+from .binary_index import open_binary_index
+from .boolean_query import BooleanExecutor, expand_terms, parse_boolean_query, query_terms
+from .cache import CachedIndex, LRUCache
+from .encoding import load_file
+from .fuzzy import FuzzyMatcher
+from .index import load_inverted_index
+from .matrix import build_matrix_index, load_matrix_index
+from .metrics import count, stage
+from .proximity import PROXIMITY_DEPTH, rerank_by_proximity
+from .scoring import ScoringEngine
+from .segments import SegmentedIndex, open_segmented_index, read_manifest
+
+RANKING_FUNCTIONS = ("TF-IDF", "BM25")
+# "postings" walks postings lists with WAND, "matrix" scores with sparse matrix products
+SCORING_BACKENDS = ("postings", "matrix")
+
+
+def open_index(index_file):
+    """
+    Open an index file, memory-mapping binary indexes and parsing JSON ones.
+    :param index_file: Path to an inverted_index.bin or inverted_index.json file.
+    :return: BinaryIndex or InvertedIndex instance.
+    """
+    if index_file.endswith(".json"):
+        return load_inverted_index(index_file)
+    return open_binary_index(index_file)
+
+
+def files_generation(*paths):
+    """
+    Get a generation number of a set of files: the latest modification time of the ones that exist,
+    which changes whenever one of them is rewritten or removed after the others.
+    """
+    return max((os.stat(path).st_mtime_ns for path in paths if path and os.path.exists(path)), default=0)
+
+
+class IndexReader:
+    """
+    Read-only view over a built index and the hotel documents it was built from.
+    Document IDs of the index are positions in the documents list.
+    """
+
+    def __init__(self, inverted_index, documents, matrix_index=None, generation=0, source=None):
+        """
+        :param inverted_index: InvertedIndex, BinaryIndex or SegmentedIndex instance.
+        :param documents: List of raw hotel data, as scraped into hotel_data.json.
+        :param matrix_index: Optional precomputed MatrixIndex for the matrix scoring backend.
+        :param generation: Number identifying the version of the index, part of every cache key.
+        :param source: Optional (index_file, documents_file, matrix_file) the reader was opened from, to reopen it.
+        """
+        if len(documents) != inverted_index.total_docs:
+            raise ValueError(f"Index has {inverted_index.total_docs} documents but {len(documents)} were given")
+        if matrix_index is not None and matrix_index.total_docs != inverted_index.total_docs:
+            raise ValueError(f"Index has {inverted_index.total_docs} documents but the scoring matrices "
+                             f"have {matrix_index.total_docs}")
+        self.inverted_index = inverted_index
+        self.documents = documents
+        self.matrix_index = matrix_index
+        self.generation = generation
+        self.source = source
+
+    @classmethod
+    def open(cls, index_file="inverted_index.bin", documents_file="hotel_data.json",
+             matrix_file="inverted_index.npz"):
+        """
+        Open an index and its documents from disk. The generation is the latest modification time of
+        the index, documents and matrix files, which changes whenever any of them is rewritten.
+        :param index_file: Path to the binary or JSON index, or to an index directory written by an
+            IndexWriter, which holds its own documents: see open_segments.
+        :param documents_file: Path to the raw hotel data.
+        :param matrix_file: Path to the precomputed scoring matrices, loaded if the file exists.
+        :return: IndexReader instance.
+        """
+        if os.path.isdir(index_file):
+            return cls.open_segments(index_file)
+        # Read before the files, so that a file rewritten while they are read triggers another reopen
+        generation = files_generation(index_file, documents_file, matrix_file)
+        documents = load_file(documents_file)
+        matrix_index = None
+        if matrix_file and os.path.exists(matrix_file):
+            matrix_index = load_matrix_index(matrix_file)
+        return cls(open_index(index_file), documents, matrix_index, generation,
+                   (index_file, documents_file, matrix_file))
+
+    @classmethod
+    def open_segments(cls, directory, previous=None):
+        """
+        Open the live segments of an index directory. The generation is the manifest generation.
+        :param directory: Index directory written by an IndexWriter.
+        :param previous: Optional IndexReader of the same directory, whose open segments are reused.
+        :return: IndexReader instance.
+        """
+        previous_index = previous.inverted_index if previous is not None else None
+        try:
+            inverted_index, generation = open_segmented_index(directory, previous_index)
+        except FileNotFoundError:
+            # A merge removed a segment of the manifest that was read: read the new manifest
+            inverted_index, generation = open_segmented_index(directory, previous_index)
+        return cls(inverted_index, inverted_index.documents(), generation=generation, source=(directory, None, None))
+
+    def reopen(self):
+        """
+        Open the current version of the index if it changed since this reader was opened. The
+        segments of an index directory that did not change are shared with the new reader, so
+        this reader must be closed with the new one in others while it is in use.
+        :return: New IndexReader, or this reader if the index did not change.
+        """
+        if self.source is None:
+            return self
+        index_file, documents_file, matrix_file = self.source
+        if os.path.isdir(index_file):
+            if read_manifest(index_file)["generation"] == self.generation:
+                return self
+            return self.open_segments(index_file, self)
+        # The matrices are written after the index: a reopen between the two writes is followed by another
+        if files_generation(index_file, documents_file, matrix_file) == self.generation:
+            return self
+        return self.open(index_file, documents_file, matrix_file)
+
+    def get_matrix_index(self):
+        """
+        Get the scoring matrices, building them from the index if they were not precomputed.
+        """
+        if self.matrix_index is None:
+            self.matrix_index = build_matrix_index(self.inverted_index)
+        return self.matrix_index
+
+    @property
+    def total_docs(self):
+        return self.inverted_index.total_docs
+
+    def stats(self):
+        return self.inverted_index.stats()
+
+    def document(self, doc_id):
+        return self.documents[doc_id]
+
+    def doc_name(self, doc_id):
+        return self.documents[doc_id]["basic_data"]["name"]
+
+    def close(self, others=()):
+        """
+        Release the files of the index.
+        :param others: Readers still in use: the segments this reader shares with the ones reopened
+            from it stay open.
+        """
+        if isinstance(self.inverted_index, SegmentedIndex):
+            self.inverted_index.close([reader.inverted_index for reader in others
+                                       if isinstance(reader.inverted_index, SegmentedIndex)])
+        elif hasattr(self.inverted_index, "close"):
+            self.inverted_index.close()
+
+
+class Searcher:
+    """
+    Query pipeline shared by the server and the command line tools: parsing, Boolean matching
+    and ranking over an IndexReader. Scorer statistics and the fuzzy matcher of misspelled terms
+    are computed once for the lifetime of the searcher. Search results, decoded postings lists and
+    Boolean term sets are kept in LRU caches keyed by the index generation, so caches shared with
+    a searcher over a rebuilt index never serve stale entries.
+    """
+
+    def __init__(self, reader, analyzer=default_analyzer, scoring_backend="postings",
+                 result_cache=None, postings_cache=None, collection_stats=None, term_set_cache=None):
+        """
+        :param reader: IndexReader instance.
+        :param analyzer: Analyzer of the queries, which must be the analyzer of the index.
+        :param scoring_backend: Default scoring backend, one of SCORING_BACKENDS.
+        :param result_cache: LRUCache of search results, a new one holding 1024 results by default.
+        :param postings_cache: LRUCache of decoded postings lists, a new one holding 4096 lists by default.
+        :param collection_stats: Optional CollectionStats of the whole collection when the reader holds
+            one shard of it, to score with the statistics of the collection (postings backend only).
+        :param term_set_cache: LRUCache of the document sets of Boolean terms, a new one holding 4096 sets by default.
+        """
+        if scoring_backend not in SCORING_BACKENDS:
+            raise ValueError(f"Unsupported scoring backend: {scoring_backend}")
+        index_analyzer = reader.inverted_index.analyzer
+        if index_analyzer is not None and index_analyzer != analyzer.fingerprint:
+            raise ValueError(f"Index was built with analyzer {index_analyzer} but queries are analyzed "
+                             f"with {analyzer.fingerprint}: reprocess the data and rebuild the index")
+        self.reader = reader
+        self.analyzer = analyzer
+        self.preprocess = analyzer.analyze
+        self.scoring_backend = scoring_backend
+        self.result_cache = result_cache if result_cache is not None else LRUCache(maxsize=1024)
+        self.postings_cache = postings_cache if postings_cache is not None else LRUCache(maxsize=4096)
+        inverted_index = CachedIndex(reader.inverted_index, self.postings_cache, reader.generation)
+        self.collection_stats = collection_stats
+        self.scoring_engine = ScoringEngine(inverted_index, collection_stats)
+        self.term_set_cache = term_set_cache if term_set_cache is not None else LRUCache(maxsize=4096)
+        self.boolean_executor = BooleanExecutor(inverted_index, self.term_set_cache, reader.generation)
+        # Expansions depend on the term dictionary, this cache is not shared with reopened searchers
+        self.fuzzy_cache = LRUCache(maxsize=4096)
+        self._fuzzy_matcher = None
+        self._fuzzy_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, index_file="inverted_index.bin", documents_file="hotel_data.json", scoring_backend="postings"):
+        return cls(IndexReader.open(index_file, documents_file), scoring_backend=scoring_backend)
+
+    def parse(self, query, fuzzy=False):
+        """
+        Parse a raw query into a Boolean query AST.
+        :param fuzzy: Whether terms missing from the index are replaced by the OR of the closest
+            terms of the index, see FuzzyMatcher.
+        """
+        with stage("parse"):
+            query_tree = parse_boolean_query(query, self._analyze)
+        if fuzzy:
+            with stage("fuzzy"):
+                query_tree = expand_terms(query_tree, self.fuzzy_matcher.expand)
+        return query_tree
+
+    @property
+    def fuzzy_matcher(self):
+        # Built on first use: its n-gram index covers the whole term dictionary
+        if self._fuzzy_matcher is None:
+            with self._fuzzy_lock:
+                if self._fuzzy_matcher is None:
+                    self._fuzzy_matcher = FuzzyMatcher(self.reader.inverted_index, cache=self.fuzzy_cache)
+        return self._fuzzy_matcher
+
+    def _analyze(self, text):
+        with stage("analyze"):
+            return self.preprocess(text)
+
+    def match(self, query, fuzzy=False):
+        """
+        Find the documents matching a Boolean query.
+        :param query: Raw query string or parsed query AST.
+        :param fuzzy: Whether misspelled terms of a raw query are expanded, see parse.
+        :return: Sorted list of matching document IDs.
+        """
+        query_tree = self.parse(query, fuzzy) if isinstance(query, str) else query
+        with stage("match"):
+            matching_docs = self.boolean_executor.execute(query_tree)
+        count("docs_matched", len(matching_docs))
+        return matching_docs
+
+    def get_ranker(self, scoring_backend=None):
+        """
+        Get the object ranking documents for a scoring backend; both expose the same top_k method.
+        :param scoring_backend: One of SCORING_BACKENDS, the searcher default if None.
+        """
+        scoring_backend = scoring_backend or self.scoring_backend
+        if scoring_backend == "postings":
+            return self.scoring_engine
+        if scoring_backend == "matrix":
+            return self.reader.get_matrix_index()
+        raise ValueError(f"Unsupported scoring backend: {scoring_backend}")
+
+    def rank(self, query, k=10, ranking_function="TF-IDF", scoring_backend=None, proximity=0.0, fuzzy=False):
+        """
+        Rank documents against the terms of a query.
+        :param query: Raw query string or parsed query AST.
+        :param k: Number of documents to return.
+        :param ranking_function: Name of a registered scorer.
+        :param scoring_backend: One of SCORING_BACKENDS, the searcher default if None.
+        :param proximity: Weight of the boost of documents where the query terms are close, 0 for none.
+        :param fuzzy: Whether misspelled terms of a raw query are expanded, see parse.
+        :return: List of (doc_id, score) sorted by descending score.
+        """
+        query_tree = self.parse(query, fuzzy) if isinstance(query, str) else query
+        ranker = self.get_ranker(scoring_backend)
+        terms = query_terms(query_tree)
+        with stage(f"rank:{ranking_function}"):
+            ranking = ranker.top_k(terms, self._rank_depth(k, proximity), ranking_function=ranking_function)
+        return self._boost(terms, ranking, k, proximity)
+
+    def _rank_depth(self, k, proximity):
+        # The proximity boost reorders the top documents, rank enough of them to fill the top k
+        return max(k, PROXIMITY_DEPTH) if proximity else k
+
+    def _boost(self, terms, ranking, k, proximity):
+        if not proximity:
+            return ranking
+        with stage("proximity"):
+            return rerank_by_proximity(self.scoring_engine.inverted_index, terms, ranking, proximity)[:k]
+
+    def _result_key(self, query_tree, k, ranking_functions, scoring_backend, proximity):
+        # Queries are normalized by their parsed form: case, spacing, stopwords and word forms
+        # that do not change the AST share a cache entry
+        return (self.reader.generation, query_tree, k, tuple(ranking_functions),
+                scoring_backend or self.scoring_backend, proximity)
+
+    def search(self, query, k=10, ranking_functions=RANKING_FUNCTIONS, scoring_backend=None, proximity=0.0,
+               fuzzy=False):
+        """
+        Run the full pipeline for a query: Boolean matching and one ranking per ranking function.
+        Results are cached and shared between calls: they must not be modified.
+        :param query: Raw query string or parsed query AST.
+        :param k: Number of ranked documents to return per ranking function.
+        :param ranking_functions: Names of the scorers to rank with.
+        :param scoring_backend: One of SCORING_BACKENDS, the searcher default if None.
+        :param proximity: Weight of the proximity boost of the rankings, 0 for none.
+        :param fuzzy: Whether misspelled terms of a raw query are expanded, see parse. Results are
+            cached by the expanded query, shared with the queries spelled correctly.
+        :return: Dictionary with the matching document IDs and the rankings by ranking function.
+        """
+        query_tree = self.parse(query, fuzzy) if isinstance(query, str) else query
+        key = self._result_key(query_tree, k, ranking_functions, scoring_backend, proximity)
+        results = self.result_cache.get(key)
+        if results is not None:
+            count("result_cache_hits")
+            return results
+        count("result_cache_misses")
+        results = {
+            "matching_docs": self.match(query_tree),
+            "rankings": {ranking_function: self.rank(query_tree, k, ranking_function, scoring_backend, proximity)
+                         for ranking_function in ranking_functions}
+        }
+        self.result_cache.put(key, results)
+        return results
+
+    def rank_many(self, queries, k=10, ranking_function="TF-IDF", scoring_backend=None, proximity=0.0,
+                  fuzzy=False):
+        """
+        Rank documents for a batch of queries, sharing postings and scores between queries.
+        :param queries: List of raw query strings or parsed query ASTs.
+        :param k: Number of documents to return per query.
+        :param ranking_function: Name of a registered scorer.
+        :param scoring_backend: One of SCORING_BACKENDS, the searcher default if None.
+        :param proximity: Weight of the proximity boost, 0 for none.
+        :param fuzzy: Whether misspelled terms of raw queries are expanded, see parse.
+        :return: One list of (doc_id, score) per query, sorted by descending score.
+        """
+        query_trees = [self.parse(query, fuzzy) if isinstance(query, str) else query for query in queries]
+        ranker = self.get_ranker(scoring_backend)
+        terms = [query_terms(query_tree) for query_tree in query_trees]
+        with stage(f"rank:{ranking_function}"):
+            rankings = ranker.top_k_many(terms, self._rank_depth(k, proximity), ranking_function=ranking_function)
+        return [self._boost(ranking_terms, ranking, k, proximity) for ranking_terms, ranking in zip(terms, rankings)]
+
+    def search_many(self, queries, k=10, ranking_functions=RANKING_FUNCTIONS, scoring_backend=None, proximity=0.0,
+                    fuzzy=False):
+        """
+        Run the full pipeline for a batch of queries. Repeated and cached queries are processed
+        once and each ranking function scores the remaining queries together.
+        :param queries: List of raw query strings.
+        :param k: Number of ranked documents to return per query and ranking function.
+        :param ranking_functions: Names of the scorers to rank with.
+        :param scoring_backend: One of SCORING_BACKENDS, the searcher default if None.
+        :param proximity: Weight of the proximity boost of the rankings, 0 for none.
+        :param fuzzy: Whether misspelled terms are expanded, see parse.
+        :return: One result per query, in the format of search.
+        """
+        query_trees = {query: self.parse(query, fuzzy) for query in queries}
+        results = {}
+        missing = []
+        for query_tree in dict.fromkeys(query_trees.values()):
+            key = self._result_key(query_tree, k, ranking_functions, scoring_backend, proximity)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                results[query_tree] = cached
+            else:
+                missing.append(query_tree)
+        count("result_cache_hits", len(results))
+        count("result_cache_misses", len(missing))
+
+        rankings = {ranking_function: self.rank_many(missing, k, ranking_function, scoring_backend, proximity)
+                    for ranking_function in ranking_functions}
+        for i, query_tree in enumerate(missing):
+            results[query_tree] = {
+                "matching_docs": self.match(query_tree),
+                "rankings": {ranking_function: rankings[ranking_function][i]
+                             for ranking_function in ranking_functions}
+            }
+            self.result_cache.put(self._result_key(query_tree, k, ranking_functions, scoring_backend, proximity),
+                                  results[query_tree])
+        return [results[query_trees[query]] for query in queries]
+
+    def reopen(self):
+        """
+        Get a searcher over the current version of the index, sharing the caches of this searcher:
+        their keys include the index generation, so entries of the previous version are not served.
+        :return: New Searcher, or this searcher if the index did not change.
+        """
+        reader = self.reader.reopen()
+        if reader is self.reader:
+            return self
+        return Searcher(reader, self.analyzer, self.scoring_backend, self.result_cache, self.postings_cache,
+                        self.collection_stats, self.term_set_cache)
+
+    def cache_stats(self):
+        """
+        Get the size and hit/miss counters of the search result, postings, term set, fuzzy expansion and stem
+        caches.
+        """
+        return {
+            "generation": self.reader.generation,
+            "results": self.result_cache.stats(),
+            "postings": self.postings_cache.stats(),
+            "term_sets": self.term_set_cache.stats(),
+            "fuzzy": self.fuzzy_cache.stats(),
+            "stems": self.analyzer.stem_cache.stats()
+        }
@@ -0,0 +1,590 @@
+import json
+import os
+import threading
+from bisect import bisect_right
+from collections import defaultdict
+from math import log
+
+from .analysis import default_analyzer
+from .binary_index import open_binary_index, write_binary_index
+from .documents import document_key, preprocess_hotel
+from .encoding import load_file, loads
+from .index import InvertedIndex, build_inverted_index
+
+# Index directory layout:
+#   manifest.json               generation, analyzer and the ordered list of live segments with
+#                               their tombstones; replaced atomically on every commit and merge
+#   seg_NNNNNN.bin              binary index of the segment, immutable once written
+#   seg_NNNNNN.docs.jsonl       raw hotels of the segment, one per line, in local document ID order
+#   seg_NNNNNN.keys.json        keys of the hotels of the segment, see documents.document_key
+#   write.lock                  held by the IndexWriter of the directory
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = "write.lock"
+SEGMENT_EXTENSIONS = (".bin", ".docs.jsonl", ".keys.json")
+
+
+def segment_path(directory, name, extension):
+    return os.path.join(directory, name + extension)
+
+
+def read_manifest(directory):
+    """
+    Read the manifest of an index directory.
+    :return: Manifest dictionary, an empty index if the directory has no manifest yet.
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"generation": 0, "analyzer": None, "next_segment": 0, "segments": []}
+
+
+def write_manifest(directory, manifest):
+    """
+    Replace the manifest of an index directory atomically: readers see either the old or the new one.
+    """
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def write_segment(directory, name, inverted_index, documents, keys):
+    """
+    Write the files of a segment.
+    :param inverted_index: InvertedIndex of the documents.
+    :param documents: List of raw hotels, in local document ID order.
+    :param keys: List of the keys of the documents.
+    """
+    write_binary_index(inverted_index, segment_path(directory, name, ".bin"))
+    with open(segment_path(directory, name, ".docs.jsonl"), "w") as f:
+        for doc in documents:
+            f.write(json.dumps(doc) + "\n")
+    with open(segment_path(directory, name, ".keys.json"), "w") as f:
+        json.dump(keys, f)
+
+
+class Segment:
+    """
+    Immutable segment of an index directory: a memory-mapped binary index with the documents and
+    keys it was built from, both loaded on first use.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.index = open_binary_index(segment_path(directory, name, ".bin"))
+        self._documents = None
+        self._keys = None
+
+    @property
+    def doc_count(self):
+        return self.index.total_docs
+
+    @property
+    def documents(self):
+        if self._documents is None:
+            with open(segment_path(self.directory, self.name, ".docs.jsonl"), "rb") as f:
+                self._documents = [loads(line) for line in f]
+        return self._documents
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._keys = load_file(segment_path(self.directory, self.name, ".keys.json"))
+        return self._keys
+
+    def close(self):
+        self.index.close()
+
+
+class SegmentedIndex:
+    """
+    Read-only index over the live documents of a list of segments, with the interface of
+    InvertedIndex. Live documents are numbered consecutively in segment order, so that document
+    IDs, statistics and scores are those of a single index built from the live documents.
+    Per-term score upper bounds depend on the statistics of all the segments: they are not
+    stored, ScoringEngine computes them on first use.
+    """
+
+    def __init__(self, segments, deleted=None, analyzer=None):
+        """
+        :param segments: List of Segment instances.
+        :param deleted: Optional dictionary segment name -> collection of deleted local document IDs.
+        :param analyzer: Fingerprint of the Analyzer of the segments.
+        """
+        deleted = deleted or {}
+        self.segments = segments
+        self.analyzer = analyzer
+        self.max_scores = {}
+        self.bases = []  # First global document ID of each segment
+        self.live = []  # Sorted live local document IDs of each segment
+        self.remaps = []  # Local -> global document ID of each segment with deletions (-1 if deleted), or None
+        self.doc_lengths = []
+        for segment in segments:
+            segment_deleted = set(deleted.get(segment.name, ()))
+            self.bases.append(len(self.doc_lengths))
+            live = [doc_id for doc_id in range(segment.doc_count) if doc_id not in segment_deleted]
+            remap = None
+            if len(live) < segment.doc_count:
+                remap = [-1] * segment.doc_count
+                for i, doc_id in enumerate(live, len(self.doc_lengths)):
+                    remap[doc_id] = i
+            self.live.append(live)
+            self.remaps.append(remap)
+            self.doc_lengths.extend(segment.index.doc_length(doc_id) for doc_id in live)
+        self.ends = [base + len(live) for base, live in zip(self.bases, self.live)]
+        self.total_docs = len(self.doc_lengths)
+        self.total_terms = sum(self.doc_lengths)
+        self.avg_doc_length = self.total_terms / self.total_docs if self.total_docs else 0.0
+        self._terms = None
+
+    def __contains__(self, term):
+        return any(term in segment.index for segment in self.segments)
+
+    def __len__(self):
+        return len(self.terms())
+
+    def terms(self):
+        # Terms of deleted documents are kept until their segment is merged, with empty postings
+        if self._terms is None:
+            self._terms = sorted({term for segment in self.segments for term in segment.index.terms()})
+        return self._terms
+
+    def get_postings(self, term):
+        """
+        Get the postings list of a term over the live documents.
+        :param term: Preprocessed term.
+        :return: List of (doc_id, term_frequency, positions), empty if the term is unknown.
+        """
+        postings = []
+        for segment, base, remap in zip(self.segments, self.bases, self.remaps):
+            segment_postings = segment.index.get_postings(term)
+            if remap is None:
+                postings.extend((base + doc_id, tf, positions) for doc_id, tf, positions in segment_postings)
+            else:
+                postings.extend((remap[doc_id], tf, positions) for doc_id, tf, positions in segment_postings
+                                if remap[doc_id] >= 0)
+        return postings
+
+    def get_doc_ids(self, term):
+        doc_ids = []
+        for segment, base, remap in zip(self.segments, self.bases, self.remaps):
+            segment_doc_ids = segment.index.get_doc_ids(term)
+            if remap is None:
+                doc_ids.extend(base + doc_id for doc_id in segment_doc_ids)
+            else:
+                doc_ids.extend(remap[doc_id] for doc_id in segment_doc_ids if remap[doc_id] >= 0)
+        return doc_ids
+
+    def document_frequency(self, term):
+        return len(self.get_doc_ids(term))
+
+    def locate(self, doc_id):
+        """
+        Find the segment of a live document.
+        :return: Tuple (segment index, local document ID).
+        """
+        # First segment ending after the document, segments without live documents are skipped
+        i = bisect_right(self.ends, doc_id)
+        return i, self.live[i][doc_id - self.bases[i]]
+
+    def term_frequency(self, term, doc_id):
+        i, local_doc_id = self.locate(doc_id)
+        return self.segments[i].index.term_frequency(term, local_doc_id)
+
+    def doc_length(self, doc_id):
+        return self.doc_lengths[doc_id]
+
+    def documents(self):
+        """
+        Get the raw hotels of the live documents, indexed by document ID.
+        """
+        return [segment.documents[doc_id] for segment, live in zip(self.segments, self.live) for doc_id in live]
+
+    def stats(self):
+        return {
+            "total_docs": self.total_docs,
+            "total_terms": self.total_terms,
+            "avg_doc_length": self.avg_doc_length,
+            "vocabulary_size": len(self.terms()),
+            "segments": len(self.segments)
+        }
+
+    def close(self, others=()):
+        """
+        Close the segments of this index.
+        :param others: SegmentedIndex instances still in use, the segments shared with them stay open.
+        """
+        shared = {id(segment) for other in others for segment in other.segments}
+        for segment in self.segments:
+            if id(segment) not in shared:
+                segment.close()
+
+
+def open_segmented_index(directory, previous=None):
+    """
+    Open the live segments of an index directory.
+    :param directory: Index directory written by an IndexWriter.
+    :param previous: Optional SegmentedIndex of the same directory, whose open segments are reused.
+    :return: Tuple (SegmentedIndex, manifest generation).
+    """
+    manifest = read_manifest(directory)
+    open_segments = {segment.name: segment for segment in previous.segments} if previous is not None else {}
+    segments = [open_segments.get(entry["name"]) or Segment(directory, entry["name"])
+                for entry in manifest["segments"]]
+    deleted = {entry["name"]: entry["deleted"] for entry in manifest["segments"]}
+    return SegmentedIndex(segments, deleted, manifest["analyzer"]), manifest["generation"]
+
+
+class TieredMergePolicy:
+    """
+    Merge policy grouping segments in tiers of live document counts growing by a factor of
+    segments_per_tier: once segments_per_tier adjacent segments share a tier, they are merged into
+    one segment of the next tier. Each document is thus rewritten about log(N) times. Segments
+    with more than max_deleted_ratio of their documents deleted are rewritten on their own to
+    reclaim space.
+    """
+
+    def __init__(self, segments_per_tier=10, floor_segment_size=100, max_deleted_ratio=0.5):
+        """
+        :param segments_per_tier: Number of segments of a tier that triggers their merge.
+        :param floor_segment_size: Segments smaller than this are all in the lowest tier.
+        :param max_deleted_ratio: Ratio of deleted documents that triggers a segment rewrite.
+        """
+        self.segments_per_tier = segments_per_tier
+        self.floor_segment_size = floor_segment_size
+        self.max_deleted_ratio = max_deleted_ratio
+
+    def tier(self, live_docs):
+        return int(log(max(live_docs, self.floor_segment_size) / self.floor_segment_size, self.segments_per_tier))
+
+    def find_merges(self, segments):
+        """
+        Find the segments to merge.
+        :param segments: List of (name, doc_count, deleted_count), in index order.
+        :return: List of lists of adjacent segment names, each to merge into a single segment.
+        """
+        merges = []
+        run = []
+        run_tier = None
+        for name, doc_count, deleted_count in segments:
+            tier = self.tier(doc_count - deleted_count)
+            if tier != run_tier:
+                run, run_tier = [], tier
+            run.append(name)
+            if len(run) == self.segments_per_tier:
+                merges.append(run)
+                run, run_tier = [], None
+        merged = {name for merge in merges for name in merge}
+        for name, doc_count, deleted_count in segments:
+            if name not in merged and doc_count and deleted_count / doc_count > self.max_deleted_ratio:
+                merges.append([name])
+        return merges
+
+
+class IndexWriter:
+    """
+    Incremental writer of an index directory. Added hotels are buffered and written as a new
+    immutable segment on commit; a hotel whose key is already indexed replaces the indexed one,
+    which is marked deleted with a tombstone in the manifest. Commits and merges publish a new
+    manifest generation, that readers pick up with IndexReader.reopen.
+
+    Segments are merged by a TieredMergePolicy, in a background thread by default. Deletions
+    made while a merge runs are carried over to the merged segment. Files of merged segments are
+    removed one generation later, so that readers opening the previous manifest can still open them,
+    and segment files left unreferenced by a previous writer are removed when a writer opens.
+    A directory has a single writer at a time.
+    """
+
+    def __init__(self, directory, analyzer=default_analyzer, merge_policy=None, background_merge=True):
+        """
+        :param directory: Index directory, created if needed.
+        :param analyzer: Analyzer of the hotels, which must be the analyzer of the existing segments.
+        :param merge_policy: TieredMergePolicy instance, the default policy if None.
+        :param background_merge: Whether to merge in a background thread rather than during commit.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+        try:
+            os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            raise RuntimeError(f"Index directory {directory} is locked by another writer, "
+                               f"remove {self.lock_path} if no writer is running") from None
+
+        self.manifest = read_manifest(directory)
+        if self.manifest["analyzer"] not in (None, analyzer.fingerprint):
+            self._release_lock()
+            raise ValueError(f"Index was built with analyzer {self.manifest['analyzer']} "
+                             f"but documents are analyzed with {analyzer.fingerprint}")
+        self.analyzer = analyzer
+        self.merge_policy = merge_policy or TieredMergePolicy()
+        self.background_merge = background_merge
+        self.lock = threading.RLock()
+        self.segments = {entry["name"]: Segment(directory, entry["name"]) for entry in self.manifest["segments"]}
+        self.deleted = {entry["name"]: set(entry["deleted"]) for entry in self.manifest["segments"]}
+        self.pending_deletes = defaultdict(set)  # Uncommitted tombstones by segment name
+        self.buffer = {}  # Uncommitted hotels by key
+        self.merging = set()  # Names of the segments being merged
+        self.obsolete = []  # Names of merged segments whose files are removed on the next publication
+        self.merge_thread = None
+        self.merge_error = None
+        self._remove_segment_files(self._unreferenced_segments())
+
+        # Locate the live document of every key
+        self.locations = {}
+        for name, segment in self.segments.items():
+            for doc_id, key in enumerate(segment.keys):
+                if doc_id not in self.deleted[name]:
+                    self.locations[key] = (name, doc_id)
+
+    def _unreferenced_segments(self):
+        """
+        Get the names of the segments with files in the directory but not in the manifest: merged away
+        in the last generation of a previous writer, or partly written by a writer that crashed.
+        """
+        names = set()
+        for file_name in os.listdir(self.directory):
+            for extension in SEGMENT_EXTENSIONS:
+                if file_name.startswith("seg_") and file_name.endswith(extension):
+                    names.add(file_name[:-len(extension)])
+        return names - set(self.segments)
+
+    def _remove_segment_files(self, names):
+        for name in names:
+            for extension in SEGMENT_EXTENSIONS:
+                path = segment_path(self.directory, name, extension)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _release_lock(self):
+        if os.path.exists(self.lock_path):
+            os.remove(self.lock_path)
+
+    def add_documents(self, hotels):
+        """
+        Add or replace hotels, visible to readers after the next commit.
+        :param hotels: Iterable of raw hotels.
+        """
+        with self.lock:
+            for hotel in hotels:
+                key = document_key(hotel)
+                self._delete(key)
+                self.buffer[key] = hotel
+
+    def delete_documents(self, keys):
+        """
+        Delete hotels by key, visible to readers after the next commit.
+        :param keys: Iterable of hotel keys.
+        """
+        with self.lock:
+            for key in keys:
+                self._delete(key)
+                self.buffer.pop(key, None)
+
+    def _delete(self, key):
+        location = self.locations.pop(key, None)
+        if location is not None:
+            self.pending_deletes[location[0]].add(location[1])
+
+    def _new_segment_name(self):
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        return name
+
+    def _publish(self, names):
+        """
+        Write the manifest of the given segments and their committed tombstones as a new generation,
+        then remove the files of the segments that were obsolete in the previous generation.
+        """
+        self.manifest["generation"] += 1
+        self.manifest["analyzer"] = self.analyzer.fingerprint
+        self.manifest["segments"] = [{"name": name, "doc_count": self.segments[name].doc_count,
+                                      "deleted": sorted(self.deleted[name])} for name in names]
+        write_manifest(self.directory, self.manifest)
+        obsolete, self.obsolete = self.obsolete, []
+        self._remove_segment_files(obsolete)
+        return self.manifest["generation"]
+
+    def _segment_names(self):
+        return [entry["name"] for entry in self.manifest["segments"]]
+
+    def commit(self):
+        """
+        Write the buffered hotels as a new segment and publish them with the pending deletions.
+        Nothing is published when there are no changes, so that readers do not reload for nothing.
+        :return: Generation of the published manifest, the current one without changes.
+        """
+        self._raise_merge_error()
+        with self.lock:
+            if not self.buffer and not any(self.pending_deletes.values()):
+                return self.manifest["generation"]
+            names = self._segment_names()
+            if self.buffer:
+                name = self._new_segment_name()
+                keys = list(self.buffer)
+                documents = list(self.buffer.values())
+                inverted_index = build_inverted_index(preprocess_hotel(hotel, self.analyzer) for hotel in documents)
+                write_segment(self.directory, name, inverted_index, documents, keys)
+                self.segments[name] = Segment(self.directory, name)
+                self.deleted[name] = set()
+                for doc_id, key in enumerate(keys):
+                    self.locations[key] = (name, doc_id)
+                names.append(name)
+                self.buffer = {}
+            for name, doc_ids in self.pending_deletes.items():
+                self.deleted[name] |= doc_ids
+            self.pending_deletes = defaultdict(set)
+            generation = self._publish(names)
+        self.maybe_merge()
+        return generation
+
+    def maybe_merge(self):
+        """
+        Run the merges selected by the merge policy, in the background thread if enabled.
+        """
+        if not self.background_merge:
+            while self._merge_next():
+                pass
+            return
+        with self.lock:
+            if self.merge_thread is None or not self.merge_thread.is_alive():
+                self.merge_thread = threading.Thread(target=self._merge_loop, name="index-merge", daemon=True)
+                self.merge_thread.start()
+
+    def _merge_loop(self):
+        try:
+            while self._merge_next():
+                pass
+        except Exception as e:
+            self.merge_error = e
+
+    def _raise_merge_error(self):
+        if self.merge_error is not None:
+            error, self.merge_error = self.merge_error, None
+            raise RuntimeError("Background segment merge failed") from error
+
+    def _merge_next(self):
+        """
+        Run the first merge selected by the merge policy.
+        :return: Whether a merge was run.
+        """
+        with self.lock:
+            candidates = [(name, self.segments[name].doc_count, len(self.deleted[name]))
+                          for name in self._segment_names()]
+            merges = [merge for merge in self.merge_policy.find_merges(candidates)
+                      if not self.merging.intersection(merge)]
+            if not merges:
+                return False
+            names = merges[0]
+            self.merging.update(names)
+            snapshot = {name: set(self.deleted[name]) for name in names}
+            merged_name = self._new_segment_name()
+        try:
+            self._merge_segments(names, merged_name, snapshot)
+        finally:
+            with self.lock:
+                self.merging.difference_update(names)
+        return True
+
+    def force_merge(self):
+        """
+        Commit, then merge all the segments into one.
+        :return: Generation of the published manifest.
+        """
+        generation = self.commit()
+        self.wait_for_merges()
+        with self.lock:
+            names = self._segment_names()
+            if len(names) < 2 and not any(self.deleted[name] for name in names):
+                return generation
+            self.merging.update(names)
+            snapshot = {name: set(self.deleted[name]) for name in names}
+            merged_name = self._new_segment_name()
+        try:
+            return self._merge_segments(names, merged_name, snapshot)
+        finally:
+            with self.lock:
+                self.merging.difference_update(names)
+
+    def _merge_segments(self, names, merged_name, deleted):
+        """
+        Merge adjacent segments into one and publish it in their place.
+        :param names: Names of adjacent segments, in index order.
+        :param merged_name: Name of the merged segment.
+        :param deleted: Committed tombstones of the segments when the merge started, dropped from the merged segment.
+        :return: Generation of the published manifest.
+        """
+        with self.lock:
+            segments = [self.segments[name] for name in names]
+
+        # Rewrite the live documents of the segments, without re-analyzing them
+        postings = defaultdict(list)
+        doc_lengths, documents, keys, remaps = [], [], [], []
+        for segment in segments:
+            remap = {}
+            for doc_id in range(segment.doc_count):
+                if doc_id not in deleted[segment.name]:
+                    remap[doc_id] = len(doc_lengths)
+                    doc_lengths.append(segment.index.doc_length(doc_id))
+                    documents.append(segment.documents[doc_id])
+                    keys.append(segment.keys[doc_id])
+            for term in segment.index.terms():
+                postings[term].extend((remap[doc_id], tf, positions)
+                                      for doc_id, tf, positions in segment.index.get_postings(term)
+                                      if doc_id in remap)
+            remaps.append(remap)
+        inverted_index = InvertedIndex({term: term_postings for term, term_postings in postings.items() if term_postings},
+                                       doc_lengths, analyzer=self.analyzer.fingerprint)
+        write_segment(self.directory, merged_name, inverted_index, documents, keys)
+        merged = Segment(self.directory, merged_name)
+
+        with self.lock:
+            # Carry over the tombstones and locations that changed during the merge
+            self.segments[merged_name] = merged
+            self.deleted[merged_name] = set()
+            for segment, remap in zip(segments, remaps):
+                for doc_id in self.deleted[segment.name] - deleted[segment.name]:
+                    self.deleted[merged_name].add(remap[doc_id])
+                if segment.name in self.pending_deletes:
+                    self.pending_deletes[merged_name].update(remap[doc_id]
+                                                             for doc_id in self.pending_deletes.pop(segment.name))
+                for doc_id, new_doc_id in remap.items():
+                    key = segment.keys[doc_id]
+                    if self.locations.get(key) == (segment.name, doc_id):
+                        self.locations[key] = (merged_name, new_doc_id)
+
+            current = self._segment_names()
+            start = current.index(names[0])
+            published = current[:start] + [merged_name] + current[start + len(names):]
+            for name in names:
+                del self.segments[name]
+                del self.deleted[name]
+            generation = self._publish(published)
+            self.obsolete.extend(names)
+        for segment in segments:
+            segment.close()
+        return generation
+
+    def wait_for_merges(self):
+        """
+        Wait for the background merges to finish.
+        """
+        thread = self.merge_thread
+        if thread is not None:
+            thread.join()
+        self._raise_merge_error()
+
+    def close(self):
+        """
+        Wait for the merges and release the directory. Uncommitted changes are discarded.
+        """
+        try:
+            self.wait_for_merges()
+        finally:
+            for segment in self.segments.values():
+                segment.close()
+            self._release_lock()
@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+
+class Saturated(Exception):
+    """
+    Raised when the executor has no worker nor queue slot left for a new task.
+    """
+
+
+class Timeout(Exception):
+    """
+    Raised when a task did not finish within its timeout.
+    """
+
+
+class BoundedExecutor:
+    """
+    Thread pool running the CPU-bound part of requests with admission control. At most workers
+    tasks run at once and at most max_queue more wait for a worker; further tasks are rejected
+    immediately with Saturated instead of queueing without bound, so that a saturated server
+    answers fast with backpressure rather than making every request wait behind the others.
+    Parallelism across cores comes from running several server processes, each with its own
+    executor over the same memory-mapped index.
+    """
+
+    def __init__(self, workers=4, max_queue=16):
+        """
+        :param workers: Number of worker threads.
+        :param max_queue: Number of tasks allowed to wait for a worker.
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scoring")
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submit a task, or raise Saturated if all the worker and queue slots are taken.
+        :return: Future of the task.
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise Saturated(f"{self.workers + self.max_queue} tasks already running or queued")
+        with self.lock:
+            self.in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            if future is not None and not future.cancelled():
+                self.completed += 1
+        self.slots.release()
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Run a task and wait for its result.
+        :param timeout: Maximum time to wait in seconds. A task still queued at the timeout is
+            cancelled; a running one finishes in the background, keeping its slot until then.
+        :return: Result of the task.
+        """
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self.lock:
+                self.timeouts += 1
+            raise Timeout(f"Task did not finish within {timeout} seconds") from None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,342 @@
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import threading
+from array import array
+from collections import Counter
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from .binary_index import open_binary_index, write_binary_index
+from .documents import summarize_document
+from .encoding import load_file
+from .index import build_inverted_index
+from .scoring import CollectionStats, compute_max_scores
+from .searcher import RANKING_FUNCTIONS, IndexReader, Searcher
+
+SHARDS_MANIFEST = "shards.json"
+
+
+class ShardError(Exception):
+    """
+    Raised when a shard failed to answer a request.
+    """
+
+
+def shard_path(directory, shard, extension):
+    return os.path.join(directory, f"shard-{shard}{extension}")
+
+
+def global_doc_id(local_doc_id, shard, num_shards):
+    # Documents are dealt round-robin: document d of the collection is document d // N of shard d % N
+    return local_doc_id * num_shards + shard
+
+
+def build_shards(documents, processed_data, directory, num_shards):
+    """
+    Partition a collection into shards, each with its own binary index and documents. Every shard
+    also stores the document frequencies of its terms in the whole collection, and its max scores
+    are computed with the statistics of the collection, so that shards score like the whole index.
+    :param documents: List of raw hotel data, indexed by document ID.
+    :param processed_data: List of processed hotel data, in document ID order.
+    :param directory: Directory of the shards, created if needed.
+    :param num_shards: Number of shards.
+    :return: Manifest of the shards.
+    """
+    if len(documents) != len(processed_data):
+        raise ValueError(f"{len(documents)} documents but {len(processed_data)} processed documents")
+    os.makedirs(directory, exist_ok=True)
+    shard_indexes = [build_inverted_index(processed_data[shard::num_shards]) for shard in range(num_shards)]
+    document_frequencies = Counter()
+    for inverted_index in shard_indexes:
+        for term in inverted_index.terms():
+            document_frequencies[term] += inverted_index.document_frequency(term)
+    collection_stats = CollectionStats(sum(inverted_index.total_docs for inverted_index in shard_indexes),
+                                       sum(inverted_index.total_terms for inverted_index in shard_indexes),
+                                       document_frequencies.__getitem__)
+
+    for shard, inverted_index in enumerate(shard_indexes):
+        inverted_index.max_scores = compute_max_scores(inverted_index, collection_stats=collection_stats)
+        write_binary_index(inverted_index, shard_path(directory, shard, ".bin"))
+        # Collection document frequencies in the order of the term dictionary of the binary index
+        terms = sorted(inverted_index.terms(), key=lambda term: term.encode("utf-8"))
+        with open(shard_path(directory, shard, ".df"), "wb") as f:
+            array("I", (document_frequencies[term] for term in terms)).tofile(f)
+        with open(shard_path(directory, shard, ".docs.json"), "w") as f:
+            json.dump(documents[shard::num_shards], f)
+
+    manifest = {
+        "num_shards": num_shards,
+        "total_docs": collection_stats.total_docs,
+        "total_terms": collection_stats.total_terms,
+        "analyzer": shard_indexes[0].analyzer if shard_indexes else None
+    }
+    with open(os.path.join(directory, SHARDS_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_shards_manifest(directory):
+    return load_file(os.path.join(directory, SHARDS_MANIFEST))
+
+
+def open_shard(directory, shard):
+    """
+    Open a shard written by build_shards.
+    :return: Searcher over the shard, scoring with the statistics of the collection.
+    """
+    manifest = read_shards_manifest(directory)
+    index_file = shard_path(directory, shard, ".bin")
+    inverted_index = open_binary_index(index_file)
+    with open(shard_path(directory, shard, ".df"), "rb") as f:
+        document_frequencies = array("I", f.read())
+
+    def document_frequency(term):
+        term_id = inverted_index.term_id(term)
+        return document_frequencies[term_id] if term_id >= 0 else 0
+
+    collection_stats = CollectionStats(manifest["total_docs"], manifest["total_terms"], document_frequency)
+    reader = IndexReader(inverted_index, load_file(shard_path(directory, shard, ".docs.json")),
+                         generation=os.stat(index_file).st_mtime_ns)
+    return Searcher(reader, collection_stats=collection_stats)
+
+
+class ShardServer:
+    """
+    Serves the searches of one shard over multiprocessing connections, one thread per connection.
+    Document IDs in the responses are those of the whole collection.
+    Requests are tuples:
+        ("search_many", queries, k, ranking_functions, proximity)  -> one search result per query
+        ("summaries", doc_ids)                                     -> summary of each document of the shard
+        ("stats",)                                                 -> statistics of the shard index
+    Responses are ("ok", value) or ("error", message).
+    """
+
+    def __init__(self, directory, shard):
+        self.searcher = open_shard(directory, shard)
+        self.shard = shard
+        self.num_shards = read_shards_manifest(directory)["num_shards"]
+
+    def to_global(self, doc_id):
+        return global_doc_id(doc_id, self.shard, self.num_shards)
+
+    def search_many(self, queries, k, ranking_functions, proximity=0.0):
+        results = []
+        for result in self.searcher.search_many(queries, k, ranking_functions, proximity=proximity):
+            results.append({
+                "matching_docs": [self.to_global(doc_id) for doc_id in result["matching_docs"]],
+                "rankings": {ranking_function: [(self.to_global(doc_id), score) for doc_id, score in ranking]
+                             for ranking_function, ranking in result["rankings"].items()}
+            })
+        return results
+
+    def summaries(self, doc_ids):
+        return [summarize_document(self.searcher.reader.document(doc_id // self.num_shards)) for doc_id in doc_ids]
+
+    def handle(self, request):
+        command, *args = request
+        if command == "search_many":
+            return self.search_many(*args)
+        if command == "summaries":
+            return self.summaries(*args)
+        if command == "stats":
+            return self.searcher.reader.stats()
+        raise ValueError(f"Unknown shard command: {command}")
+
+    def serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = connection.recv()
+                except EOFError:
+                    return
+                try:
+                    response = ("ok", self.handle(request))
+                except Exception as e:
+                    response = ("error", f"{type(e).__name__}: {e}")
+                connection.send(response)
+
+    def serve(self, listener):
+        while True:
+            try:
+                connection = listener.accept()
+            except (AuthenticationError, OSError):
+                continue  # A client with the wrong key or that went away
+            threading.Thread(target=self.serve_connection, args=(connection,), daemon=True).start()
+
+
+def run_shard_server(directory, shard, address, authkey, ready=None):
+    """
+    Serve a shard until the process is terminated.
+    :param address: (host, port) to listen on, port 0 for any free port.
+    :param ready: Optional connection to send the address listened on once ready.
+    """
+    server = ShardServer(directory, shard)
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        server.serve(listener)
+
+
+def merge_rankings(rankings, k):
+    """
+    Merge the rankings of the shards into the k best documents, in the order of Searcher.rank.
+    """
+    return heapq.nsmallest(k, (posting for ranking in rankings for posting in ranking), key=lambda x: (-x[1], x[0]))
+
+
+class ShardedSearcher:
+    """
+    Coordinator of a sharded index: a search is sent to every shard at once and their results are
+    merged, the matching documents by document ID and the rankings by score. Shards score with the
+    statistics of the whole collection, so the merged top k is the top k of the whole index.
+    Each caller takes one connection per shard from a pool, in shard order, so concurrent searches
+    use separate connections without deadlocking.
+    """
+
+    def __init__(self, addresses, authkey, connections_per_shard=4):
+        """
+        :param addresses: (host, port) of every shard server, in shard order.
+        :param authkey: Authentication key of the shard servers.
+        :param connections_per_shard: Maximum number of concurrent requests per shard.
+        """
+        self.addresses = list(addresses)
+        self.authkey = authkey
+        self.pools = []
+        for _ in self.addresses:
+            pool = queue.Queue()
+            for _ in range(connections_per_shard):
+                pool.put(None)  # Connected on first use
+            self.pools.append(pool)
+
+    @property
+    def num_shards(self):
+        return len(self.addresses)
+
+    def _scatter(self, requests):
+        """
+        Send one request per shard and wait for all the responses.
+        :param requests: Request of each shard, in shard order.
+        :return: Response values, in shard order.
+        """
+        connections = [pool.get() for pool in self.pools]
+        responses = []
+        try:
+            for shard, request in enumerate(requests):
+                if connections[shard] is None:
+                    connections[shard] = Client(self.addresses[shard], authkey=self.authkey)
+                connections[shard].send(request)
+            for connection in connections:
+                responses.append(connection.recv())
+        except (EOFError, OSError):
+            # The state of the connections is unknown, reconnect on the next use
+            for connection in connections:
+                if connection is not None:
+                    connection.close()
+            connections = [None] * len(connections)
+            raise
+        finally:
+            for pool, connection in zip(self.pools, connections):
+                pool.put(connection)
+        errors = [f"shard {shard}: {value}" for shard, (status, value) in enumerate(responses) if status != "ok"]
+        if errors:
+            raise ShardError("; ".join(errors))
+        return [value for _, value in responses]
+
+    def search_many(self, queries, k=10, ranking_functions=RANKING_FUNCTIONS, proximity=0.0):
+        """
+        Run the full pipeline for a batch of queries on every shard and merge the results.
+        With a proximity boost, each shard reranks its own top documents before the merge.
+        :return: One result per query, in the format of Searcher.search.
+        """
+        request = ("search_many", list(queries), k, tuple(ranking_functions), proximity)
+        shard_results = self._scatter([request] * self.num_shards)
+        results = []
+        for query_results in zip(*shard_results):
+            results.append({
+                "matching_docs": list(heapq.merge(*(result["matching_docs"] for result in query_results))),
+                "rankings": {ranking_function: merge_rankings([result["rankings"][ranking_function]
+                                                               for result in query_results], k)
+                             for ranking_function in ranking_functions}
+            })
+        return results
+
+    def search(self, query, k=10, ranking_functions=RANKING_FUNCTIONS, proximity=0.0):
+        return self.search_many([query], k, ranking_functions, proximity)[0]
+
+    def summaries(self, doc_ids):
+        """
+        Fetch the summaries of documents from their shards.
+        :return: Summaries, in the order of doc_ids.
+        """
+        by_shard = [[] for _ in range(self.num_shards)]
+        for doc_id in doc_ids:
+            by_shard[doc_id % self.num_shards].append(doc_id)
+        shard_summaries = self._scatter([("summaries", shard_doc_ids) for shard_doc_ids in by_shard])
+        found = {doc_id: summary for shard_doc_ids, summaries in zip(by_shard, shard_summaries)
+                 for doc_id, summary in zip(shard_doc_ids, summaries)}
+        return [found[doc_id] for doc_id in doc_ids]
+
+    def stats(self):
+        return self._scatter([("stats",)] * self.num_shards)
+
+    def close(self):
+        for pool in self.pools:
+            while not pool.empty():
+                connection = pool.get()
+                if connection is not None:
+                    connection.close()
+
+
+class LocalShardCluster:
+    """
+    One shard server process per shard of a directory, all on localhost, for a single machine or
+    for testing. Use as a context manager or call start and stop.
+    """
+
+    def __init__(self, directory, host="127.0.0.1", authkey=None):
+        self.directory = directory
+        self.host = host
+        self.authkey = authkey or os.urandom(16)
+        self.processes = []
+        self.addresses = []
+
+    def start(self):
+        # Spawned rather than forked: the parent may run threads, such as a web server's
+        context = multiprocessing.get_context("spawn")
+        pending = []
+        for shard in range(read_shards_manifest(self.directory)["num_shards"]):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=run_shard_server, name=f"shard-{shard}", daemon=True,
+                                      args=(self.directory, shard, (self.host, 0), self.authkey, sender))
+            process.start()
+            sender.close()
+            self.processes.append(process)
+            pending.append(receiver)
+        for receiver in pending:
+            try:
+                self.addresses.append(receiver.recv())
+            except EOFError:
+                self.stop()
+                raise ShardError("A shard server failed to start") from None
+        return self
+
+    def searcher(self, connections_per_shard=4):
+        return ShardedSearcher(self.addresses, self.authkey, connections_per_shard)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+        self.processes = []
+        self.addresses = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+
+from .documents import DocumentStore
+from .suggest import SuggestionIndex
+
+# Everything a request reads from the index: requests take the current snapshot once and use it
+# until they finish, so a reload never mixes two versions of the index in one response
+Snapshot = namedtuple("Snapshot", ["searcher", "summaries", "suggestions", "loaded_at"])
+
+
+def make_snapshot(searcher):
+    # Build the fuzzy matcher now rather than in the first request with a fuzzy query
+    searcher.fuzzy_matcher
+    documents = searcher.reader.documents
+    return Snapshot(searcher, DocumentStore(documents), SuggestionIndex(documents), time.time())
+
+
+class SnapshotManager:
+    """
+    Holder of the current snapshot of a searcher, swapped atomically when the index changes.
+    A reload opens the new index generation, its document summaries, suggestions and fuzzy matcher,
+    warms the caches by replaying the most recent queries against it, and only then replaces the
+    single snapshot reference: requests in flight finish on the previous snapshot, new ones see the
+    new one. Requests reading the index hold their snapshot with acquire, and the reader of a
+    swapped out snapshot is closed when its last request is done, releasing the mappings of files
+    that merges removed.
+    """
+
+    def __init__(self, searcher, warm_queries=100):
+        """
+        :param searcher: Searcher of the initial snapshot.
+        :param warm_queries: Number of most recent cached queries replayed before a swap.
+        """
+        self.snapshot = make_snapshot(searcher)
+        self.warm_queries = warm_queries
+        self.reload_lock = threading.Lock()
+        self.lock = threading.Lock()  # Guards the reference counts and the swap
+        self.users = Counter()  # Number of requests holding each snapshot, by id
+        self.retired = []  # Swapped out snapshots whose reader is still open
+        self.reloads = 0
+        self.last_error = None
+        self.watch_thread = None
+        self.stop_event = threading.Event()
+
+    def current(self):
+        return self.snapshot
+
+    @contextmanager
+    def acquire(self):
+        """
+        Hold the current snapshot for the duration of a request, so that its reader stays open.
+        """
+        with self.lock:
+            snapshot = self.snapshot
+            self.users[id(snapshot)] += 1
+        try:
+            yield snapshot
+        finally:
+            with self.lock:
+                self.users[id(snapshot)] -= 1
+                if not self.users[id(snapshot)]:
+                    del self.users[id(snapshot)]
+                    self._close_retired()
+
+    def _close_retired(self):
+        """
+        Close the readers of the swapped out snapshots no request holds anymore. Called with the lock held.
+        """
+        idle = [snapshot for snapshot in self.retired if id(snapshot) not in self.users]
+        if not idle:
+            return
+        self.retired = [snapshot for snapshot in self.retired if id(snapshot) in self.users]
+        others = [snapshot.searcher.reader for snapshot in [self.snapshot, *self.retired]]
+        for snapshot in idle:
+            snapshot.searcher.reader.close(others)
+
+    def warm(self, searcher, previous):
+        """
+        Run the most recent queries of the previous searcher on a new one, filling the shared
+        result and postings caches under the new generation.
+        """
+        for key in previous.result_cache.recent_keys(self.warm_queries):
+            generation, query_tree, k, ranking_functions, scoring_backend, proximity = key
+            if generation == previous.reader.generation:
+                searcher.search(query_tree, k, ranking_functions, scoring_backend, proximity)
+
+    def reload(self):
+        """
+        Load the current version of the index if it changed, then swap it in.
+        Only one reload runs at a time.
+        :return: Whether a new snapshot was swapped in.
+        """
+        with self.reload_lock:
+            previous = self.snapshot
+            try:
+                searcher = previous.searcher.reopen()
+                if searcher is previous.searcher:
+                    return False
+                snapshot = make_snapshot(searcher)
+                self.warm(searcher, previous.searcher)
+            except Exception as e:
+                # Keep serving the previous snapshot
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            with self.lock:
+                self.snapshot = snapshot
+                self.retired.append(previous)
+                self._close_retired()
+            self.reloads += 1
+            self.last_error = None
+            return True
+
+    def reload_in_background(self):
+        """
+        Start a reload in a background thread.
+        """
+        thread = threading.Thread(target=self._reload_quietly, name="index-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def _reload_quietly(self):
+        try:
+            self.reload()
+        except Exception:
+            pass  # Recorded in last_error
+
+    def watch(self, interval=5.0):
+        """
+        Poll the index files every interval seconds and reload when they change. Checking an
+        unchanged index costs a stat of the index file or a read of the manifest.
+        :param interval: Polling interval in seconds.
+        """
+        if self.watch_thread is not None:
+            return
+        self.stop_event.clear()
+
+        def poll():
+            while not self.stop_event.wait(interval):
+                self._reload_quietly()
+
+        self.watch_thread = threading.Thread(target=poll, name="index-watch", daemon=True)
+        self.watch_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.watch_thread is not None:
+            self.watch_thread.join()
+            self.watch_thread = None
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            "generation": snapshot.searcher.reader.generation,
+            "loaded_at": snapshot.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+            "watching": self.watch_thread is not None,
+            "index": snapshot.searcher.reader.stats(),
+            "suggestions": snapshot.suggestions.stats()
+        }
@@ -0,0 +1,280 @@
+import heapq
+import os
+import struct
+import tempfile
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby, islice
+from operator import itemgetter
+
+from .binary_index import BinaryIndexWriter, encode_varint, iter_varints
+from .index import InvertedIndex, document_terms
+from .scoring import SCORERS
+
+# Block files are sequences of records sorted by term:
+#   record header  term length, doc count, first doc_id, last doc_id, postings length, positions length
+#   term           UTF-8 bytes
+#   postings       varint(doc_id delta), varint(term_frequency) per posting, the first delta from 0
+#   positions      varint(position delta) per occurrence, posting by posting
+# which are the postings and positions sections of the binary index format.
+BLOCK_RECORD = struct.Struct("<IIIIQQ")
+MEMORY_BUDGET = 256 * 1024 * 1024
+# Approximate memory taken by a term of a block besides its encoded postings
+TERM_OVERHEAD = 200
+# Maximum number of blocks merged at once, more are merged in several passes
+MERGE_FAN_IN = 64
+
+
+def _varint_length(value):
+    length = 1
+    while value >= 0x80:
+        value >>= 7
+        length += 1
+    return length
+
+
+class BlockBuilder:
+    """
+    In-memory block of the postings of consecutive documents, kept per term in the encoded form
+    of the binary index so that the memory it takes is known and small.
+    """
+
+    def __init__(self):
+        # term -> [postings, positions, doc count, first doc_id, last doc_id]
+        self.terms = {}
+        self.size = 0
+
+    def add_document(self, doc_id, hotel):
+        """
+        Add the terms of a processed hotel, with a doc_id greater than those already added.
+        :return: Length of the document.
+        """
+        term_positions = defaultdict(list)
+        for position, term in document_terms(hotel):
+            term_positions[term].append(position)
+
+        for term, positions in term_positions.items():
+            entry = self.terms.get(term)
+            if entry is None:
+                entry = self.terms[term] = [bytearray(), bytearray(), 0, doc_id, 0]
+                self.size += TERM_OVERHEAD + len(term)
+            postings_data, positions_data = entry[0], entry[1]
+            size = len(postings_data) + len(positions_data)
+            encode_varint(doc_id - entry[4], postings_data)
+            encode_varint(len(positions), postings_data)
+            previous_position = 0
+            for position in positions:
+                encode_varint(position - previous_position, positions_data)
+                previous_position = position
+            entry[2] += 1
+            entry[4] = doc_id
+            self.size += len(postings_data) + len(positions_data) - size
+        return sum(len(positions) for positions in term_positions.values())
+
+    def flush(self, path):
+        """
+        Write the block sorted by term and empty it.
+        :return: Path of the block file.
+        """
+        records = sorted((term.encode("utf-8"), doc_count, first_doc_id, last_doc_id, postings_data, positions_data)
+                         for term, (postings_data, positions_data, doc_count, first_doc_id, last_doc_id)
+                         in self.terms.items())
+        write_block(path, records)
+        self.terms = {}
+        self.size = 0
+        return path
+
+
+def write_block(path, records):
+    """
+    Write block records, in term order.
+    """
+    with open(path, "wb") as f:
+        for term, doc_count, first_doc_id, last_doc_id, postings_data, positions_data in records:
+            f.write(BLOCK_RECORD.pack(len(term), doc_count, first_doc_id, last_doc_id,
+                                      len(postings_data), len(positions_data)))
+            f.write(term)
+            f.write(postings_data)
+            f.write(positions_data)
+
+
+def read_block(path):
+    """
+    Read the records of a block file one at a time.
+    :return: Generator of (term, doc count, first doc_id, last doc_id, postings, positions).
+    """
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(BLOCK_RECORD.size)
+            if not header:
+                return
+            term_length, doc_count, first_doc_id, last_doc_id, postings_length, positions_length = \
+                BLOCK_RECORD.unpack(header)
+            yield (f.read(term_length), doc_count, first_doc_id, last_doc_id,
+                   f.read(postings_length), f.read(positions_length))
+
+
+def merge_blocks(paths):
+    """
+    K-way merge of blocks covering consecutive ranges of documents, in document order. The
+    postings of a term in several blocks are concatenated, re-encoding only the first doc_id
+    delta of each block against the last doc_id of the previous one.
+    :param paths: Block files, in document order.
+    :return: Generator of merged records, in term order.
+    """
+    # heapq.merge is stable: the records of a term come in block order
+    records = heapq.merge(*(read_block(path) for path in paths), key=itemgetter(0))
+    for term, group in groupby(records, key=itemgetter(0)):
+        _, doc_count, first_doc_id, last_doc_id, postings_data, positions_data = next(group)
+        for _, block_doc_count, block_first_doc_id, block_last_doc_id, block_postings, block_positions in group:
+            if isinstance(postings_data, bytes):
+                postings_data, positions_data = bytearray(postings_data), bytearray(positions_data)
+            encode_varint(block_first_doc_id - last_doc_id, postings_data)
+            postings_data += block_postings[_varint_length(block_first_doc_id):]
+            positions_data += block_positions
+            doc_count += block_doc_count
+            last_doc_id = block_last_doc_id
+        yield term, doc_count, first_doc_id, last_doc_id, postings_data, positions_data
+
+
+def postings_max_scores(scorers, doc_count, postings_data):
+    """
+    Compute the max scores of a term for several scorers in one pass over its encoded postings,
+    decoded one posting at a time so that long postings lists are never materialized.
+    :return: List of the max score of each scorer, as term_max_score.
+    """
+    term_weights = [scorer.term_weight(doc_count) for scorer in scorers]
+    max_scores = [0.0] * len(scorers)
+    values = iter_varints(postings_data, 0, len(postings_data))
+    doc_id = 0
+    for delta, term_frequency in zip(values, values):
+        doc_id += delta
+        for i, scorer in enumerate(scorers):
+            score = scorer.score(term_frequency, doc_id, term_weights[i])
+            if score > max_scores[i]:
+                max_scores[i] = score
+    return max_scores
+
+
+def invert_documents(hotels, first_doc_id, directory, memory_budget, prefix="block"):
+    """
+    Invert a stream of processed hotels into block files, flushing a block whenever its postings
+    reach the memory budget.
+    :param hotels: Iterable of processed hotel data.
+    :param first_doc_id: Document ID of the first hotel.
+    :param directory: Directory of the block files.
+    :param memory_budget: Approximate maximum size in bytes of a block in memory.
+    :param prefix: Prefix of the block file names, unique per call.
+    :return: Tuple (block paths in document order, document lengths, analyzer fingerprints).
+    """
+    builder = BlockBuilder()
+    blocks = []
+    doc_lengths = array("I")
+    analyzers = set()
+    for doc_id, hotel in enumerate(hotels, first_doc_id):
+        analyzers.add(hotel.get("analyzer"))
+        doc_lengths.append(builder.add_document(doc_id, hotel))
+        if builder.size >= memory_budget:
+            blocks.append(builder.flush(os.path.join(directory, f"{prefix}-{len(blocks)}.blk")))
+    if builder.terms:
+        blocks.append(builder.flush(os.path.join(directory, f"{prefix}-{len(blocks)}.blk")))
+    return blocks, doc_lengths, analyzers
+
+
+def invert_documents_parallel(hotels, directory, memory_budget, workers, chunk_size):
+    """
+    Invert a stream of processed hotels in worker processes, each inverting chunks of consecutive
+    documents into its own blocks. At most two chunks per worker are in flight.
+    :return: Same as invert_documents.
+    """
+    blocks = []
+    doc_lengths = array("I")
+    analyzers = set()
+    hotels = iter(hotels)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        first_doc_id = 0
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(islice(hotels, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(invert_documents, chunk, first_doc_id, directory,
+                                               memory_budget // workers, f"chunk{first_doc_id}"))
+                first_doc_id += len(chunk)
+            if not pending:
+                break
+            # Chunks are collected in submission order, which is document order
+            chunk_blocks, chunk_doc_lengths, chunk_analyzers = pending.popleft().result()
+            blocks += chunk_blocks
+            doc_lengths += chunk_doc_lengths
+            analyzers |= chunk_analyzers
+    return blocks, doc_lengths, analyzers
+
+
+def reduce_blocks(blocks, directory, fan_in=MERGE_FAN_IN):
+    """
+    Merge groups of consecutive blocks until at most fan_in are left, so that the final merge
+    does not open more files than that.
+    :return: Remaining block paths, in document order.
+    """
+    level = 0
+    while len(blocks) > fan_in:
+        merged = []
+        for i in range(0, len(blocks), fan_in):
+            group = blocks[i:i + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            path = os.path.join(directory, f"merge{level}-{i // fan_in}.blk")
+            write_block(path, merge_blocks(group))
+            for block in group:
+                os.remove(block)
+            merged.append(path)
+        blocks = merged
+        level += 1
+    return blocks
+
+
+def build_external_index(processed_data, output_file, memory_budget=MEMORY_BUDGET, workers=1, chunk_size=10000,
+                         work_dir=None, ranking_functions=None):
+    """
+    Build a binary index from a stream of processed hotels with bounded memory (single-pass
+    in-memory inversion): postings are accumulated in blocks flushed to disk when they reach
+    the memory budget, then the blocks are merged into the index file, computing the max scores
+    of the terms along the way. Only the document lengths are kept for the whole corpus.
+    The index is the same as write_binary_index of build_inverted_index with compute_max_scores.
+    :param processed_data: Iterable of processed hotel data, in document ID order.
+    :param output_file: File path of the binary index.
+    :param memory_budget: Approximate memory in bytes for the postings being inverted.
+    :param workers: Number of worker processes inverting chunks of documents, 1 to invert in this process.
+    :param chunk_size: Number of documents sent to a worker at once.
+    :param work_dir: Directory of the temporary block files, the system temporary directory by default.
+    :param ranking_functions: Names of the scorers to compute max scores for, all registered ones by default.
+    :return: Statistics of the index.
+    """
+    with tempfile.TemporaryDirectory(prefix="spimi-", dir=work_dir) as directory:
+        if workers > 1:
+            blocks, doc_lengths, analyzers = invert_documents_parallel(processed_data, directory, memory_budget,
+                                                                       workers, chunk_size)
+        else:
+            blocks, doc_lengths, analyzers = invert_documents(processed_data, 0, directory, memory_budget)
+        if len(analyzers) > 1:
+            raise ValueError(f"Processed data mixes analyzers: {', '.join(sorted(map(str, analyzers)))}")
+        blocks = reduce_blocks(blocks, directory)
+
+        # Corpus statistics for the scorers, without postings
+        corpus = InvertedIndex({}, doc_lengths)
+        score_slots = sorted(ranking_functions or SCORERS)
+        scorers = [SCORERS[ranking_function](corpus) for ranking_function in score_slots]
+        writer = BinaryIndexWriter(output_file, score_slots)
+        vocabulary_size = 0
+        for term, doc_count, _, _, postings_data, positions_data in merge_blocks(blocks):
+            writer.add_term(term, doc_count, postings_data, positions_data,
+                            postings_max_scores(scorers, doc_count, postings_data))
+            vocabulary_size += 1
+
+        stats = {**corpus.stats(), "vocabulary_size": vocabulary_size}
+        writer.finish(doc_lengths, stats, analyzers.pop() if analyzers else None)
+    return stats
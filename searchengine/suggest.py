@@ -0,0 +1,136 @@
+import heapq
+import re
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from .analysis import default_analyzer
+from .encoding import Encoded, dumps
+
+# Maximum number of suggestions per prefix
+MAX_SUGGESTIONS = 20
+# Prefixes matching more keys than this have their top suggestions precomputed
+SCAN_LIMIT = 64
+# Kinds of suggestions, by priority when the same text is several of them
+SUGGESTION_TYPES = ("hotel", "amenity", "term")
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+# Greater than any character, ends the range of keys starting with a prefix
+MAX_CHAR = "\U0010ffff"
+
+
+def normalize_text(text):
+    """
+    Normalize a text for prefix matching: lowercase words separated by single spaces.
+    """
+    return NON_WORD_PATTERN.sub(" ", text.lower()).strip()
+
+
+def normalize_prefix(prefix):
+    # A trailing separator is kept: "outdoor " completes "outdoor pool" but not "outdoors"
+    return NON_WORD_PATTERN.sub(" ", prefix.lower()).lstrip()
+
+
+class SuggestionIndex:
+    """
+    As-you-type completions of hotel names, amenities (the feature strings of the hotels) and words
+    of the hotels, weighted by the number of hotels they appear in. Completions are found by binary
+    search in a sorted array of keys, with a key per word of a completion so that "pool" completes
+    "Outdoor pool". The top suggestions of the prefixes matching many keys are precomputed, every
+    other prefix matches at most scan_limit keys, so a lookup never depends on the collection size.
+    Suggestions are pre-encoded JSON objects, spliced into responses by encode.
+    """
+
+    def __init__(self, documents, analyzer=default_analyzer, max_suggestions=MAX_SUGGESTIONS, scan_limit=SCAN_LIMIT):
+        """
+        :param documents: List of raw hotel data.
+        :param analyzer: Analyzer whose tokenizer and stopwords select the words suggested.
+        :param max_suggestions: Maximum number of suggestions per lookup.
+        :param scan_limit: Maximum number of keys scanned by a lookup.
+        """
+        self.max_suggestions = max_suggestions
+        self.scan_limit = scan_limit
+
+        # Number of hotels of every suggestion, with the first spelling seen
+        counts = {suggestion_type: Counter() for suggestion_type in SUGGESTION_TYPES}
+        spellings = {}
+        for doc in documents:
+            texts = {"hotel": [doc.get("basic_data", {}).get("name") or ""], "amenity": doc.get("features") or []}
+            words = {word for text in [*texts["hotel"], *texts["amenity"], doc.get("description") or ""]
+                     for word in analyzer.tokenize(text)
+                     if word not in analyzer.stop_words and len(word) > 1}
+            texts["term"] = words
+            for suggestion_type, type_texts in texts.items():
+                for text in type_texts:
+                    normalized = normalize_text(text)
+                    if normalized:
+                        spellings.setdefault((suggestion_type, normalized), text.strip())
+                counts[suggestion_type].update({normalize_text(text) for text in type_texts} - {""})
+
+        # A text found as several types is suggested once, with the spelling and type of its first type in
+        # SUGGESTION_TYPES (later types are overwritten) and the largest of its counts across types
+        suggestions = {}
+        for suggestion_type in reversed(SUGGESTION_TYPES):
+            for normalized, count in counts[suggestion_type].items():
+                count = max(count, suggestions.get(normalized, (None, None, 0))[2])
+                suggestions[normalized] = (spellings[suggestion_type, normalized], suggestion_type, count)
+        # Suggestion IDs are ranks: by number of hotels, then shorter and alphabetical first
+        ranked = sorted(suggestions.items(), key=lambda item: (-item[1][2], len(item[0]), item[0]))
+        self.suggestions = [Encoded(dumps({"text": text, "type": suggestion_type, "count": count}))
+                            for _, (text, suggestion_type, count) in ranked]
+
+        keys = []
+        for suggestion_id, (normalized, _) in enumerate(ranked):
+            words = normalized.split(" ")
+            keys += [(" ".join(words[i:]), suggestion_id) for i in range(len(words))]
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.suggestion_ids = array("I", (suggestion_id for _, suggestion_id in keys))
+        self.top = self._precompute()
+
+    def _top(self, low, high, limit):
+        # Suggestion IDs are ranks, the best suggestions are the smallest distinct IDs
+        return heapq.nsmallest(limit, set(self.suggestion_ids[low:high]))
+
+    def _precompute(self):
+        """
+        Walk the prefixes of the keys as a trie over the sorted array, down to the prefixes matching
+        at most scan_limit keys.
+        :return: Dictionary prefix -> top suggestion IDs, for the prefixes matching more keys.
+        """
+        top = {}
+        keys = self.keys
+        stack = [("", 0, len(keys))]
+        while stack:
+            prefix, low, high = stack.pop()
+            if high - low <= self.scan_limit:
+                continue
+            top[prefix] = self._top(low, high, self.max_suggestions)
+            depth = len(prefix)
+            i = low
+            while i < high and len(keys[i]) == depth:
+                i += 1  # The key equal to the prefix
+            while i < high:
+                child = keys[i][:depth + 1]
+                end = bisect_left(keys, child + MAX_CHAR, i, high)
+                stack.append((child, i, end))
+                i = end
+        return top
+
+    def suggest(self, prefix, limit=10):
+        """
+        Get the best completions of a prefix.
+        :param prefix: Raw text typed so far.
+        :param limit: Maximum number of suggestions, at most max_suggestions.
+        :return: List of Encoded {"text", "type", "count"} objects, best first.
+        """
+        prefix = normalize_prefix(prefix)
+        limit = min(limit, self.max_suggestions)
+        suggestion_ids = self.top.get(prefix)
+        if suggestion_ids is None:
+            low = bisect_left(self.keys, prefix)
+            high = bisect_left(self.keys, prefix + MAX_CHAR, low)
+            suggestion_ids = self._top(low, high, limit)
+        return [self.suggestions[suggestion_id] for suggestion_id in suggestion_ids[:limit]]
+
+    def stats(self):
+        return {"suggestions": len(self.suggestions), "keys": len(self.keys), "precomputed_prefixes": len(self.top)}
@@ -1,162 +1,287 @@
-from flask import Flask, request, jsonify
+import hmac
+import os
+import time
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
-import json
-from collections import defaultdict
-from math import log
-from nltk.corpus import stopwords
-from nltk.stem import PorterStemmer
-from nltk.tokenize import word_tokenize
+from searchengine import (RANKING_FUNCTIONS, SCORING_BACKENDS, SUMMARY_FIELDS, BoundedExecutor, MetricsRegistry,
+                          QuerySyntaxError, SamplingProfiler, Saturated, Searcher, SnapshotManager, Timeout, Trace,
+                          encode, stage, tracing)
 
-# Initialize stemmer and stopwords
-stemmer = PorterStemmer()
-stop_words = set(stopwords.words('english'))
 # Initialize Flask app
 
 app = Flask(__name__)
 # add cors
 CORS(app, resources={r"/*": {"origins": "http://localhost:5173"}})
 
-# Load data
-with open("processed_hotel_data.json", "r") as f:
-    processed_data = json.load(f)
+# Load data: the binary index file, or an index directory maintained by update_index.py
+INDEX_PATH = os.environ.get("INDEX_PATH", "inverted_index.bin")
+snapshots = SnapshotManager(Searcher.open(INDEX_PATH, "hotel_data.json"))
 
-with open("inverted_index.json", "r") as f:
-    inverted_index = json.load(f)
+# Reload the index when its files change, every INDEX_WATCH_INTERVAL seconds (0 disables it)
+WATCH_INTERVAL = float(os.environ.get("INDEX_WATCH_INTERVAL", 5))
+if WATCH_INTERVAL > 0:
+    snapshots.watch(WATCH_INTERVAL)
 
-with open("hotel_data.json", "r") as f:
-    hotel_data = json.load(f)
+# Admin endpoints require this token in the X-Admin-Token header when it is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
 
-total_docs = len(processed_data)
+# Searches run on a bounded pool of scoring threads: requests beyond SCORING_WORKERS running and
+# SCORING_QUEUE waiting get a 429, searches longer than REQUEST_TIMEOUT seconds a 503
+scoring_executor = BoundedExecutor(int(os.environ.get("SCORING_WORKERS", 4)),
+                                   int(os.environ.get("SCORING_QUEUE", 16)))
+REQUEST_TIMEOUT = float(os.environ.get("REQUEST_TIMEOUT", 2.0))
 
-# Functions for ranking and search
-def preprocess_query(query):
-    """
-    Preprocess the user query to match processed data terms.
-    :param query: Raw query string.
-    :return: List of preprocessed query terms.
-    """
-    tokens = word_tokenize(query.lower())
-    tokens = [token for token in tokens if token.isalpha() and token not in stop_words]
-    return [stemmer.stem(token) for token in tokens]
+# Per-stage timings and counters of all the requests, served on /metrics
+metrics = MetricsRegistry()
+# Sampling profiler of the scoring threads, switched on and off with /admin/profiler
+profiler = SamplingProfiler(thread_prefix="scoring")
+
+# Response keys of the rankings, by ranking function
+RANKING_KEYS = {"TF-IDF": "ranked_tf_idf", "BM25": "ranked_bm25"}
+MAX_LIMIT = 100  # Maximum number of documents per page
+MAX_OFFSET = 1000  # Maximum offset of a page, a page ranks all the documents before it
+MAX_BATCH_SIZE = 100  # Maximum number of queries of a batch
+MAX_PROXIMITY = 10  # Maximum weight of the proximity boost
+MAX_PREFIX_LENGTH = 100  # Maximum length of the text completed by /suggest
+
+
+class ValidationError(ValueError):
+    pass
+
+@app.errorhandler(ValidationError)
+@app.errorhandler(QuerySyntaxError)
+def handle_validation_error(e):
+    return jsonify({"error": str(e)}), 400
+
+@app.errorhandler(Saturated)
+def handle_saturated(e):
+    metrics.increment("requests_rejected")
+    return jsonify({"error": "Server is busy, retry later"}), 429, {"Retry-After": "1"}
 
-def parse_query(query):
+@app.errorhandler(Timeout)
+def handle_timeout(e):
+    metrics.increment("requests_timed_out")
+    return jsonify({"error": "Search timed out"}), 503, {"Retry-After": "1"}
+
+def get_int(data, name, default, minimum=0, maximum=None):
+    value = data.get(name, default)
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < minimum:
+        raise ValidationError(f"'{name}' must be an integer >= {minimum}")
+    if maximum is not None and value > maximum:
+        raise ValidationError(f"'{name}' must be at most {maximum}")
+    return value
+
+def get_choices(data, name, choices):
+    values = data.get(name)
+    if values is None:
+        return None
+    if not isinstance(values, list) or any(value not in choices for value in values):
+        raise ValidationError(f"'{name}' must be a list of values among {', '.join(choices)}")
+    return list(dict.fromkeys(values))
+
+def parse_search_options(data):
     """
-    Parse the query into terms and operators (AND, OR, NOT).
-    :param query: Raw query string.
-    :return: List of tuples (operator, terms).
+    Validate the options shared by /search and /search/batch.
+    :param data: JSON body of the request.
+    :return: Dictionary of options.
     """
-    operators = {"AND", "OR", "NOT"}
-    tokens = query.split()
-    parsed_query = []
-    current_operator = "AND"  # Default operator
-
-    for token in tokens:
-        if token in operators:
-            current_operator = token
-        else:
-            preprocessed_term = preprocess_query(token)
-            if preprocessed_term:
-                parsed_query.append((current_operator, preprocessed_term))
-
-    return parsed_query
-
-def boolean_search(parsed_query, inverted_index, total_docs):
-    result_set = set(range(total_docs))  # Start with all documents
-    for operator, terms in parsed_query:
-        term_docs = set.union(*(set(inverted_index.get(term, [])) for term in terms))
-
-        if operator == "AND":
-            result_set &= term_docs
-        elif operator == "OR":
-            result_set |= term_docs
-        elif operator == "NOT":
-            result_set -= term_docs
-        else:
-            raise ValueError(f"Unsupported operator: {operator}")
-
-    return result_set
-
-def calculate_tf_idf(term, doc_id, inverted_index, processed_data):
+    # "k" is the former name of "limit", kept for existing clients
+    limit = get_int(data, "limit", get_int(data, "k", 10, maximum=MAX_LIMIT), maximum=MAX_LIMIT)
+    offset = get_int(data, "offset", 0, maximum=MAX_OFFSET)
+    ranking_functions = get_choices(data, "rankers", RANKING_FUNCTIONS)
+    backend = data.get("backend")  # Scoring backend: "postings" (default) or "matrix"
+    if backend is not None and backend not in SCORING_BACKENDS:
+        raise ValidationError(f"'backend' must be one of {', '.join(SCORING_BACKENDS)}")
+    proximity = data.get("proximity", 0)  # Weight of the boost of documents where the query terms are close
+    if isinstance(proximity, bool) or not isinstance(proximity, (int, float)) or not 0 <= proximity <= MAX_PROXIMITY:
+        raise ValidationError(f"'proximity' must be a number between 0 and {MAX_PROXIMITY}")
+    debug = data.get("debug", False)  # Return the stage timings and counters of the request
+    if not isinstance(debug, bool):
+        raise ValidationError("'debug' must be a boolean")
+    fuzzy = data.get("fuzzy", False)  # Opt in to correcting the query terms missing from the index
+    if not isinstance(fuzzy, bool):
+        raise ValidationError("'fuzzy' must be a boolean")
+    return {
+        "debug": debug,
+        "offset": offset,
+        "limit": limit,
+        "fields": get_choices(data, "fields", SUMMARY_FIELDS),
+        "ranking_functions": RANKING_FUNCTIONS if ranking_functions is None else ranking_functions,
+        "backend": backend,
+        "proximity": float(proximity),
+        "fuzzy": fuzzy
+    }
+
+def get_request_data():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise ValidationError("The request body must be a JSON object")
+    return data
+
+def map_results(results, options, summaries):
     """
-    Calculate TF-IDF score for a term in a specific document.
+    Map a page of the results of a query to the response format. Only the requested rankings
+    are returned, and only the requested fields of the document summaries, which come
+    pre-encoded from the document store and are spliced into the response by encode.
     """
-    term_frequency = processed_data[doc_id]["description"].count(term) + \
-                     sum(feature.count(term) for feature in processed_data[doc_id]["features"])
-    doc_count_containing_term = len(inverted_index.get(term, []))
-    total_docs = len(processed_data)
-    if term_frequency > 0:
-        tf = 1 + log(term_frequency)
-        idf = log(total_docs / (1 + doc_count_containing_term))
-        return tf * idf
-    return 0
-
-
-def calculate_bm25(term, doc_id, inverted_index, processed_data, k1=1.5, b=0.75):
+    offset, limit, fields = options["offset"], options["limit"], options["fields"]
+    matching_docs = results["matching_docs"]
+    with stage("map_documents"):
+        response = {
+            "total_matches": len(matching_docs),
+            "matching_docs": [summaries.get(doc_id, fields) for doc_id in matching_docs[offset:offset + limit]]
+        }
+        for ranking_function, ranked in results["rankings"].items():
+            response[RANKING_KEYS[ranking_function]] = [{"doc": summaries.get(doc_id, fields), "score": score}
+                                                        for doc_id, score in ranked[offset:offset + limit]]
+    return response
+
+def run_search_task(task, options):
     """
-    Calculate BM25 score for a term in a specific document.
+    Run a search task on the scoring executor with a trace of its stages, recorded in the metrics
+    and returned in the "debug" block of the response when requested.
     """
-    term_frequency = processed_data[doc_id]["description"].count(term) + \
-                     sum(feature.count(term) for feature in processed_data[doc_id]["features"])
-    doc_count_containing_term = len(inverted_index.get(term, []))
-    total_docs = len(processed_data)
-    avg_doc_length = sum(len(doc["description"]) + sum(len(feature) for feature in doc["features"])
-                         for doc in processed_data) / total_docs
-    doc_length = len(processed_data[doc_id]["description"]) + sum(
-        len(feature) for feature in processed_data[doc_id]["features"])
-
-    idf = log((total_docs - doc_count_containing_term + 0.5) / (doc_count_containing_term + 0.5) + 1)
-    tf_norm = (term_frequency * (k1 + 1)) / (term_frequency + k1 * (1 - b + b * (doc_length / avg_doc_length)))
-    return idf * tf_norm
-
-def rank_documents(query_terms, inverted_index, processed_data, doc_ids, ranking_function="TF-IDF"):
+    trace = Trace()
+    submitted = time.perf_counter()
+
+    def traced_task():
+        trace.stages["queued"] = time.perf_counter() - submitted
+        with tracing(trace), trace.stage("search"):
+            return task()
+    response = scoring_executor.run(traced_task, timeout=REQUEST_TIMEOUT)
+    if options["debug"]:
+        response = {**response, "debug": trace.to_dict()}
+    with trace.stage("serialize"):
+        body = encode(response)
+    metrics.observe(trace)
+    return Response(body, mimetype="application/json")
+
+@app.route('/search', methods=['POST'])
+def search():
+    data = get_request_data()
+    query = data.get("query")
+    if not isinstance(query, str):
+        raise ValidationError("'query' must be a string")
+    options = parse_search_options(data)
+
+    def run_search():
+        # Rankings are computed up to the end of the requested page, unused rankers not at all
+        with snapshots.acquire() as snapshot:
+            results = snapshot.searcher.search(query, options["offset"] + options["limit"],
+                                               ranking_functions=options["ranking_functions"],
+                                               scoring_backend=options["backend"], proximity=options["proximity"],
+                                               fuzzy=options["fuzzy"])
+            return map_results(results, options, snapshot.summaries)
+    return run_search_task(run_search, options)
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    data = get_request_data()
+    queries = data.get("queries")
+    if not isinstance(queries, list) or any(not isinstance(query, str) for query in queries):
+        raise ValidationError("'queries' must be a list of strings")
+    if len(queries) > MAX_BATCH_SIZE:
+        raise ValidationError(f"'queries' must hold at most {MAX_BATCH_SIZE} queries")
+    options = parse_search_options(data)
+
+    def run_search_many():
+        # Terms shared by several queries are looked up and scored once for the whole batch
+        with snapshots.acquire() as snapshot:
+            results = snapshot.searcher.search_many(queries, options["offset"] + options["limit"],
+                                                    ranking_functions=options["ranking_functions"],
+                                                    scoring_backend=options["backend"],
+                                                    proximity=options["proximity"], fuzzy=options["fuzzy"])
+            return {"results": [map_results(query_results, options, snapshot.summaries)
+                                for query_results in results]}
+    return run_search_task(run_search_many, options)
+
+@app.route('/suggest', methods=['GET'])
+def suggest():
     """
-    Rank documents based on the query using the specified ranking function.
+    GET /suggest?q=<text typed so far>&limit=<n> returns the best completions of hotel names,
+    amenities and words. Lookups take microseconds, so they run on the request thread rather
+    than queueing behind searches on the scoring executor.
     """
-    scores = defaultdict(float)
+    prefix = request.args.get("q", "")
+    if len(prefix) > MAX_PREFIX_LENGTH:
+        raise ValidationError(f"'q' must be at most {MAX_PREFIX_LENGTH} characters")
+    suggestion_index = snapshots.current().suggestions
+    limit = get_int(request.args, "limit", 10, minimum=1, maximum=suggestion_index.max_suggestions)
+    trace = Trace()
+    with tracing(trace), trace.stage("suggest"):
+        suggestions = suggestion_index.suggest(prefix, limit)
+    metrics.observe(trace)
+    return Response(encode({"prefix": prefix, "suggestions": suggestions}), mimetype="application/json")
 
-    for term in query_terms:
-        for doc_id in doc_ids:
-            if ranking_function == "TF-IDF":
-                scores[doc_id] += calculate_tf_idf(term, doc_id, inverted_index, processed_data)
-            elif ranking_function == "BM25":
-                scores[doc_id] += calculate_bm25(term, doc_id, inverted_index, processed_data)
-            else:
-                raise ValueError(f"Unsupported ranking function: {ranking_function}")
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    # Hit/miss counters of the result, postings and stem caches, to size them
+    return jsonify(snapshots.current().searcher.cache_stats())
 
-    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus scrape endpoint: stage latency histograms, event counters and current gauges
+    searcher = snapshots.current().searcher
+    gauges = [("index_generation", {}, searcher.reader.generation),
+              ("index_documents", {}, searcher.reader.total_docs)]
+    for cache, stats in searcher.cache_stats().items():
+        if isinstance(stats, dict):
+            gauges += [("cache_entries", {"cache": cache}, stats["size"]),
+                       ("cache_hits", {"cache": cache}, stats["hits"]),
+                       ("cache_misses", {"cache": cache}, stats["misses"])]
+    executor_stats = scoring_executor.stats()
+    gauges += [("executor_in_flight", {}, executor_stats["in_flight"]),
+               ("executor_slots", {}, executor_stats["workers"] + executor_stats["max_queue"])]
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
 
-@app.route('/search', methods=['POST'])
-def search():
-    data = request.get_json()
-    query = data["query"]
-    parsed_query = parse_query(query)
-    processed_terms = [term for _, terms in parsed_query for term in terms]
-    matching_docs = boolean_search(parsed_query, inverted_index, total_docs)
-
-    ranked_tf_idf = rank_documents(processed_terms, inverted_index, processed_data, range(total_docs), ranking_function="TF-IDF")
-    ranked_bm25 = rank_documents(processed_terms, inverted_index, processed_data, range(total_docs), ranking_function="BM25")
-
-    def map_document(doc_id):
-        doc = hotel_data[doc_id]
-        return {
-            "title": doc["basic_data"]["name"],
-            "imageUrl": doc["basic_data"].get("image", ""),
-            "description": doc.get("description", "No description available"),
-            "country": doc["basic_data"]["address"]["addressCountry"]["name"],
-            "address": doc["basic_data"]["address"]["streetAddress"],
-            "rating": doc["basic_data"]["aggregateRating"]["ratingValue"],
-            "reviewCount": doc["basic_data"]["aggregateRating"]["reviewCount"]
-        }
-    matching_docs_data = [map_document(doc_id) for doc_id in matching_docs]
-    ranked_tf_idf_data = [{"doc": map_document(doc_id), "score": score} for doc_id, score in ranked_tf_idf]
-    ranked_bm25_data = [{"doc": map_document(doc_id), "score": score} for doc_id, score in ranked_bm25]
+def check_admin_token():
+    token = request.headers.get("X-Admin-Token", "")
+    if ADMIN_TOKEN and not hmac.compare_digest(token, ADMIN_TOKEN):
+        return jsonify({"error": "Invalid admin token"}), 403
+    return None
+
+@app.route('/admin/index', methods=['GET'])
+def admin_index():
+    return check_admin_token() or jsonify({**snapshots.stats(), "scoring_executor": scoring_executor.stats()})
 
-    return jsonify({
-        "matching_docs": matching_docs_data,
-        "ranked_tf_idf": ranked_tf_idf_data,
-        "ranked_bm25": ranked_bm25_data
-    })
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    # Load the new index generation, warm it, then swap it in; in-flight requests are not affected
+    error = check_admin_token()
+    if error:
+        return error
+    try:
+        reloaded = snapshots.reload()
+    except Exception as e:
+        return jsonify({"reloaded": False, "error": f"{type(e).__name__}: {e}"}), 500
+    return jsonify({"reloaded": reloaded, **snapshots.stats()})
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+def admin_profiler():
+    """
+    POST {"enabled": true|false, "reset": bool} starts or stops the sampling profiler of the scoring
+    threads; GET returns the most sampled functions, or collapsed stacks for flame graphs with
+    ?format=collapsed.
+    """
+    error = check_admin_token()
+    if error:
+        return error
+    if request.method == 'POST':
+        data = get_request_data()
+        if data.get("reset"):
+            profiler.reset()
+        if data.get("enabled") is True:
+            profiler.start()
+        elif data.get("enabled") is False:
+            profiler.stop()
+    if request.args.get("format") == "collapsed":
+        return Response(profiler.collapsed(), mimetype="text/plain")
+    return jsonify({**profiler.stats(), "top_functions": profiler.top_functions()})
 
 if __name__ == '__main__':
+    # Development server, see wsgi.py to serve in production
     app.run(debug=True)
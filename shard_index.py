@@ -0,0 +1,35 @@
+import argparse
+import time
+
+from searchengine import LocalShardCluster, build_shards, load_file
+from preprocessing import read_hotels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partition the index into shards served by local worker processes")
+    parser.add_argument("--shards", type=int, default=4, help="Number of shards")
+    parser.add_argument("--output", default="shards", help="Directory of the shards")
+    parser.add_argument("--documents", default="hotel_data.json", help="Raw hotel data")
+    parser.add_argument("--processed-data", default="processed_hotel_data.json", help="Processed hotel data")
+    parser.add_argument("--query", nargs="*", default=[], help="Queries to run on the shards once built")
+    args = parser.parse_args()
+
+    manifest = build_shards(load_file(args.documents), list(read_hotels(args.processed_data)), args.output,
+                            args.shards)
+    print(f"{manifest['total_docs']} documents partitioned into {args.shards} shards in {args.output}")
+
+    if args.query:
+        # Scatter-gather over one worker process per shard
+        with LocalShardCluster(args.output) as cluster:
+            searcher = cluster.searcher()
+            for query in args.query:
+                start = time.perf_counter()
+                results = searcher.search(query)
+                elapsed = (time.perf_counter() - start) * 1000
+                print(f"\n{query}: {len(results['matching_docs'])} matches in {elapsed:.1f}ms")
+                ranking = results["rankings"]["BM25"]
+                for summary, (doc_id, score) in zip(searcher.summaries([doc_id for doc_id, _ in ranking]), ranking):
+                    print(f"  Document {doc_id}: {summary['title']} (BM25: {score:.3f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import hotels_scraper
+from crawler import Checkpoint, CrawlError, Crawler, content_hash
+
+
+def hotel_page(name, description):
+    """Fixture hotel page with the elements parse_hotel_page extracts"""
+    basic_data = {"name": name, "url": f"https://hotels.test/{name}", "aggregateRating": {"ratingValue": 4.5}}
+    return (f"<html><head><script>{json.dumps(basic_data)}</script></head><body>"
+            f'<div class="fIrGe _T">{description}</div>'
+            f'<div data-test-target="amenity">Pool</div></body></html>')
+
+
+def parse_text(response):
+    return {"text": response.text}
+
+
+class Sleeps:
+    """Injected sleep recording the delays instead of waiting"""
+
+    def __init__(self):
+        self.delays = []
+
+    async def __call__(self, delay):
+        self.delays.append(delay)
+        await asyncio.sleep(0)
+
+
+def crawler(handler, **options):
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    # A high rate, so that the token buckets never wait
+    return Crawler(client, parse_text, **{"rate": 1000.0, "burst": 1000.0, "sleep": Sleeps(), **options})
+
+
+def test_concurrency_limit():
+    in_flight, max_in_flight = 0, 0
+
+    async def handler(request):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        for _ in range(5):
+            await asyncio.sleep(0)
+        in_flight -= 1
+        return httpx.Response(200, text=request.url.path)
+
+    urls = [f"https://hotels.test/{i}" for i in range(20)]
+    pages = asyncio.run(crawler(handler, concurrency=3).crawl(urls))
+    assert max_in_flight == 3
+    assert [pages[url].data["text"] for url in urls] == [f"/{i}" for i in range(20)]
+
+
+def test_retries_with_capped_backoff():
+    attempts = {}
+
+    def handler(request):
+        path = request.url.path
+        attempts[path] = attempts.get(path, 0) + 1
+        if path == "/flaky" and attempts[path] <= 2:
+            return httpx.Response(503)
+        if path == "/throttled":
+            return httpx.Response(429, headers={"Retry-After": "120"})
+        if path == "/blocked":
+            return httpx.Response(403)
+        return httpx.Response(200, text="ok")
+
+    c = crawler(handler, max_retries=3, backoff_base=1.0, backoff_max=10.0)
+    assert asyncio.run(c.fetch("https://hotels.test/flaky")) == {"text": "ok"}
+    assert attempts["/flaky"] == 3
+    assert len(c.sleep.delays) == 2
+    assert all(0 <= delay <= 2 ** attempt for attempt, delay in enumerate(c.sleep.delays))
+
+    c.sleep.delays.clear()
+    with pytest.raises(CrawlError, match="HTTP 429"):
+        asyncio.run(c.fetch("https://hotels.test/throttled"))
+    # Retry-After is capped by backoff_max, and retries stop after max_retries
+    assert attempts["/throttled"] == 4
+    assert c.sleep.delays == [10.0, 10.0, 10.0]
+
+    c.sleep.delays.clear()
+    pages = asyncio.run(c.crawl(["https://hotels.test/blocked"]))
+    assert pages == {}
+    assert attempts["/blocked"] == 4
+    assert all(delay <= 10.0 for delay in c.sleep.delays)
+    assert c.stats["failed"] == 1
+
+
+def test_not_found_is_not_retried():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request.url.path)
+        return httpx.Response(404)
+
+    with pytest.raises(CrawlError, match="HTTP 404"):
+        asyncio.run(crawler(handler).fetch("https://hotels.test/missing"))
+    assert attempts == ["/missing"]
+
+
+def test_restart_skips_checkpointed_urls(tmp_path):
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(200, text="fresh")
+
+    urls = [f"https://hotels.test/{i}" for i in range(4)]
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.jsonl"))
+    first = crawler(handler, checkpoint=checkpoint)
+    asyncio.run(first.crawl(urls[:2]))
+    # A crash while writing the third record leaves a partial last line
+    with open(checkpoint.path, "a") as f:
+        f.write('{"url": "https://hotels.test/2", "da')
+
+    requested.clear()
+    restarted = crawler(handler, checkpoint=checkpoint)
+    pages = asyncio.run(restarted.crawl(urls))
+    assert sorted(requested) == urls[2:]
+    assert restarted.stats["skipped"] == 2
+    assert set(pages) == set(urls)
+    assert set(Checkpoint(checkpoint.path).load()) == set(urls)
+
+
+def test_recrawl_change_feed(monkeypatch):
+    pages = {
+        "/unmodified": hotel_page("unmodified", "Same as before"),
+        "/same": hotel_page("same", "Served again unchanged"),
+        "/changed": hotel_page("changed", "New description"),
+        "/new": hotel_page("new", "Just opened"),
+    }
+    requests = {}
+
+    def handler(request):
+        requests[request.url.path] = request.headers
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, text=pages[request.url.path], headers={"ETag": '"v2"'})
+
+    monkeypatch.setattr(hotels_scraper, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    def previous(name, description):
+        return {"basic_data": {"name": name, "url": f"https://hotels.test/{name}"}, "description": description}
+
+    previous_hotels = [previous("unmodified", "Same as before"), previous("same", "Served again unchanged"),
+                       previous("changed", "Old description"), previous("closed", "Gone")]
+    state = {
+        "https://hotels.test/unmodified": {"etag": '"v1"', "last_modified": None, "hash": "h1",
+                                           "key": "https://hotels.test/unmodified"},
+        "https://hotels.test/same": {"etag": None, "last_modified": None, "hash": content_hash(pages["/same"].encode()),
+                                     "key": "https://hotels.test/same"},
+        "https://hotels.test/changed": {"etag": None, "last_modified": None, "hash": "old",
+                                        "key": "https://hotels.test/changed"},
+        "https://hotels.test/closed": {"etag": None, "last_modified": None, "hash": "h4",
+                                       "key": "https://hotels.test/closed"},
+    }
+    urls = ["https://hotels.test/unmodified", "https://hotels.test/same", "https://hotels.test/changed",
+            "https://hotels.test/new"]
+    hotels, changes, new_state = asyncio.run(
+        hotels_scraper.recrawl_hotels(urls, previous_hotels, state, rate=1000.0, burst=1000.0))
+
+    assert requests["/unmodified"]["If-None-Match"] == '"v1"'
+    # Unchanged pages reuse the previous data, by object
+    assert hotels[0] is previous_hotels[0]
+    assert hotels[1] is previous_hotels[1]
+    assert hotels[2]["description"] == "New description"
+    assert hotels[3]["basic_data"]["name"] == "new"
+    assert [(change["op"], change["key"]) for change in changes] == [
+        ("updated", "https://hotels.test/changed"),
+        ("added", "https://hotels.test/new"),
+        ("removed", "https://hotels.test/closed"),
+    ]
+    assert changes[0]["data"] is hotels[2]
+    assert new_state["https://hotels.test/unmodified"]["hash"] == "h1"
+    assert new_state["https://hotels.test/changed"]["etag"] == '"v2"'
+    assert "https://hotels.test/closed" not in new_state
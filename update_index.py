@@ -0,0 +1,36 @@
+import argparse
+
+from crawler import read_change_feed
+from searchengine import IndexWriter
+from preprocessing import read_hotels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add, replace or delete hotels in a segmented index directory")
+    parser.add_argument("input", nargs="?", help="Scraped hotels to add or replace, JSON array or JSONL")
+    parser.add_argument("--index-dir", default="index", help="Index directory, created if needed")
+    parser.add_argument("--delete", nargs="*", default=[], help="Keys (TripAdvisor URLs) of hotels to delete")
+    parser.add_argument("--changes", help="Change feed of a crawl (hotel_changes.jsonl) to apply")
+    parser.add_argument("--force-merge", action="store_true", help="Merge all the segments into one")
+    args = parser.parse_args()
+
+    writer = IndexWriter(args.index_dir, background_merge=False)
+    try:
+        # Hotels already in the index are replaced by their new version
+        if args.input:
+            writer.add_documents(read_hotels(args.input))
+        if args.changes:
+            # Only the hotels that changed since the previous crawl are processed, in feed order
+            for change in read_change_feed(args.changes):
+                if change["op"] == "removed":
+                    writer.delete_documents([change["key"]])
+                else:
+                    writer.add_documents([change["data"]])
+        writer.delete_documents(args.delete)
+        generation = writer.force_merge() if args.force_merge else writer.commit()
+    finally:
+        writer.close()
+    print(f"Index {args.index_dir} updated to generation {generation}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""
+WSGI entry point for production serving, for example with gunicorn and gunicorn.conf.py:
+    gunicorn -c gunicorn.conf.py wsgi:application
+Each worker process memory-maps the same binary index, whose pages are shared through the page
+cache, and runs searches on its own bounded scoring executor (see server.py for its settings).
+"""
+from server import app as application